@@ -0,0 +1,55 @@
+from admission import search_admission
+from diagnostics import loop_monitor
+from postprocess import postprocess_pool
+from prefetch import prefetcher
+from text import (
+    ADMISSION_STATS_TEXT,
+    LOOP_LAG_STATS_TEXT,
+    PREFETCH_STATS_TEXT,
+    POSTPROCESS_STATS_TEXT,
+)
+
+
+def get_admin_stats_text() -> str:
+    """Runtime stats of the background machinery, appended to /stats for the admin."""
+    stats = search_admission.stats
+    text = ADMISSION_STATS_TEXT.format(
+        running=search_admission.running,
+        max_concurrent=search_admission.max_concurrent,
+        admitted=stats.admitted,
+        cached=stats.cached,
+        rate_limited=stats.rate_limited,
+        overloaded=stats.overloaded,
+        late=stats.late,
+        degraded=stats.degraded,
+        shed=stats.shed,
+    )
+    text += POSTPROCESS_STATS_TEXT.format(
+        workers=postprocess_pool.workers,
+        running=postprocess_pool.running,
+        queued=postprocess_pool.queue_depth,
+        completed=postprocess_pool.completed,
+        failed=postprocess_pool.failed,
+    )
+
+    if prefetcher:
+        text += PREFETCH_STATS_TEXT.format(
+            started=prefetcher.stats.started,
+            hits=prefetcher.stats.hits,
+            hit_rate=prefetcher.stats.hit_rate,
+            expired=prefetcher.stats.expired,
+            failed=prefetcher.stats.failed,
+            skipped=prefetcher.stats.skipped,
+            wasted_mb=prefetcher.stats.wasted_bytes / (1024 * 1024),
+        )
+
+    if loop_monitor:
+        text += LOOP_LAG_STATS_TEXT.format(
+            p50_ms=loop_monitor.stats.percentile(0.5) * 1000,
+            p99_ms=loop_monitor.stats.percentile(0.99) * 1000,
+            max_ms=loop_monitor.stats.max_lag * 1000,
+            threshold=loop_monitor.threshold,
+            blocks=loop_monitor.stats.blocks,
+        )
+
+    return text
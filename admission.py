@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from loguru import logger
+
+from config import (
+    LENGTH_LIMIT,
+    SEARCH_LIMIT,
+    SEARCH_MAX_CONCURRENT,
+    SEARCH_QUEUE_TIMEOUT,
+    SEARCH_USER_RATE,
+    SEARCH_USER_BURST,
+    SEARCH_ANSWER_DEADLINE,
+)
+from database import search_catalogue
+from negative_cache import filter_known_bad
+from yt_utils import cached_search_page, search_page
+
+
+class Overloaded(Exception):
+    """No capacity for a search and nothing cached to answer it with."""
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    cached: int = 0
+    rate_limited: int = 0
+    overloaded: int = 0
+    degraded: int = 0
+    shed: int = 0
+    # admitted searches that were still running at the answer deadline
+    late: int = 0
+
+
+class SearchAdmission:
+    """
+    Decides which inline queries may start a YouTube extraction. Pages that
+    are already cached are always answered; new extractions need a token
+    from the user's bucket and one of max_concurrent slots. Queries that
+    get neither are answered from stale cached results or the local
+    catalogue, or rejected with Overloaded when there is nothing to show.
+    An admitted extraction that isn't done by the answer deadline is
+    answered the same way, with what it found so far, and keeps running to
+    fill the cache for the next query.
+
+    Args:
+        max_concurrent: Extractions running at once
+        queue_timeout: Seconds a query may wait for a free slot
+        user_rate: Extractions a user may start per second, on average
+        user_burst: Extractions a user may start at once
+        max_users: Token buckets kept, least recently seen users are forgotten
+        deadline: Seconds from a query's arrival to its answer (0 waits for the search)
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        queue_timeout: float,
+        user_rate: float,
+        user_burst: int,
+        max_users: int = 10000,
+        deadline: float = 0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_users = max_users
+        self.deadline = deadline
+        self.running = 0
+        self.stats = AdmissionStats()
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._buckets: OrderedDict[int, TokenBucket] = OrderedDict()
+        # searches that outlived their answer deadline
+        self._background: set[asyncio.Task] = set()
+
+    def _take_token(self, user_id: int | None) -> bool:
+        if user_id is None or self.user_rate <= 0:
+            return True
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = TokenBucket(self.user_rate, self.user_burst)
+            self._buckets[user_id] = bucket
+            while len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+        return bucket.take()
+
+    async def search(
+        self, query: str, offset: int = 0, user_id: int | None = None
+    ) -> tuple[list, str, bool]:
+        """
+        Return a page of results, the next offset and whether the page is a
+        degraded answer that shouldn't be cached for long.
+        """
+        started = time.monotonic()
+        cached = cached_search_page(query, offset)
+        if cached is not None:
+            self.stats.cached += 1
+            return *cached, False
+
+        if not self._take_token(user_id):
+            self.stats.rate_limited += 1
+            return await self._degrade(query, offset)
+
+        queue_timeout = self.queue_timeout
+        if self.deadline > 0:
+            queue_timeout = min(queue_timeout, self.deadline)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats.overloaded += 1
+            return await self._degrade(query, offset)
+
+        self.stats.admitted += 1
+        self.running += 1
+        task = asyncio.create_task(self._search(query, offset))
+        if self.deadline <= 0:
+            results, next_offset = await task
+            return results, next_offset, False
+
+        remaining = self.deadline - (time.monotonic() - started)
+        try:
+            # the search isn't cancelled with the wait, it goes on in the background
+            results, next_offset = await asyncio.wait_for(asyncio.shield(task), max(remaining, 0))
+        except asyncio.TimeoutError:
+            self.stats.late += 1
+            self._keep(task)
+            logger.info(f"Inline query {query!r} at offset {offset} missed its deadline")
+            return await self._degrade(query, offset)
+        except asyncio.CancelledError:
+            self._keep(task)
+            raise
+        return results, next_offset, False
+
+    async def _search(self, query: str, offset: int) -> tuple[list, str]:
+        try:
+            return await search_page(query, offset)
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    def _keep(self, task: asyncio.Task):
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background search failed: {task.exception()!r}")
+
+    async def _degrade(self, query: str, offset: int) -> tuple[list, str, bool]:
+        stale = cached_search_page(query, offset, allow_stale=True)
+        if stale is not None:
+            self.stats.degraded += 1
+            return *stale, True
+
+        if offset == 0:
+            try:
+                results = await filter_known_bad(
+                    await search_catalogue(query, SEARCH_LIMIT, LENGTH_LIMIT * 60)
+                )
+            except Exception as e:
+                logger.error(f"Catalogue search failed: {str(e)}")
+                results = []
+            if results:
+                self.stats.degraded += 1
+                return results, "", True
+
+        self.stats.shed += 1
+        logger.info(f"Shed inline query {query!r} at offset {offset}")
+        raise Overloaded(query)
+
+
+search_admission = SearchAdmission(
+    max_concurrent=SEARCH_MAX_CONCURRENT,
+    queue_timeout=SEARCH_QUEUE_TIMEOUT,
+    user_rate=SEARCH_USER_RATE,
+    user_burst=SEARCH_USER_BURST,
+    deadline=SEARCH_ANSWER_DEADLINE,
+)
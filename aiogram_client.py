@@ -1,6 +1,28 @@
-from config import BOT_TOKEN
+import os
+
+from config import BOT_TOKEN, BOT_API_URL, BOT_API_LOCAL, BOT_API_LOCAL_ROOT
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+
+def local_file_uri(path: str, root: str = BOT_API_LOCAL_ROOT) -> str:
+    """
+    file:// reference a local mode Bot API server reads straight from disk,
+    so the file isn't streamed through HTTP. root replaces the bot's working
+    directory when the server has it mounted at another path.
+    """
+    path = os.path.abspath(path)
+    if root:
+        path = os.path.join(root, os.path.relpath(path))
+    return f"file://{path}"
+
 
+session = None
+if BOT_API_URL:
+    session = AiohttpSession(
+        api=TelegramAPIServer.from_base(BOT_API_URL, is_local=BOT_API_LOCAL)
+    )
 
-aiogram_bot = Bot(token=BOT_TOKEN)
+aiogram_bot = Bot(token=BOT_TOKEN, session=session)
 aiogram_dp = Dispatcher()
@@ -1,7 +1,6 @@
-from aiogram_client import aiogram_bot, aiogram_dp
+from aiogram_client import aiogram_bot, aiogram_dp, local_file_uri
 import os
 import random
-import re
 from aiogram.filters import Command, CommandStart
 from aiogram import F
 from aiogram.types import (
@@ -15,17 +14,38 @@ from aiogram.types import (
     InlineKeyboardMarkup,
     ChosenInlineResult,
     InputMediaAudio,
+    BufferedInputFile,
 )
 from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
-from yt_utils import search, download
+from admission import search_admission, Overloaded
+from jobs import download_audio
 from loguru import logger
-from config import queued, CHAT_ID
-from const import REMIX_KEYWORDS
+from config import queued, CHAT_ID, ADMIN_ID, BOT_API_LOCAL
+from const import DEGRADED_CACHE_TIME
 from utils import download_and_crop_thumbnail, safe_filename
-from database import add_file, get_file, add_use, get_user_ids, get_stats
-from text import STATS_TEXT
+from database import (
+    get_file,
+    add_use,
+    get_user_ids,
+    get_stats,
+    set_file_id,
+    set_downloaded,
+)
+from text import (
+    STATS_TEXT,
+    PROFILE_USAGE_TEXT,
+    PROFILE_DISABLED_TEXT,
+    PROFILE_BUSY_TEXT,
+    PROFILE_STARTED_TEXT,
+)
 import asyncio
-from audio_manager import cleanup_audio_folder
+import time
+from audio_manager import cleanup_audio_folder, cleanup_storage
+from prefetch import prefetcher
+from admin_stats import get_admin_stats_text
+from diagnostics import profiler
+from storage import fetch_audio
+from upload_source import MappedInputFile
 
 
 @aiogram_dp.message(CommandStart())
@@ -42,7 +62,29 @@ async def start(message: Message):
 @aiogram_dp.inline_query()
 async def inline_query_handler(query: InlineQuery, *args, **kwargs):
     # user = await get_user(query.from_user.id)
-    results = await search(query.query)
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    try:
+        results, next_offset, degraded = await search_admission.search(
+            query.query, offset, query.from_user.id
+        )
+    except Overloaded:
+        busy = [
+            InlineQueryResultArticle(
+                id=str(random.randint(10000, 99999)),
+                title="Busy, try again in a moment",
+                input_message_content=InputTextMessageContent(
+                    message_text="The bot is busy right now, please try again in a moment."
+                ),
+            )
+        ]
+        return await query.answer(
+            results=busy if offset == 0 else [], cache_time=0, is_personal=True
+        )
+
+    if not results and offset > 0:
+        return await query.answer(
+            results=[], cache_time=86400, is_personal=False, next_offset=""
+        )
 
     if not results:
         return await query.answer(
@@ -61,14 +103,8 @@ async def inline_query_handler(query: InlineQuery, *args, **kwargs):
 
     inline_results = []
     for result in results:
+        # rows were stored when the results were found, see yt_utils.search_page
         logger.info(result["id"])
-        await add_file(
-            result["id"],
-            result["title"],
-            result["uploader"],
-            result["thumbnail"],
-            result["duration"],
-        )
         inline_results.append(
             InlineQueryResultArticle(
                 id=result["id"],
@@ -101,12 +137,68 @@ async def inline_query_handler(query: InlineQuery, *args, **kwargs):
 
     logger.info(results)
 
-    results = await query.answer(
-        results=inline_results, cache_time=86400, is_personal=False
+    await query.answer(
+        results=inline_results,
+        cache_time=DEGRADED_CACHE_TIME if degraded else 86400,
+        is_personal=False,
+        next_offset=next_offset,
     )
+    if prefetcher and offset == 0 and not degraded:
+        prefetcher.schedule(results)
     return None
 
 
+def result_markup(video_id: str, username: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text="YouTube",
+                    url=f"https://www.youtube.com/watch?v={video_id}",
+                )
+            ],
+            [InlineKeyboardButton(text=f"@{username}", url=f"https://t.me/{username}")],
+        ]
+    )
+
+
+async def upload_audio(
+    video_id: str,
+    filename: str,
+    thumb: str | None,
+    title: str,
+    performer: str,
+) -> str:
+    # Bot API can only put uploaded files into inline messages by file_id,
+    # so the audio goes through CHAT_ID first and the file_id is kept for reuse.
+    # A local Bot API server reads the file itself, named after the file on disk
+    file_path = await fetch_audio(video_id)
+    if BOT_API_LOCAL:
+        audio = local_file_uri(file_path)
+    else:
+        audio = MappedInputFile(file_path, filename)
+    sent_message = await aiogram_bot.send_audio(
+        chat_id=CHAT_ID,
+        audio=audio,
+        thumbnail=FSInputFile(thumb) if thumb is not None else None,
+        title=title,
+        performer=performer,
+    )
+    file_id = sent_message.audio.file_id
+    await aiogram_bot.delete_message(
+        chat_id=CHAT_ID, message_id=sent_message.message_id
+    )
+    await set_file_id(video_id, file_id)
+    return file_id
+
+
+async def warmup_upload(video_id: str, file: dict) -> str:
+    performer, title = file["performer"], file["track"]
+    filename = f"{safe_filename(file['title'])}_{video_id}.mp3"
+    thumb = await download_and_crop_thumbnail(file["thumbnail"], video_id)
+    return await upload_audio(video_id, filename, thumb, title, performer)
+
+
 @aiogram_dp.chosen_inline_result()
 async def chosen_inline_result_handler(inline_result: ChosenInlineResult):
     logger.info("chosen inline result")
@@ -123,62 +215,58 @@ async def chosen_inline_result_handler(inline_result: ChosenInlineResult):
 
     file = await get_file(inline_result.result_id)
     logger.info(inline_result.result_id)
-    file_path = f"audio/{inline_result.result_id}.mp3"
     filename = f"{safe_filename(file['title'])}_{inline_result.result_id}.mp3"
     logger.info(f"filename: {filename}")
     logger.info(file)
 
-    performer = file["uploader"]
-    title = file["title"]
+    performer, title = file["performer"], file["track"]
 
-    for kw in REMIX_KEYWORDS:
-        if kw in title.lower():
-            break
-    else:
-        for sep in (" — ", " - "):
-            # maybe_uploader = title.split(sep, 1)[1]
-            # if ', ' in maybe_uploader or uploader.lower() in maybe_uploader.lower():
-            #     uploader = title.split(sep, 1)[0]
-            #     title = title.split(sep, 1)[1]
-            if sep not in title:
-                continue
-            if performer in title.split(sep, 1)[1]:
-                continue
-            performer = title.split(sep, 1)[0]
-            title = title.split(sep, 1)[1]
-
-    # chars_to_strip = len(performer) + 3
-    # if title.lower().startswith(f'{performer.lower()} - '):
-    #     title = title[chars_to_strip:]
-    # elif title.lower().endswith(f'{performer.lower()} - '):
-    #     title = title[:len(title) - chars_to_strip]
-
-    title = re.sub(r"\s*\(\d{4}\)\s*$", "", title).strip()
-    title = re.sub(r",\s*\d{4}\s*$", "", title).strip()
-
-    if performer.endswith("- Topic"):
-        performer = performer.removesuffix(" - Topic")
+    if file["file_id"]:
+        logger.info("File already uploaded")
+        try:
+            await aiogram_bot.edit_message_media(
+                media=InputMediaAudio(
+                    media=file["file_id"],
+                    title=title,
+                    performer=performer,
+                    filename=filename,
+                ),
+                inline_message_id=inline_result.inline_message_id,
+                reply_markup=result_markup(inline_result.result_id, me.username),
+            )
+        except TelegramAPIError as e:
+            logger.info(f"Cached file_id rejected: {str(e)}")
+            await set_file_id(inline_result.result_id, None)
+        else:
+            queued.remove(inline_result.from_user.id)
+            await add_use(inline_result.result_id, inline_result.from_user.id)
+            logger.info("done")
+            return
 
     logger.info("get thumbnail")
     thumb = await download_and_crop_thumbnail(
         file["thumbnail"], inline_result.result_id
     )
 
-    if os.path.exists(file_path):
+    prefetched = prefetcher is not None and await prefetcher.claim(
+        inline_result.result_id
+    )
+
+    # only finished files are ever published, so the flag is enough to decide
+    cached_file_id = None
+    if file["downloaded"] or prefetched:
         logger.info("File already exists")
         logger.info("send audio")
-        sent_message = await aiogram_bot.send_audio(
-            chat_id=CHAT_ID,
-            audio=FSInputFile(file_path, filename),
-            thumbnail=FSInputFile(thumb) if thumb is not None else None,
-            title=title,
-            performer=performer,
-        )
-        logger.info("delete message")
-        file_id = sent_message.audio.file_id
-        await aiogram_bot.delete_message(
-            chat_id=CHAT_ID, message_id=sent_message.message_id
-        )
+        try:
+            cached_file_id = await upload_audio(
+                inline_result.result_id, filename, thumb, title, performer
+            )
+        except FileNotFoundError:
+            logger.info("File was evicted")
+            await set_downloaded(inline_result.result_id, 0)
+
+    if cached_file_id:
+        file_id = cached_file_id
         logger.info("edit message")
         await aiogram_bot.edit_message_media(
             media=InputMediaAudio(
@@ -189,21 +277,7 @@ async def chosen_inline_result_handler(inline_result: ChosenInlineResult):
                 filename=filename,
             ),
             inline_message_id=inline_result.inline_message_id,
-            reply_markup=InlineKeyboardMarkup(
-                inline_keyboard=[
-                    [
-                        InlineKeyboardButton(
-                            text="YouTube",
-                            url=f"https://www.youtube.com/watch?v={inline_result.result_id}",
-                        )
-                    ],
-                    [
-                        InlineKeyboardButton(
-                            text=f"@{me.username}", url=f"https://t.me/{me.username}"
-                        )
-                    ],
-                ]
-            ),
+            reply_markup=result_markup(inline_result.result_id, me.username),
         )
         queued.remove(inline_result.from_user.id)
         logger.info("add use")
@@ -212,12 +286,10 @@ async def chosen_inline_result_handler(inline_result: ChosenInlineResult):
         return
 
     # info_dict = await download(f'https://www.youtube.com/watch?v={inline_result.result_id}', progress_callback=default_progress_callback, complete_callback=default_complete_callback, error_callback=default_error_callback)
-    info_dict = await download(
-        f"https://www.youtube.com/watch?v={inline_result.result_id}"
-    )
+    info_dict = await download_audio(inline_result.result_id)
     queued.remove(inline_result.from_user.id)
 
-    if not info_dict or not os.path.exists(file_path):
+    if not info_dict:
         logger.info(f"info dict: {info_dict}")
         await aiogram_bot.edit_message_text(
             text="Failed to download the audio.",
@@ -225,17 +297,19 @@ async def chosen_inline_result_handler(inline_result: ChosenInlineResult):
         )
         return
 
-    sent_message = await aiogram_bot.send_audio(
-        chat_id=CHAT_ID,
-        audio=FSInputFile(file_path, filename),
-        thumbnail=FSInputFile(thumb) if thumb is not None else None,
-        title=title,
-        performer=performer,
-    )
-    file_id = sent_message.audio.file_id
-    await aiogram_bot.delete_message(
-        chat_id=CHAT_ID, message_id=sent_message.message_id
-    )
+    try:
+        file_id = await upload_audio(
+            inline_result.result_id, filename, thumb, title, performer
+        )
+    except FileNotFoundError:
+        # evicted between the download and the upload
+        logger.info("File was evicted")
+        await set_downloaded(inline_result.result_id, 0)
+        await aiogram_bot.edit_message_text(
+            text="Failed to download the audio.",
+            inline_message_id=inline_result.inline_message_id,
+        )
+        return
 
     media = InputMediaAudio(
         media=file_id,
@@ -248,21 +322,7 @@ async def chosen_inline_result_handler(inline_result: ChosenInlineResult):
     await aiogram_bot.edit_message_media(
         media=media,
         inline_message_id=inline_result.inline_message_id,
-        reply_markup=InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    InlineKeyboardButton(
-                        text="YouTube",
-                        url=f"https://www.youtube.com/watch?v={inline_result.result_id}",
-                    )
-                ],
-                [
-                    InlineKeyboardButton(
-                        text=f"@{me.username}", url=f"https://t.me/{me.username}"
-                    )
-                ],
-            ]
-        ),
+        reply_markup=result_markup(inline_result.result_id, me.username),
     )
     await add_use(inline_result.result_id, inline_result.from_user.id)
     logger.info("File downloaded")
@@ -272,6 +332,7 @@ async def chosen_inline_result_handler(inline_result: ChosenInlineResult):
         deleted_files = cleanup_audio_folder()
         if deleted_files:
             logger.info(f"Cleaned up audio folder, deleted {len(deleted_files)} files")
+        await cleanup_storage()
     except Exception as e:
         logger.error(f"Error during audio folder cleanup: {str(e)}")
 
@@ -296,12 +357,37 @@ async def mail(message: Message):
 @aiogram_dp.message(Command("stats"))
 async def stats_handler(message: Message):
     stats = await get_stats(message.from_user.id)
-    await message.answer(
-        STATS_TEXT.format(
-            users=stats.users_count,
-            cached=stats.cached_files,
-            sent_user=stats.sent_videos_user,
-            sent_total=stats.sent_videos_total,
-            downloaded=stats.downloaded,
-        )
+    text = STATS_TEXT.format(
+        users=stats.users_count,
+        cached=stats.cached_files,
+        sent_user=stats.sent_videos_user,
+        sent_total=stats.sent_videos_total,
+        downloaded=stats.downloaded,
+    )
+    if message.from_user.id == ADMIN_ID:
+        text += get_admin_stats_text()
+    await message.answer(text)
+
+
+@aiogram_dp.message(Command("profile"))
+async def profile_handler(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    if profiler is None:
+        await message.answer(PROFILE_DISABLED_TEXT)
+        return
+    try:
+        kind, seconds = profiler.parse_args(message.text)
+    except ValueError as e:
+        await message.answer(PROFILE_USAGE_TEXT.format(error=str(e)))
+        return
+    if profiler.busy:
+        await message.answer(PROFILE_BUSY_TEXT)
+        return
+
+    await message.answer(PROFILE_STARTED_TEXT.format(kind=kind, seconds=seconds))
+    summary, report = await profiler.run(kind, seconds)
+    await message.answer_document(
+        BufferedInputFile(report.encode(), filename=f"profile_{kind}_{int(time.time())}.txt"),
+        caption=summary,
     )
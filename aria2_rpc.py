@@ -0,0 +1,307 @@
+import asyncio
+import hashlib
+import itertools
+import os
+import queue
+from dataclasses import dataclass
+from typing import Callable
+
+import aiohttp
+import yt_dlp
+from loguru import logger
+
+from config import (
+    BOT_TOKEN,
+    ARIA2_RPC,
+    ARIA2_RPC_URL,
+    ARIA2_RPC_PORT,
+    ARIA2_RPC_SECRET,
+    ARIA2_MAX_CONCURRENT_DOWNLOADS,
+    ARIA2_MAX_CONNECTIONS_PER_SERVER,
+    ARIA2_SPLIT,
+    ARIA2_MIN_SPLIT_SIZE,
+    ARIA2_MAX_DOWNLOAD_LIMIT,
+    ARIA2_POLL_INTERVAL,
+)
+
+STATUS_KEYS = ["gid", "status", "totalLength", "completedLength", "downloadSpeed", "errorMessage"]
+
+
+class Aria2Error(Exception):
+    """aria2 rejected a call or a download failed."""
+
+
+@dataclass
+class Aria2Download:
+    gid: str
+    # called from the event loop with every polled status, the last one is final
+    notify: Callable[[dict], None]
+
+
+class Aria2Daemon:
+    """
+    One long-running aria2c that takes downloads over JSON-RPC, so no process
+    is spawned per track and the bandwidth limit covers all downloads at
+    once. Unless url is given, aria2c is started here; processes of the same
+    bot share it when it's already listening. A single task polls the status
+    of this process's downloads and passes it on.
+
+    Args:
+        url: JSON-RPC endpoint of an aria2c started elsewhere, on the same filesystem
+        port: Port of the aria2c started here
+        secret: RPC token
+        global_options: aria2c options for the whole daemon
+        download_options: aria2 options of every download
+        poll_interval: Seconds between status polls
+    """
+
+    def __init__(
+        self,
+        url: str,
+        port: int,
+        secret: str,
+        global_options: dict,
+        download_options: dict,
+        poll_interval: float,
+    ):
+        self.external = bool(url)
+        self.url = url or f"http://127.0.0.1:{port}/jsonrpc"
+        self.port = port
+        self.secret = secret
+        self.global_options = global_options
+        self.download_options = download_options
+        self.poll_interval = poll_interval
+        self.available = False
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self._process: asyncio.subprocess.Process | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._downloads: dict[str, Aria2Download] = {}
+        self._tracker: asyncio.Task | None = None
+        self._start_lock: asyncio.Lock | None = None
+        self._ids = itertools.count()
+
+    async def call(self, method: str, *params):
+        if self._session is None:
+            self._session = aiohttp.ClientSession()
+        payload = {
+            "jsonrpc": "2.0",
+            "id": str(next(self._ids)),
+            "method": f"aria2.{method}",
+            "params": [f"token:{self.secret}", *params],
+        }
+        async with self._session.post(self.url, json=payload) as response:
+            body = await response.json(content_type=None)
+        if "error" in body:
+            raise Aria2Error(f"{method}: {body['error'].get('message')}")
+        return body["result"]
+
+    async def _responding(self) -> bool:
+        try:
+            await self.call("getVersion")
+            return True
+        except (aiohttp.ClientError, Aria2Error):
+            return False
+
+    async def start(self) -> bool:
+        """Make sure aria2c is up, starting it if needed. False if it can't be reached."""
+        self.loop = asyncio.get_running_loop()
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+
+        async with self._start_lock:
+            if self._tracker is None or self._tracker.done():
+                self._tracker = asyncio.create_task(self._track())
+            if self._process is not None and self._process.returncode is None:
+                return True
+            self.available = await self._responding() or await self._spawn()
+            return self.available
+
+    async def _spawn(self) -> bool:
+        if self.external:
+            logger.error(f"aria2 isn't answering at {self.url}")
+            return False
+
+        args = [
+            "aria2c",
+            "--enable-rpc",
+            f"--rpc-listen-port={self.port}",
+            f"--rpc-secret={self.secret}",
+            # the daemon goes away with the process that started it
+            f"--stop-with-process={os.getpid()}",
+            "--continue=true",
+            "--auto-file-renaming=false",
+            "--allow-overwrite=true",
+            "--quiet=true",
+            *(f"--{name}={value}" for name, value in self.global_options.items()),
+        ]
+        try:
+            self._process = await asyncio.create_subprocess_exec(
+                *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError as e:
+            logger.error(f"Can't start aria2c: {str(e)}")
+            return False
+
+        for _ in range(50):
+            # another process of the bot may have bound the port first, that one is used then
+            if await self._responding():
+                logger.info(f"aria2 RPC listening on port {self.port}")
+                return True
+            if self._process.returncode is not None:
+                break
+            await asyncio.sleep(0.1)
+        logger.error("aria2c didn't start")
+        return False
+
+    async def add(self, uri: str, directory: str, out: str, headers: dict, notify: Callable[[dict], None]) -> str:
+        options = {**self.download_options, "dir": directory, "out": out}
+        if headers:
+            options["header"] = [f"{name}: {value}" for name, value in headers.items()]
+        gid = await self.call("addUri", [uri], options)
+        self._downloads[gid] = Aria2Download(gid, notify)
+        return gid
+
+    async def remove(self, gid: str):
+        self._downloads.pop(gid, None)
+        try:
+            await self.call("forceRemove", gid)
+        except (aiohttp.ClientError, Aria2Error):
+            pass
+
+    async def _track(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            downloads = list(self._downloads.values())
+            if not downloads:
+                continue
+
+            statuses = await asyncio.gather(
+                *(self.call("tellStatus", download.gid, STATUS_KEYS) for download in downloads),
+                return_exceptions=True,
+            )
+            for download, status in zip(downloads, statuses):
+                if download.gid not in self._downloads:
+                    continue
+                if isinstance(status, Exception):
+                    # the download is gone, e.g. aria2c was restarted
+                    if isinstance(status, Aria2Error):
+                        status = {"gid": download.gid, "status": "error", "errorMessage": str(status)}
+                    else:
+                        logger.error(f"aria2 status poll failed: {str(status)}")
+                        continue
+
+                download.notify(status)
+                if status["status"] in ("complete", "error", "removed"):
+                    del self._downloads[download.gid]
+                    try:
+                        await self.call("removeDownloadResult", download.gid)
+                    except (aiohttp.ClientError, Aria2Error):
+                        pass
+
+    def download_sync(self, filename: str, url: str, headers: dict, progress_hooks: list, info: dict) -> bool:
+        """
+        Download url to filename from a worker thread. Progress hooks are
+        called in that thread with yt-dlp style statuses and may raise to
+        abort the download.
+        """
+        if os.path.exists(filename):
+            return True
+
+        temp_filename = f"{filename}.part"
+        updates = queue.SimpleQueue()
+        gid = asyncio.run_coroutine_threadsafe(
+            self.add(
+                url,
+                os.path.abspath(os.path.dirname(filename)),
+                os.path.basename(temp_filename),
+                headers,
+                updates.put,
+            ),
+            self.loop,
+        ).result()
+
+        try:
+            while True:
+                try:
+                    status = updates.get(timeout=max(30.0, self.poll_interval * 10))
+                except queue.Empty:
+                    raise Aria2Error(f"No status of {filename} from aria2") from None
+                progress = {
+                    "status": "downloading",
+                    "filename": filename,
+                    "tmpfilename": temp_filename,
+                    "downloaded_bytes": int(status.get("completedLength", 0)),
+                    "total_bytes": int(status.get("totalLength", 0)) or None,
+                    "speed": int(status.get("downloadSpeed", 0)),
+                    "info_dict": info,
+                }
+                if status["status"] in ("error", "removed"):
+                    raise Aria2Error(f"Download of {filename} failed: {status.get('errorMessage')}")
+                if status["status"] == "complete":
+                    break
+                for hook in progress_hooks:
+                    hook(progress)
+        except BaseException:
+            asyncio.run_coroutine_threadsafe(self.remove(gid), self.loop).result()
+            raise
+
+        os.replace(temp_filename, filename)
+        progress.update(status="finished", downloaded_bytes=os.path.getsize(filename))
+        progress["total_bytes"] = progress["downloaded_bytes"]
+        for hook in progress_hooks:
+            hook(progress)
+        return True
+
+    async def close(self):
+        if self._tracker is not None:
+            self._tracker.cancel()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._process is not None and self._process.returncode is None:
+            self._process.terminate()
+            await self._process.wait()
+
+
+class Aria2YoutubeDL(yt_dlp.YoutubeDL):
+    """Hands plain HTTP media downloads to the aria2 daemon, anything else stays with yt-dlp."""
+
+    def __init__(self, params: dict | None = None, auto_init: bool = True, daemon: Aria2Daemon | None = None):
+        super().__init__(params, auto_init)
+        self.daemon = daemon
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if (
+            test
+            or subtitle
+            or name == "-"
+            or info.get("protocol") not in ("http", "https")
+            or not info.get("url")
+        ):
+            return super().dl(name, info, subtitle, test)
+
+        headers = info.get("http_headers") or self._calc_headers(info)
+        success = self.daemon.download_sync(name, info["url"], headers, self._progress_hooks, info)
+        return success, True
+
+
+aria2_daemon: Aria2Daemon | None = None
+if ARIA2_RPC:
+    aria2_daemon = Aria2Daemon(
+        url=ARIA2_RPC_URL,
+        port=ARIA2_RPC_PORT,
+        # the same for every process of the bot, so they can share one daemon
+        secret=ARIA2_RPC_SECRET or hashlib.sha256(f"aria2:{BOT_TOKEN}".encode()).hexdigest()[:32],
+        global_options={
+            "max-concurrent-downloads": ARIA2_MAX_CONCURRENT_DOWNLOADS,
+            "max-overall-download-limit": ARIA2_MAX_DOWNLOAD_LIMIT,
+            "max-download-result": 1000,
+        },
+        download_options={
+            "max-connection-per-server": str(ARIA2_MAX_CONNECTIONS_PER_SERVER),
+            "split": str(ARIA2_SPLIT),
+            "min-split-size": ARIA2_MIN_SPLIT_SIZE,
+            "continue": "true",
+        },
+        poll_interval=ARIA2_POLL_INTERVAL,
+    )
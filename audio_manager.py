@@ -2,42 +2,75 @@ import os
 import shutil
 from pathlib import Path
 from loguru import logger
-from database import get_session, File
-from sqlmodel import select
-from config import AUDIO_FOLDER_SIZE_LIMIT
+from database import get_session, File, forget_files
+from sqlmodel import select, update
+from config import (
+    AUDIO_FOLDER_SIZE_LIMIT,
+    STALE_TEMP_MAX_AGE,
+    STORAGE_CLEANUP_INTERVAL,
+    STORAGE_SIZE_LIMIT,
+)
+from paths import AUDIO_DIR, iter_files, published_video_id
+from storage import storage
 import time
 
+_last_storage_cleanup = 0.0
+
 
 def get_folder_size(folder_path: str) -> int:
     """Get the total size of a folder in bytes."""
     total_size = 0
-    for dirpath, dirnames, filenames in os.walk(folder_path):
-        for filename in filenames:
-            filepath = os.path.join(dirpath, filename)
-            if os.path.exists(filepath):
-                total_size += os.path.getsize(filepath)
+    for entry in iter_files(folder_path):
+        total_size += entry.stat().st_size
     return total_size
 
 
 def get_audio_files_info(folder_path: str) -> list:
     """Get information about all audio files in the folder."""
     files_info = []
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.mp3'):
-            filepath = os.path.join(folder_path, filename)
-            if os.path.exists(filepath):
-                stat = os.stat(filepath)
-                video_id = filename[:-4]  # Remove .mp3 extension
-                files_info.append({
-                    'filepath': filepath,
-                    'filename': filename,
-                    'video_id': video_id,
-                    'size': stat.st_size,
-                    'modified_time': stat.st_mtime
-                })
+    # Files are spread over shard subdirectories, see paths.shard_dir
+    for entry in iter_files(folder_path):
+        video_id = published_video_id(entry.name)
+        if video_id:
+            stat = entry.stat()
+            files_info.append({
+                'filepath': entry.path,
+                'filename': entry.name,
+                'video_id': video_id,
+                'size': stat.st_size,
+                'modified_time': stat.st_mtime
+            })
     return files_info
 
 
+def delete_stale_temporary_files(folder_path: str, max_age: int) -> list:
+    """
+    Delete leftovers of interrupted downloads (.part, .aria2, source audio,
+    thumbnails, info json) that haven't been touched for max_age seconds.
+    Fresher ones are kept, a retry can still resume from them.
+    """
+    deleted_files = []
+    deleted_size = 0
+    now = time.time()
+
+    for entry in iter_files(folder_path):
+        if published_video_id(entry.name) or entry.name.startswith('.'):
+            continue
+        stat = entry.stat()
+        if now - stat.st_mtime < max_age:
+            continue
+        try:
+            os.remove(entry.path)
+            deleted_size += stat.st_size
+            deleted_files.append(entry.name)
+        except Exception as e:
+            logger.error(f"Failed to delete temporary file {entry.name}: {str(e)}")
+
+    if deleted_files:
+        logger.info(f"Deleted {len(deleted_files)} stale temporary files, freed {deleted_size} bytes")
+    return deleted_files
+
+
 def get_files_usage_count(files_info: list) -> dict:
     """Get usage count for each file from the database."""
     with get_session() as session:
@@ -55,6 +88,56 @@ def get_files_usage_count(files_info: list) -> dict:
         return usage_dict
 
 
+def mark_not_downloaded(video_ids: list):
+    """Clear File.downloaded for evicted files."""
+    if not video_ids:
+        return
+    with get_session() as session:
+        statement = update(File).where(File.video_id.in_(video_ids)).values(downloaded=False)
+        session.exec(statement)
+        session.commit()
+    forget_files(video_ids)
+
+
+async def reconcile_downloaded(batch_size: int = 1000) -> int:
+    """
+    Make File.downloaded match the finished audio files actually in storage.
+    Returns the number of rows that were changed.
+    """
+    objects = await storage.list(f"{AUDIO_DIR}/")
+    on_disk = {
+        video_id
+        for video_id in (published_video_id(os.path.basename(obj.key)) for obj in objects)
+        if video_id
+    }
+
+    with get_session() as session:
+        statement = select(File.video_id).where(File.downloaded == True)  # noqa: E712
+        flagged = set(session.exec(statement).all())
+
+        missing = list(flagged - on_disk)
+        # may include objects without a row, only updated rows are counted
+        present = list(on_disk - flagged)
+        cleared = restored = 0
+        for i in range(0, len(missing), batch_size):
+            cleared += session.exec(
+                update(File)
+                .where(File.video_id.in_(missing[i:i + batch_size]))
+                .values(downloaded=False)
+            ).rowcount
+        for i in range(0, len(present), batch_size):
+            restored += session.exec(
+                update(File)
+                .where(File.video_id.in_(present[i:i + batch_size]))
+                .values(downloaded=True)
+            ).rowcount
+        session.commit()
+    forget_files(missing + present)
+
+    logger.info(f"Reconciled downloaded flags: {cleared} cleared, {restored} set")
+    return cleared + restored
+
+
 def delete_oldest_lowest_usage_files(folder_path: str, target_size: int):
     """Delete oldest files with lowest usage count until folder size is below target."""
     # Get current folder size
@@ -92,9 +175,64 @@ def delete_oldest_lowest_usage_files(folder_path: str, target_size: int):
             logger.error(f"Failed to delete file {file_info['filename']}: {str(e)}")
     
     logger.info(f"Deleted {len(deleted_files)} files, freed {deleted_size} bytes")
+    # with a shared storage the local folder is only a copy, the tracks are still stored
+    if storage.is_local_cache:
+        mark_not_downloaded([published_video_id(filename) for filename in deleted_files])
     return deleted_files
 
 
+async def cleanup_storage(max_size_mb: int = STORAGE_SIZE_LIMIT, force: bool = False) -> list:
+    """
+    Delete the oldest files with the lowest usage count from the shared storage
+    when it exceeds its limit. When the storage is the audio folder itself,
+    cleanup_audio_folder already takes care of it. Runs at most once every
+    STORAGE_CLEANUP_INTERVAL unless forced.
+    """
+    global _last_storage_cleanup
+    if storage.is_local_cache:
+        return []
+    # listing an S3 bucket takes a request per 1000 objects, too much for every track
+    if not force and time.monotonic() - _last_storage_cleanup < STORAGE_CLEANUP_INTERVAL:
+        return []
+    _last_storage_cleanup = time.monotonic()
+
+    max_size_bytes = max_size_mb * 1024 * 1024
+    objects = await storage.list(f"{AUDIO_DIR}/")
+    current_size = sum(obj.size for obj in objects)
+    logger.info(f"Storage size: {current_size / (1024 * 1024):.2f} MB (limit: {max_size_mb} MB)")
+    if current_size <= max_size_bytes:
+        return []
+
+    files_info = []
+    for obj in objects:
+        video_id = published_video_id(os.path.basename(obj.key))
+        if video_id:
+            files_info.append({
+                'key': obj.key,
+                'video_id': video_id,
+                'size': obj.size,
+                'modified_time': obj.modified_time,
+            })
+    get_files_usage_count(files_info)
+    files_info.sort(key=lambda x: (x['uses_count'], x['modified_time']))
+
+    deleted_size = 0
+    deleted_ids = []
+    for file_info in files_info:
+        if current_size - deleted_size <= max_size_bytes:
+            break
+        try:
+            await storage.delete(file_info['key'])
+            deleted_size += file_info['size']
+            deleted_ids.append(file_info['video_id'])
+        except Exception as e:
+            logger.error(f"Failed to delete {file_info['key']} from storage: {str(e)}")
+
+    logger.info(f"Deleted {len(deleted_ids)} files from storage, freed {deleted_size} bytes")
+    mark_not_downloaded(deleted_ids)
+    return deleted_ids
+
+
 def auto_delete_audio_files(max_size_mb: int = 1000):
     """
     Automatically delete oldest files with lowest usage count when folder size exceeds limit.
@@ -102,7 +240,7 @@ def auto_delete_audio_files(max_size_mb: int = 1000):
     Args:
         max_size_mb: Maximum size of audio folder in MB (default: 1000 MB)
     """
-    folder_path = "audio"
+    folder_path = AUDIO_DIR
     
     # Check if folder exists
     if not os.path.exists(folder_path):
@@ -112,6 +250,9 @@ def auto_delete_audio_files(max_size_mb: int = 1000):
     # Convert max_size to bytes
     max_size_bytes = max_size_mb * 1024 * 1024
     
+    # Leftovers of failed downloads count towards the limit too, drop them first
+    deleted_temporary = delete_stale_temporary_files(folder_path, STALE_TEMP_MAX_AGE)
+    
     # Get current folder size
     current_size = get_folder_size(folder_path)
     current_size_mb = current_size / (1024 * 1024)
@@ -125,10 +266,10 @@ def auto_delete_audio_files(max_size_mb: int = 1000):
         new_size = get_folder_size(folder_path)
         new_size_mb = new_size / (1024 * 1024)
         logger.info(f"New audio folder size: {new_size_mb:.2f} MB")
-        return deleted_files
+        return deleted_temporary + deleted_files
     else:
         logger.info("Audio folder size is within limit")
-        return []
+        return deleted_temporary
 
 
 # Function to be called periodically or when needed
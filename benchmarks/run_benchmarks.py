@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the hot paths of the bot: title normalization, search
+result shaping, audio folder accounting and eviction, and database CRUD.
+
+Every run is saved to benchmarks/results/<timestamp>.json and compared with
+the previous saved run, so regressions show up as a slower median.
+The database benchmarks use DATABASE_URL and only touch rows whose video id
+starts with "bench_".
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from loguru import logger
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import select
+
+import audio_manager
+import database
+from paths import shard_dir
+from utils import extract_performer_title, normalize_results
+from yt_utils import _shape_entry
+
+BENCHMARKS_DIR = Path(__file__).parent
+FIXTURES_DIR = BENCHMARKS_DIR / "fixtures"
+RESULTS_DIR = BENCHMARKS_DIR / "results"
+
+
+def bench(name: str, func, number: int = 1, repeat: int = 5, setup=None) -> tuple[str, dict]:
+    """Time func number times per round; setup runs before every round, untimed."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - started) / number)
+
+    result = {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+    print(f"{name:<40} {format_time(result['median']):>10} (min {format_time(result['min'])})")
+    return name, result
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def load_search_entries() -> list:
+    with open(FIXTURES_DIR / "search_entries.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def make_audio_folder(root: str, files: int, size: int = 4 * 1024 * 1024):
+    """Sharded folder of sparse mp3 files plus a few temporaries."""
+    shutil.rmtree(root, ignore_errors=True)
+    now = time.time()
+    for i in range(files):
+        video_id = f"bench_{i:07d}"
+        folder = shard_dir(root, video_id)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{video_id}.mp3")
+        with open(path, "wb") as f:
+            f.truncate(size)
+        os.utime(path, (now - i, now - i))
+        if i % 100 == 0:
+            open(os.path.join(folder, f"{video_id}.f251.webm.part"), "wb").close()
+
+
+def benchmark_normalization(repeat: int) -> list:
+    entries = load_search_entries()
+    pairs = [(entry["uploader"], entry["title"]) for entry in entries]
+
+    def run(normalize):
+        for performer, title in pairs:
+            normalize(performer, title)
+
+    return [
+        bench(f"extract_performer_title x{len(pairs)}", lambda: run(extract_performer_title), number=100, repeat=repeat),
+        bench(
+            f"extract_performer_title uncached x{len(pairs)}",
+            lambda: run(extract_performer_title.__wrapped__),
+            number=100,
+            repeat=repeat,
+        ),
+    ]
+
+
+def benchmark_search_shaping(repeat: int) -> list:
+    entries = load_search_entries()
+
+    def run():
+        seen = set()
+        results = []
+        for video_data in normalize_results([_shape_entry(entry) for entry in entries]):
+            if video_data["id"] in seen:
+                continue
+            seen.add(video_data["id"])
+            results.append(video_data)
+
+    return [bench(f"search result shaping x{len(entries)}", run, number=100, repeat=repeat)]
+
+
+def benchmark_audio_manager(files: int, repeat: int) -> list:
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        folder = os.path.join(root, "audio")
+        make_audio_folder(folder, files)
+        results.append(bench(
+            f"get_folder_size ({files} files)",
+            lambda: audio_manager.get_folder_size(folder),
+            repeat=repeat,
+        ))
+        results.append(bench(
+            f"get_audio_files_info ({files} files)",
+            lambda: audio_manager.get_audio_files_info(folder),
+            repeat=repeat,
+        ))
+
+        # evict half of the folder, rebuilt before every round
+        target = files // 2 * 4 * 1024 * 1024
+        results.append(bench(
+            f"delete_oldest_lowest_usage ({files} files)",
+            lambda: audio_manager.delete_oldest_lowest_usage_files(folder, target),
+            repeat=min(repeat, 3),
+            setup=lambda: make_audio_folder(folder, files),
+        ))
+    return results
+
+
+def benchmark_database(repeat: int) -> list:
+    loop = asyncio.new_event_loop()
+    database.create_db_and_tables()
+    counter = iter(range(10**9))
+
+    def run(coroutine):
+        return loop.run_until_complete(coroutine)
+
+    def add_new_file():
+        run(database.add_file(f"bench_{next(counter)}", "Title", "Uploader", "https://i.ytimg.com/vi/x/hq.jpg", 180))
+
+    try:
+        run(database.add_file("bench_existing", "Title", "Uploader", None, 180))
+    except SQLAlchemyError as e:
+        print(f"Skipping database benchmarks: {e.__class__.__name__}: {e.orig}")
+        loop.close()
+        return []
+
+    results = [
+        bench("database.add_file (insert)", add_new_file, number=50, repeat=repeat),
+        bench(
+            "database.add_file (update)",
+            lambda: run(database.add_file("bench_existing", "Title 2", "Uploader", None, 181)),
+            number=50,
+            repeat=repeat,
+        ),
+        bench("database.get_file", lambda: run(database.get_file("bench_existing")), number=200, repeat=repeat),
+        bench(
+            "database.get_file (uncached)",
+            lambda: (database.forget_files(["bench_existing"]), run(database.get_file("bench_existing"))),
+            number=200,
+            repeat=repeat,
+        ),
+        bench("database.add_use", lambda: run(database.add_use("bench_existing", 1)), number=50, repeat=repeat),
+        bench(
+            "database.set_downloaded",
+            lambda: run(database.set_downloaded("bench_existing")),
+            number=50,
+            repeat=repeat,
+        ),
+    ]
+
+    with database.get_session() as session:
+        for file in session.exec(select(database.File).where(database.File.video_id.like("bench_%"))).all():
+            session.delete(file)
+        session.commit()
+    loop.close()
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=project_root, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, previous_path: Path, threshold: float) -> list:
+    with open(previous_path) as f:
+        previous = json.load(f)
+
+    print(f"\nCompared with {previous_path.name} (commit {previous.get('git_commit')}):")
+    regressions = []
+    for name, result in current["benchmarks"].items():
+        before = previous["benchmarks"].get(name)
+        if before is None:
+            continue
+        change = (result["median"] - before["median"]) / before["median"] * 100
+        marker = ""
+        if change > threshold:
+            marker = "  <-- slower"
+            regressions.append(name)
+        print(f"{name:<40} {format_time(before['median']):>10} -> {format_time(result['median']):>10} ({change:+.1f}%){marker}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10000, help="files in the synthetic audio folder")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds per benchmark")
+    parser.add_argument("--only", help="run only the benchmark groups containing this word")
+    parser.add_argument("--compare", type=Path, help="result file to compare with, the latest one by default")
+    parser.add_argument("--threshold", type=float, default=10, help="percent slower counted as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    # per-call logging and echoed statements would dominate the timings
+    database.engine.echo = False
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    groups = {
+        "normalization": lambda: benchmark_normalization(args.repeat),
+        "search": lambda: benchmark_search_shaping(args.repeat),
+        "audio_manager": lambda: benchmark_audio_manager(args.files, args.repeat),
+        "database": lambda: benchmark_database(args.repeat),
+    }
+    benchmarks = {}
+    for group, run in groups.items():
+        if args.only and args.only not in group:
+            continue
+        benchmarks.update(run())
+
+    current = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": args.files,
+        "benchmarks": benchmarks,
+    }
+
+    previous_path = args.compare
+    if previous_path is None:
+        saved = sorted(RESULTS_DIR.glob("*.json"))
+        previous_path = saved[-1] if saved else None
+    regressions = compare(current, previous_path, args.threshold) if previous_path else []
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}.json"
+        with open(path, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\nSaved results to {path.relative_to(project_root)}")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
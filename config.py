@@ -8,14 +8,140 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT"))
 LENGTH_LIMIT = int(os.getenv("LENGTH_LIMIT"))  # in minutes
 CACHE_SIZE_LIMIT = int(os.getenv("CACHE_SIZE_LIMIT"))  # in seconds
+# How long paginated search results are kept per query
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", 600))  # in seconds
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1000))  # in queries
+# Known tracks from the local catalogue put in front of YouTube results (0 disables)
+CATALOGUE_RESULTS = int(os.getenv("CATALOGUE_RESULTS", 0))
+# Admission control for inline queries that need a YouTube extraction,
+# the rest get stale or catalogue results or a busy answer
+SEARCH_MAX_CONCURRENT = int(os.getenv("SEARCH_MAX_CONCURRENT", 8))
+SEARCH_QUEUE_TIMEOUT = float(os.getenv("SEARCH_QUEUE_TIMEOUT", 1))  # in seconds
+SEARCH_USER_RATE = float(os.getenv("SEARCH_USER_RATE", 0.5))  # searches per second (0 disables)
+SEARCH_USER_BURST = int(os.getenv("SEARCH_USER_BURST", 5))
+# Inline queries are answered with what's there by then, the search goes on
+# in the background for the next query (0 waits for the search)
+SEARCH_ANSWER_DEADLINE = float(os.getenv("SEARCH_ANSWER_DEADLINE", 1.5))  # in seconds
+# How long failures are remembered, per reason (0 doesn't remember them), see negative_cache
+NEGATIVE_TTL_UNAVAILABLE = int(os.getenv("NEGATIVE_TTL_UNAVAILABLE", 7 * 86400))  # in seconds
+NEGATIVE_TTL_AGE_RESTRICTED = int(os.getenv("NEGATIVE_TTL_AGE_RESTRICTED", 7 * 86400))  # in seconds
+NEGATIVE_TTL_REGION_BLOCKED = int(os.getenv("NEGATIVE_TTL_REGION_BLOCKED", 86400))  # in seconds
+NEGATIVE_TTL_TRANSIENT = int(os.getenv("NEGATIVE_TTL_TRANSIENT", 300))  # in seconds
+NEGATIVE_TTL_EMPTY_SEARCH = int(os.getenv("NEGATIVE_TTL_EMPTY_SEARCH", 3600))  # in seconds
+# Performer/title pairs kept by the normalizer, see utils.extract_performer_title
+NORMALIZER_CACHE_SIZE = int(os.getenv("NORMALIZER_CACHE_SIZE", 10000))
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 # LOADING_GIF_URL = os.getenv('LOADING_GIF_URL')
 CHAT_ID = int(os.getenv("CHAT_ID"))
 API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 DATABASE_URL = os.getenv("DATABASE_URL")
+# File rows kept in memory for get_file (0 disables), re-read after the TTL
+# since other processes may change them
+FILE_CACHE_SIZE = int(os.getenv("FILE_CACHE_SIZE", 10000))  # in rows
+FILE_CACHE_TTL = int(os.getenv("FILE_CACHE_TTL", 300))  # in seconds
+
+# Self-hosted Bot API server for the aiogram frontend (empty uses api.telegram.org)
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+# The server runs with --local and can read the audio folder, files are sent by path
+BOT_API_LOCAL = os.getenv("BOT_API_LOCAL", "0") == "1"
+# Where the server sees the bot's working directory, if it's mounted elsewhere
+BOT_API_LOCAL_ROOT = os.getenv("BOT_API_LOCAL_ROOT", "")
+
+# Webhook mode for the aiogram frontend (empty WEBHOOK_URL keeps long polling)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # public base url, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # empty generates one on every start
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))  # in updates, per process
+WEBHOOK_CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", 32))  # updates handled at once, per process
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 1))  # processes sharing the port
+
+# Downloads go through the jobs table and are run by `python jobs.py` workers (0 downloads in the handler)
+JOB_QUEUE = int(os.getenv("JOB_QUEUE", 0))
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))  # jobs per worker process
+JOB_VISIBILITY_TIMEOUT = int(os.getenv("JOB_VISIBILITY_TIMEOUT", 300))  # in seconds, renewed while running
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))  # in seconds
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", 10))  # in seconds, doubled on every attempt
+JOB_TIMEOUT = int(os.getenv("JOB_TIMEOUT", 600))  # in seconds a handler waits for its job
+JOB_RETENTION = int(os.getenv("JOB_RETENTION", 24 * 3600))  # in seconds finished jobs are kept
+
+# Audio and thumbnail files can be spread over hashed subdirectories,
+# e.g. depth 1 and width 2 gives audio/3f/<video_id>.mp3 (depth 0 keeps one flat folder).
+# Run migrate_storage_layout.py after changing them, existing files aren't found otherwise
+STORAGE_SHARD_DEPTH = int(os.getenv("STORAGE_SHARD_DEPTH", 0))
+STORAGE_SHARD_WIDTH = int(os.getenv("STORAGE_SHARD_WIDTH", 2))
 
 # Audio folder size limit in MB (default: 1000 MB)
 AUDIO_FOLDER_SIZE_LIMIT = int(os.getenv("AUDIO_FOLDER_SIZE_LIMIT", 1000))
 
+# Cache shared between nodes: "local" keeps files under STORAGE_ROOT ("." is the
+# audio folder itself, a shared mount works too), "s3" uses an S3 compatible bucket
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", ".")
+# Size limit of the shared cache in MB, the audio folder is then a per node cache
+STORAGE_SIZE_LIMIT = int(os.getenv("STORAGE_SIZE_LIMIT", 10000))
+# The shared cache is listed to check its size at most this often
+STORAGE_CLEANUP_INTERVAL = int(os.getenv("STORAGE_CLEANUP_INTERVAL", 600))  # in seconds
+S3_ENDPOINT = os.getenv("S3_ENDPOINT", "")  # e.g. http://minio:9000
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_ACCESS_KEY = os.getenv("S3_ACCESS_KEY", "")
+S3_SECRET_KEY = os.getenv("S3_SECRET_KEY", "")
+S3_REGION = os.getenv("S3_REGION", "us-east-1")
+# Partial downloads are resumed while their media URL is valid for at least this long
+RESUME_URL_MARGIN = int(os.getenv("RESUME_URL_MARGIN", 120))  # in seconds
+# Leftovers of interrupted downloads are deleted once untouched for this long
+STALE_TEMP_MAX_AGE = int(os.getenv("STALE_TEMP_MAX_AGE", 6 * 3600))  # in seconds
+
+# Downloads go to one long-running aria2c over JSON-RPC instead of an aria2c per track
+ARIA2_RPC = os.getenv("ARIA2_RPC", "0") == "1"
+# aria2c run elsewhere on the same filesystem, e.g. http://127.0.0.1:6800/jsonrpc (empty starts one)
+ARIA2_RPC_URL = os.getenv("ARIA2_RPC_URL", "")
+ARIA2_RPC_PORT = int(os.getenv("ARIA2_RPC_PORT", 6800))
+ARIA2_RPC_SECRET = os.getenv("ARIA2_RPC_SECRET", "")  # empty derives one from BOT_TOKEN
+ARIA2_MAX_CONCURRENT_DOWNLOADS = int(os.getenv("ARIA2_MAX_CONCURRENT_DOWNLOADS", 16))
+ARIA2_MAX_CONNECTIONS_PER_SERVER = int(os.getenv("ARIA2_MAX_CONNECTIONS_PER_SERVER", 4))
+ARIA2_SPLIT = int(os.getenv("ARIA2_SPLIT", 4))  # connections per download
+ARIA2_MIN_SPLIT_SIZE = os.getenv("ARIA2_MIN_SPLIT_SIZE", "1M")
+ARIA2_MAX_DOWNLOAD_LIMIT = os.getenv("ARIA2_MAX_DOWNLOAD_LIMIT", "0")  # for all downloads together, e.g. 20M (0 is unlimited)
+ARIA2_POLL_INTERVAL = float(os.getenv("ARIA2_POLL_INTERVAL", 0.5))  # in seconds
+
 queued = set()
+
+# Speculative download of the top inline results (0 disables prefetching)
+PREFETCH_TOP_K = int(os.getenv("PREFETCH_TOP_K", 0))
+PREFETCH_MAX_CONCURRENT = int(os.getenv("PREFETCH_MAX_CONCURRENT", 2))
+PREFETCH_MAX_BYTES = int(os.getenv("PREFETCH_MAX_BYTES", 200))  # in MB
+PREFETCH_WINDOW = int(os.getenv("PREFETCH_WINDOW", 60))  # in seconds
+PREFETCH_NICENESS = int(os.getenv("PREFETCH_NICENESS", 10))
+
+# Background download/upload of the most used tracks (0 disables warm-up)
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", 0))
+WARMUP_RECENT_DAYS = int(os.getenv("WARMUP_RECENT_DAYS", 30))
+WARMUP_INTERVAL = int(os.getenv("WARMUP_INTERVAL", 6 * 3600))  # in seconds
+WARMUP_RATE = int(os.getenv("WARMUP_RATE", 6))  # tracks per minute
+WARMUP_NICENESS = int(os.getenv("WARMUP_NICENESS", 10))
+
+# Uploads read cached files in chunks, all chunks in flight share this budget
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 512 * 1024))  # in bytes
+UPLOAD_MEMORY_LIMIT = int(os.getenv("UPLOAD_MEMORY_LIMIT", 64))  # in MB
+
+# Telethon uploads send parts over this many connections at once (1 disables)
+TL_UPLOAD_CONNECTIONS = int(os.getenv("TL_UPLOAD_CONNECTIONS", 4))
+TL_UPLOAD_PART_SIZE = int(os.getenv("TL_UPLOAD_PART_SIZE", 512 * 1024))  # in bytes
+
+# ffmpeg post-processing pool (0 workers means one per available core),
+# shared out between the processes of a webhook with several WEBHOOK_WORKERS
+POSTPROCESS_WORKERS = int(os.getenv("POSTPROCESS_WORKERS", 0))
+POSTPROCESS_NICENESS = int(os.getenv("POSTPROCESS_NICENESS", 5))
+POSTPROCESS_THREADS = int(os.getenv("POSTPROCESS_THREADS", 1))  # per ffmpeg job
+
+# Event loop lag monitor and the admin's /profile command (off by default)
+DIAGNOSTICS = os.getenv("DIAGNOSTICS", "0") == "1"
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.1))  # in seconds
+# The loop's stack is logged when it doesn't come back for this long
+LOOP_LAG_THRESHOLD = float(os.getenv("LOOP_LAG_THRESHOLD", 0.5))  # in seconds
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 60))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))  # in seconds
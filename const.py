@@ -13,3 +13,9 @@ REMIX_KEYWORDS = (
     "cover",
     "hardstyle",
 )
+
+# how far an inline query can be scrolled (telegram caps a single answer at 50 results)
+SEARCH_MAX_RESULTS = 50
+
+# degraded inline answers (stale or catalogue results under load) are only cached briefly
+DEGRADED_CACHE_TIME = 10
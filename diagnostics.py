@@ -0,0 +1,263 @@
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from config import (
+    DIAGNOSTICS,
+    LOOP_LAG_INTERVAL,
+    LOOP_LAG_THRESHOLD,
+    PROFILE_MAX_SECONDS,
+    PROFILE_SAMPLE_INTERVAL,
+)
+
+PROFILE_KINDS = ("cpu", "tasks")
+# lines of each ranking in a profile report
+REPORT_TOP = 30
+
+
+@dataclass
+class LagStats:
+    samples: int = 0
+    blocks: int = 0
+    max_lag: float = 0.0
+    recent: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+    def record(self, lag: float):
+        self.samples += 1
+        self.max_lag = max(self.max_lag, lag)
+        self.recent.append(lag)
+
+    def percentile(self, p: float) -> float:
+        if not self.recent:
+            return 0.0
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps for
+    interval. A watchdog thread notices when the loop hasn't come back
+    for threshold seconds and logs what the loop's thread is doing, so
+    blocking calls show up with their stack while they block.
+    """
+
+    def __init__(self, interval: float, threshold: float):
+        self.interval = interval
+        self.threshold = threshold
+        self.stats = LagStats()
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: int | None = None
+        self._task: asyncio.Task | None = None
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start measuring the running loop."""
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._measure())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"Watching the event loop for blocks over {self.threshold}s")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _measure(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            self.stats.record(max(0.0, now - started - self.interval))
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(min(self.interval, self.threshold / 2)):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat - self.interval
+            # one report per block, taken while it lasts
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+            reported = heartbeat
+            self.stats.blocks += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unknown\n"
+            logger.warning(f"Event loop blocked for {blocked:.2f}s so far, in:\n{stack.rstrip()}")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _function_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _sample_stacks(seconds: float, interval: float) -> tuple[int, Counter, Counter, Counter]:
+    """Stacks of all threads but this one, every interval for seconds."""
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    me = threading.get_ident()
+    stacks, own, total = Counter(), Counter(), Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        samples += 1
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            own[_function_label(frame)] += 1
+            labels = []
+            while frame is not None:
+                labels.append(_function_label(frame))
+                frame = frame.f_back
+            # recursion counts once per sample
+            total.update(set(labels))
+            thread_name = names.get(thread_id) or str(thread_id)
+            stacks[";".join([thread_name, *reversed(labels)])] += 1
+        time.sleep(interval)
+    return samples, stacks, own, total
+
+
+def _ranking(counter: Counter, samples: int) -> str:
+    return "\n".join(
+        f"{count / samples:7.1%}  {label}" for label, count in counter.most_common(REPORT_TOP)
+    )
+
+
+async def profile_cpu(seconds: float, interval: float = PROFILE_SAMPLE_INTERVAL) -> tuple[str, str]:
+    """
+    Sample the stacks of every thread for seconds. Returns a summary and
+    the report, which ends with the stacks in collapsed form for
+    flamegraph.pl or speedscope. Samples are wall-clock, so threads that
+    wait (the idle loop in select, idle workers) are counted too.
+    """
+    samples, stacks, own, total = await asyncio.to_thread(_sample_stacks, seconds, interval)
+    samples = max(samples, 1)
+    threads = Counter(stack.split(";", 1)[0] for stack in stacks.elements())
+    report = "\n\n".join(
+        [
+            f"Sampling profile: {seconds:g}s, {samples} samples every {interval * 1000:g}ms",
+            "Threads:\n" + "\n".join(f"{count:7}  {name}" for name, count in threads.most_common()),
+            "Own samples:\n" + _ranking(own, samples),
+            "Total samples:\n" + _ranking(total, samples),
+            "Collapsed stacks:\n" + "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()),
+        ]
+    )
+    top = own.most_common(1)
+    summary = f"{samples} samples of {len(threads)} threads in {seconds:g}s"
+    if top:
+        summary += f", busiest: {top[0][0]}"
+    return summary, report
+
+
+def _task_label(task: asyncio.Task) -> str:
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or repr(coro)
+
+
+def _awaiting(task: asyncio.Task) -> str:
+    # innermost frame of the task's coroutine chain, where it's suspended
+    stack = task.get_stack()
+    return _frame_label(stack[-1]) if stack else "not started"
+
+
+async def dump_tasks(seconds: float, interval: float = 0.1) -> tuple[str, str]:
+    """
+    Watch the loop's tasks for seconds. Returns a summary and the report:
+    where tasks were suspended how often, tasks started and finished
+    meanwhile, and the stacks of the tasks alive at the end.
+    """
+    me = asyncio.current_task()
+    first = {task for task in asyncio.all_tasks() if task is not me}
+    seen = set(first)
+    waits = Counter()
+    samples = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        samples += 1
+        for task in asyncio.all_tasks():
+            if task is me:
+                continue
+            seen.add(task)
+            waits[f"{_task_label(task)} at {_awaiting(task)}"] += 1
+        await asyncio.sleep(interval)
+
+    alive = [task for task in asyncio.all_tasks() if task is not me]
+    created = len(seen - first)
+    finished = len(seen - set(alive))
+    samples = max(samples, 1)
+
+    stacks = io.StringIO()
+    for task in sorted(alive, key=_task_label):
+        stacks.write(f"{task.get_name()} {_task_label(task)}\n")
+        for frame in task.get_stack():
+            stacks.write(f"    {_frame_label(frame)}\n")
+    report = "\n\n".join(
+        [
+            f"Task dump: {seconds:g}s, {samples} samples every {interval * 1000:g}ms",
+            f"Alive at the start: {len(first)}, at the end: {len(alive)}, "
+            f"started: {created}, finished: {finished}",
+            "Tasks by label:\n"
+            + "\n".join(
+                f"{count:7}  {label}"
+                for label, count in Counter(_task_label(task) for task in alive).most_common()
+            ),
+            "Suspended at (share of samples):\n" + _ranking(waits, samples),
+            "Stacks at the end:\n" + stacks.getvalue().rstrip(),
+        ]
+    )
+    summary = f"{len(alive)} tasks alive, {created} started and {finished} finished in {seconds:g}s"
+    return summary, report
+
+
+class Profiler:
+    """Runs one profile at a time for the admin's /profile command."""
+
+    def __init__(self, max_seconds: float):
+        self.max_seconds = max_seconds
+        self._lock = asyncio.Lock()
+
+    def parse_args(self, text: str) -> tuple[str, float]:
+        """Kind and duration from "/profile [cpu|tasks] [seconds]", ValueError if they're wrong."""
+        kind, seconds = "cpu", 10.0
+        for arg in text.split()[1:]:
+            if arg in PROFILE_KINDS:
+                kind = arg
+            else:
+                seconds = float(arg)
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"seconds must be between 0 and {self.max_seconds:g}")
+        return kind, seconds
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def run(self, kind: str, seconds: float) -> tuple[str, str]:
+        async with self._lock:
+            logger.info(f"Profiling ({kind}) for {seconds:g}s")
+            if kind == "tasks":
+                return await dump_tasks(seconds)
+            return await profile_cpu(seconds)
+
+
+loop_monitor: LoopLagMonitor | None = None
+profiler: Profiler | None = None
+if DIAGNOSTICS:
+    loop_monitor = LoopLagMonitor(interval=LOOP_LAG_INTERVAL, threshold=LOOP_LAG_THRESHOLD)
+    profiler = Profiler(max_seconds=PROFILE_MAX_SECONDS)
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import select
+import socket
+import threading
+import time
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from config import (
+    JOB_QUEUE,
+    JOB_WORKER_CONCURRENCY,
+    JOB_VISIBILITY_TIMEOUT,
+    JOB_POLL_INTERVAL,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_DELAY,
+    JOB_TIMEOUT,
+    JOB_RETENTION,
+)
+from database import (
+    engine,
+    prepare_db,
+    enqueue_job,
+    claim_job,
+    extend_job,
+    complete_job,
+    fail_job,
+    get_job,
+    delete_finished_jobs,
+)
+from diagnostics import loop_monitor
+from yt_utils import download
+
+JOB_HANDLERS: dict[str, Callable[[dict], Awaitable[dict]]] = {}
+
+
+def job_handler(kind: str):
+    """Register the coroutine that runs jobs of this kind and returns their result."""
+
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+
+    return decorator
+
+
+@job_handler("download")
+async def run_download_job(payload: dict) -> dict:
+    video_id = payload["video_id"]
+    result = await download(f"https://www.youtube.com/watch?v={video_id}")
+    if not result:
+        raise RuntimeError(f"Failed to download {video_id}")
+    return {"video_id": video_id}
+
+
+class JobListener:
+    """
+    Wakes up waiters when postgres announces a finished job. Runs a LISTEN
+    connection in a thread; without postgres waiters only poll.
+    """
+
+    def __init__(self):
+        self._waiters: dict[int, set[asyncio.Event]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+
+    def _listen(self):
+        while True:
+            try:
+                connection = engine.raw_connection()
+                # autocommit would leak into the pool, this connection is never returned
+                connection.detach()
+                try:
+                    connection.driver_connection.autocommit = True
+                    connection.cursor().execute("LISTEN job_finished")
+                    driver_connection = connection.driver_connection
+                    while True:
+                        if select.select([driver_connection], [], [], 60) == ([], [], []):
+                            continue
+                        driver_connection.poll()
+                        while driver_connection.notifies:
+                            notify = driver_connection.notifies.pop(0)
+                            self._loop.call_soon_threadsafe(self._wake, int(notify.payload))
+                finally:
+                    connection.close()
+            except Exception as e:
+                logger.error(f"Job listener error: {str(e)}")
+                time.sleep(5)
+
+    def _wake(self, job_id: int):
+        for event in self._waiters.get(job_id, ()):
+            event.set()
+
+    async def wait(self, job_id: int, timeout: float):
+        if engine.dialect.name == "postgresql" and self._thread is None:
+            self._loop = asyncio.get_running_loop()
+            self._thread = threading.Thread(target=self._listen, name="job-listener", daemon=True)
+            self._thread.start()
+
+        event = asyncio.Event()
+        self._waiters.setdefault(job_id, set()).add(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiters[job_id].discard(event)
+            if not self._waiters[job_id]:
+                del self._waiters[job_id]
+
+
+listener = JobListener()
+
+
+async def wait_for_job(job_id: int, timeout: float = JOB_TIMEOUT) -> dict | None:
+    """Wait until a job is done or failed and return it, None on timeout."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = await get_job(job_id)
+        if job is None or job["status"] in ("done", "failed"):
+            return job
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        # with postgres notifications wake this up, polling only covers missed ones
+        poll_interval = JOB_POLL_INTERVAL
+        if engine.dialect.name == "postgresql":
+            poll_interval = max(poll_interval, 5)
+        await listener.wait(job_id, min(remaining, poll_interval))
+
+
+async def download_audio(video_id: str):
+    """
+    Download a video's audio, through the job queue when JOB_QUEUE is
+    enabled and in this process otherwise. The result is falsy on failure.
+    """
+    if not JOB_QUEUE:
+        return await download(f"https://www.youtube.com/watch?v={video_id}")
+
+    job_id = await enqueue_job(
+        "download", {"video_id": video_id}, key=video_id, max_attempts=JOB_MAX_ATTEMPTS
+    )
+    job = await wait_for_job(job_id)
+    if job is None:
+        logger.info(f"Download job {job_id} for {video_id} timed out")
+        return None
+    if job["status"] != "done":
+        logger.info(f"Download job {job_id} for {video_id} failed: {job['error']}")
+        return None
+    return job["result"]
+
+
+class JobWorker:
+    """
+    Claims jobs from the jobs table and runs them, several at a time.
+    Any number of workers on any number of hosts can share one database.
+
+    Args:
+        kinds: Job kinds this worker runs
+        concurrency: Jobs run at once
+        visibility_timeout: Seconds a claimed job stays hidden from other
+            workers, renewed while it runs
+        poll_interval: Seconds to wait when there is nothing to do
+        retry_delay: Seconds before the first retry of a failed job
+    """
+
+    def __init__(
+        self,
+        kinds: list[str],
+        concurrency: int,
+        visibility_timeout: int,
+        poll_interval: float,
+        retry_delay: int,
+    ):
+        self.kinds = kinds
+        self.concurrency = concurrency
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def _keep_locked(self, job_id: int, worker: str):
+        while True:
+            await asyncio.sleep(self.visibility_timeout / 3)
+            if not await extend_job(job_id, worker, self.visibility_timeout):
+                logger.warning(f"Job {job_id} was taken over by another worker")
+                return
+
+    async def run_one(self, worker: str) -> bool:
+        """Claim and run a single job, False if there was none."""
+        job = await claim_job(worker, self.kinds, self.visibility_timeout)
+        if job is None:
+            return False
+
+        logger.info(f"{worker} running job {job['id']} ({job['kind']}, attempt {job['attempts']})")
+        heartbeat = asyncio.create_task(self._keep_locked(job["id"], worker))
+        try:
+            result = await JOB_HANDLERS[job["kind"]](job["payload"])
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {str(e)}")
+            await fail_job(job["id"], worker, str(e), self.retry_delay)
+        else:
+            await complete_job(job["id"], worker, result)
+        finally:
+            heartbeat.cancel()
+        return True
+
+    async def _run_slot(self, slot: int):
+        # each slot owns its jobs under its own name
+        worker = f"{self.name}:{slot}"
+        while True:
+            try:
+                if await self.run_one(worker):
+                    continue
+            except Exception as e:
+                logger.error(f"Job worker error: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _clean_up(self):
+        while True:
+            try:
+                deleted = await delete_finished_jobs(JOB_RETENTION)
+                if deleted:
+                    logger.info(f"Deleted {deleted} finished jobs")
+            except Exception as e:
+                logger.error(f"Error deleting finished jobs: {str(e)}")
+            await asyncio.sleep(3600)
+
+    async def run(self):
+        await asyncio.gather(
+            self._clean_up(),
+            *(self._run_slot(slot) for slot in range(self.concurrency)),
+        )
+
+
+async def main():
+    if loop_monitor:
+        loop_monitor.start()
+    await prepare_db()
+    worker = JobWorker(
+        kinds=list(JOB_HANDLERS),
+        concurrency=JOB_WORKER_CONCURRENCY,
+        visibility_timeout=JOB_VISIBILITY_TIMEOUT,
+        poll_interval=JOB_POLL_INTERVAL,
+        retry_delay=JOB_RETRY_DELAY,
+    )
+    logger.info(f"Job worker {worker.name} started for {', '.join(worker.kinds)}")
+    await worker.run()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,224 @@
+"""
+Offline stand-ins for the services the bot talks to: YouTube (through
+yt-dlp), the Bot API and the MTProto client the Telethon handlers use.
+"""
+
+import asyncio
+import copy
+import hashlib
+import io
+import itertools
+import json
+import os
+import time
+import uuid
+from collections import defaultdict
+
+from aiohttp import web
+from PIL import Image
+from telethon import TelegramClient, functions as tl_functions, types as tl_types, utils as tl_utils
+from telethon._updates import EntityCache
+
+import yt_utils
+from paths import audio_path
+
+
+def _thumbnail_jpeg() -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (480, 360), (40, 40, 40)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+class FakeYouTube:
+    """
+    Replaces the yt-dlp calls in yt_utils. Searches return fixture entries
+    under ids derived from the query, in result pages of page_size that each
+    take search_latency to arrive. Downloads write audio_size bytes after
+    download_latency. Both block their worker thread, like yt-dlp does.
+    """
+
+    def __init__(
+        self,
+        entries: list,
+        thumbnail_base: str,
+        search_latency: float = 0.8,
+        download_latency: float = 3.0,
+        audio_size: int = 4 * 1024 * 1024,
+        results_per_query: int = 30,
+        page_size: int = 20,
+    ):
+        self.entries = entries
+        self.thumbnail_base = thumbnail_base
+        self.search_latency = search_latency
+        self.download_latency = download_latency
+        self.audio_size = audio_size
+        self.results_per_query = results_per_query
+        self.page_size = page_size
+        self.searches = 0
+        self.pages = 0
+        self.downloads = 0
+
+    def install(self):
+        yt_utils._search_entries = self.search_entries
+        yt_utils._download_sync = self.download_sync
+
+    def _entries_for(self, query: str) -> list:
+        digest = hashlib.sha1(query.strip().lower().encode()).hexdigest()
+        shift = int(digest[:8], 16) % len(self.entries)
+        entries = []
+        for i in range(self.results_per_query):
+            entry = copy.deepcopy(self.entries[(shift + i) % len(self.entries)])
+            # the same track comes up for different queries only sometimes
+            video_id = hashlib.sha1(f"{digest[:2]}{entry['id']}".encode()).hexdigest()[:11]
+            entry["id"] = video_id
+            entry["url"] = f"https://www.youtube.com/watch?v={video_id}"
+            entry["thumbnails"] = [{"url": f"{self.thumbnail_base}/vi/{video_id}/hqdefault.jpg"}]
+            entry["duration"] = min(entry.get("duration") or 0, 600)
+            entries.append(entry)
+        return entries
+
+    def search_entries(self, query: str):
+        self.searches += 1
+        for i, entry in enumerate(self._entries_for(query)):
+            if i % self.page_size == 0:
+                self.pages += 1
+                time.sleep(self.search_latency)
+            yield entry
+
+    def download_sync(self, url, progress_callback, complete_callback, error_callback):
+        self.downloads += 1
+        video_id = yt_utils._video_id_from_url(url)
+        time.sleep(self.download_latency)
+        path = audio_path(video_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if not os.path.exists(path):
+            temp_path = f"{path}.{uuid.uuid4().hex}.part"
+            with open(temp_path, "wb") as f:
+                f.truncate(self.audio_size)
+            os.replace(temp_path, path)
+        # a published path, as if another process had finished the download
+        return path
+
+
+class FakeBotAPI:
+    """
+    Bot API server that accepts every call after latency seconds. Uploads
+    are read in full; answered inline result ids are kept for the driver.
+    Also serves the thumbnails FakeYouTube points to.
+    """
+
+    def __init__(self, latency: float = 0.05, port: int = 8780):
+        self.latency = latency
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        self.calls: dict[str, int] = defaultdict(int)
+        self.uploaded_bytes = 0
+        # inline query id to the answered result ids and next offset
+        self.answers: dict[str, tuple[list[str], str]] = {}
+        self._message_ids = itertools.count(1)
+        self._thumbnail = _thumbnail_jpeg()
+        self._runner: web.AppRunner | None = None
+
+    async def _handle(self, request: web.Request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        form = await request.post()
+        await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "Bot", "username": "loadtest_bot"}
+        elif method == "answerInlineQuery":
+            results = json.loads(form.get("results", "[]"))
+            self.answers[form["inline_query_id"]] = (
+                [result["id"] for result in results],
+                form.get("next_offset", ""),
+            )
+            result = True
+        elif method == "sendAudio":
+            audio = form["audio"]
+            if isinstance(audio, web.FileField):
+                self.uploaded_bytes += len(audio.file.read())
+            result = {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(form["chat_id"]), "type": "group"},
+                "audio": {"file_id": uuid.uuid4().hex, "file_unique_id": uuid.uuid4().hex, "duration": 1},
+            }
+        else:
+            # deleteMessage, editMessageMedia and editMessageText of inline messages
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _thumbnail_handler(self, request: web.Request):
+        return web.Response(body=self._thumbnail, content_type="image/jpeg")
+
+    async def start(self):
+        app = web.Application(client_max_size=100 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        app.router.add_get("/vi/{video_id}/hqdefault.jpg", self._thumbnail_handler)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def close(self):
+        await self._runner.cleanup()
+
+
+class FakeTelethonClient:
+    """
+    Takes the place of tl_client.tl_bot. Handlers are registered through
+    on() like on a TelegramClient, requests and upload parts are answered
+    after latency seconds.
+    """
+
+    def __init__(self, latency: float = 0.05, part_size: int = 512 * 1024):
+        self.latency = latency
+        self.part_size = part_size
+        self.handlers: dict[type, list] = defaultdict(list)
+        self.calls: dict[str, int] = defaultdict(int)
+        self.uploaded_bytes = 0
+        self.answers: dict[int, tuple[list[str], str]] = {}
+        self._parse_mode = tl_utils.sanitize_parse_mode("html")
+        self._mb_entity_cache = EntityCache()
+        self._file_ids = itertools.count(1)
+
+    # building messages and buttons doesn't touch the network, so it's borrowed as is
+    _parse_message_text = TelegramClient._parse_message_text
+    build_reply_markup = staticmethod(TelegramClient.build_reply_markup)
+
+    def on(self, event):
+        def decorator(func):
+            self.handlers[type(event)].append(func)
+            return func
+
+        return decorator
+
+    async def get_me(self):
+        return tl_types.User(id=1, bot=True, first_name="Bot", username="loadtest_bot")
+
+    async def __call__(self, request):
+        self.calls[type(request).__name__] += 1
+        await asyncio.sleep(self.latency)
+        if isinstance(request, tl_functions.messages.SetInlineBotResultsRequest):
+            self.answers[request.query_id] = (
+                [result.id for result in request.results],
+                request.next_offset or "",
+            )
+        return True
+
+    async def upload_file(self, file, file_size=None, file_name=None):
+        if isinstance(file, str):
+            with open(file, "rb") as f:
+                data = f.read()
+            file_name = os.path.basename(file)
+            parts = max(1, -(-len(data) // self.part_size))
+            self.uploaded_bytes += len(data)
+            await asyncio.sleep(self.latency * parts)
+        else:
+            parts = 0
+            while chunk := await file.read(self.part_size):
+                parts += 1
+                self.uploaded_bytes += len(chunk)
+                self.calls["SaveBigFilePartRequest"] += 1
+                await asyncio.sleep(self.latency)
+        return tl_types.InputFile(id=next(self._file_ids), parts=parts, name=file_name, md5_checksum="")
@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+"""
+Offline load test of the whole bot. Inline queries, scrolling, chosen
+results and download clicks are replayed into the aiogram dispatcher or the
+Telethon handlers, with YouTube and Telegram replaced by the stand-ins in
+loadtest/fakes.py. Traffic is offered at each of --rates updates per second
+in turn; every step reports p50/p95/p99 latencies, and the highest step
+that stayed within --slo and --max-error-rate is the sustainable rate.
+
+Runs in a temporary working directory; the database comes from
+--database-url and gets fixture tracks written into it.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(project_root))
+
+FIXTURE_PATH = project_root / "benchmarks" / "fixtures" / "search_entries.json"
+
+# config.py needs these, nothing here reaches the real services
+DEFAULT_ENVIRONMENT = {
+    "BOT_TOKEN": "123:loadtest",
+    "SEARCH_LIMIT": "10",
+    "LENGTH_LIMIT": "20",
+    "CACHE_SIZE_LIMIT": "3600",
+    "ADMIN_ID": "1",
+    "CHAT_ID": "-1",
+    "API_ID": "-1",
+    "API_HASH": "",
+}
+
+
+@dataclass
+class Sample:
+    kind: str
+    latency: float
+    error: bool = False
+
+
+@dataclass
+class StepResult:
+    rate: float
+    duration: float
+    offered: int = 0
+    completed: int = 0
+    errors: int = 0
+    timeouts: int = 0
+    elapsed: float = 0.0
+    samples: list = field(default_factory=list)
+    admission: dict = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def offered_rate(self) -> float:
+        return self.offered / self.duration
+
+    @property
+    def error_rate(self) -> float:
+        return (self.errors + self.timeouts) / self.offered if self.offered else 0.0
+
+    def latencies(self, kind: str | None = None) -> list:
+        return sorted(
+            sample.latency
+            for sample in self.samples
+            if not sample.error and (kind is None or sample.kind == kind)
+        )
+
+
+def percentile(values: list, p: float) -> float:
+    """Nearest rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(p / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+class Traffic:
+    """
+    Picks the next update: a new query, half of the time one being typed,
+    scrolling an answered query or choosing one of its results. Queries and
+    users follow Zipf distributions, so popular queries come back often.
+    """
+
+    def __init__(self, entries: list, users: int, mix: dict, rng: random.Random, zipf: float = 1.1):
+        self.rng = rng
+        self.mix = mix
+        self.users = list(range(1000, 1000 + users))
+        self.user_weights = [1 / rank**zipf for rank in range(1, users + 1)]
+        self.queries = self._vocabulary(entries)
+        self.query_weights = [1 / rank**zipf for rank in range(1, len(self.queries) + 1)]
+        # (user_id, query, offset, result ids, next offset) of recent answers
+        self.answers: deque = deque(maxlen=500)
+
+    @staticmethod
+    def _vocabulary(entries: list) -> list:
+        queries = []
+        for entry in entries:
+            performer = entry["uploader"].removesuffix(" - Topic").lower()
+            title = re.sub(r"[\(\[].*?[\)\]]", "", entry["title"]).lower()
+            title = title.split(" - ", 1)[-1].strip()
+            for query in (performer, title, f"{performer} {title}"):
+                if query and query not in queries:
+                    queries.append(query)
+        return queries
+
+    def next(self) -> tuple[str, dict]:
+        user_id = self.rng.choices(self.users, self.user_weights)[0]
+        kind = self.rng.choices(list(self.mix), list(self.mix.values()))[0]
+
+        if kind == "scroll":
+            scrollable = [answer for answer in self.answers if answer[4]]
+            if scrollable:
+                _, query, _, _, next_offset = self.rng.choice(scrollable)
+                return "inline_query", {"user_id": user_id, "query": query, "offset": next_offset}
+        elif kind == "chosen":
+            choosable = [answer for answer in self.answers if answer[3]]
+            if choosable:
+                answer_user, query, _, result_ids, _ = self.rng.choice(choosable[-50:])
+                # the top results get picked most
+                index = min(int(self.rng.expovariate(0.7)), len(result_ids) - 1)
+                return "chosen", {"user_id": answer_user, "query": query, "result_id": result_ids[index]}
+
+        query = self.rng.choices(self.queries, self.query_weights)[0]
+        if len(query) > 4 and self.rng.random() < 0.5:
+            query = query[: self.rng.randint(3, len(query) - 1)]
+        return "inline_query", {"user_id": user_id, "query": query, "offset": ""}
+
+    def record(self, action: dict, answer: tuple[list, str] | None):
+        if answer is not None:
+            self.answers.append((action["user_id"], action["query"], action["offset"], *answer))
+
+
+class AiogramFrontend:
+    def __init__(self, bot, api, dispatcher):
+        self.bot = bot
+        self.api = api
+        self.dispatcher = dispatcher
+        self._update_ids = iter(range(1, 10**12))
+
+    async def inline_query(self, action: dict):
+        from aiogram.types import InlineQuery, Update, User
+
+        update_id = next(self._update_ids)
+        query_id = str(update_id)
+        update = Update(
+            update_id=update_id,
+            inline_query=InlineQuery(
+                id=query_id,
+                from_user=User(id=action["user_id"], is_bot=False, first_name="User"),
+                query=action["query"],
+                offset=action["offset"],
+            ),
+        )
+        await self.dispatcher.feed_update(self.bot, update)
+        return self.api.answers.pop(query_id, None)
+
+    async def chosen(self, action: dict):
+        from aiogram.types import ChosenInlineResult, Update, User
+
+        update_id = next(self._update_ids)
+        update = Update(
+            update_id=update_id,
+            chosen_inline_result=ChosenInlineResult(
+                result_id=action["result_id"],
+                from_user=User(id=action["user_id"], is_bot=False, first_name="User"),
+                query=action["query"],
+                inline_message_id=f"inline-{update_id}",
+            ),
+        )
+        await self.dispatcher.feed_update(self.bot, update)
+
+
+class TelethonFrontend:
+    def __init__(self, client):
+        self.client = client
+        self._ids = iter(range(1, 10**12))
+
+    async def _dispatch(self, event_type, event):
+        event._set_client(self.client)
+        for handler in self.client.handlers[event_type]:
+            await handler(event)
+
+    async def inline_query(self, action: dict):
+        from telethon import events as tl_events, types as tl_types
+
+        query_id = next(self._ids)
+        update = tl_types.UpdateBotInlineQuery(
+            query_id=query_id,
+            user_id=action["user_id"],
+            query=action["query"],
+            offset=action["offset"],
+        )
+        event = tl_events.InlineQuery.build(update)
+        event.original_update = update
+        await self._dispatch(tl_events.InlineQuery, event)
+        return self.client.answers.pop(query_id, None)
+
+    async def chosen(self, action: dict):
+        # the sent article has a download button, the click does the work
+        from telethon import events as tl_events, types as tl_types
+
+        update = tl_types.UpdateInlineBotCallbackQuery(
+            query_id=next(self._ids),
+            user_id=action["user_id"],
+            msg_id=tl_types.InputBotInlineMessageID(
+                dc_id=2, id=next(self._ids), access_hash=random.getrandbits(63)
+            ),
+            chat_instance=random.getrandbits(63),
+            data=action["result_id"].encode(),
+        )
+        event = tl_events.CallbackQuery.build(update)
+        event.original_update = update
+        await self._dispatch(tl_events.CallbackQuery, event)
+
+
+async def timed(frontend, traffic: Traffic, kind: str, action: dict, scheduled: float, step: StepResult):
+    loop = asyncio.get_running_loop()
+    try:
+        if kind == "inline_query":
+            traffic.record(action, await frontend.inline_query(action))
+        else:
+            await frontend.chosen(action)
+    except Exception as e:
+        step.errors += 1
+        step.samples.append(Sample(kind, loop.time() - scheduled, error=True))
+        print(f"{kind} failed: {e.__class__.__name__}: {e}", file=sys.stderr)
+        return
+    step.completed += 1
+    # measured from when the update was due, queueing included
+    step.samples.append(Sample(kind, loop.time() - scheduled))
+
+
+async def run_step(frontend, traffic: Traffic, rate: float, duration: float, drain: float, rng: random.Random) -> StepResult:
+    from admission import search_admission
+
+    loop = asyncio.get_running_loop()
+    step = StepResult(rate=rate, duration=duration)
+    admission_before = dict(vars(search_admission.stats))
+    tasks = set()
+
+    started = loop.time()
+    due = started
+    # open loop with poisson arrivals, slow answers don't slow the offered load
+    while due < started + duration:
+        await asyncio.sleep(max(0.0, due - loop.time()))
+        kind, action = traffic.next()
+        tasks.add(asyncio.create_task(timed(frontend, traffic, kind, action, due, step)))
+        step.offered += 1
+        due += rng.expovariate(rate)
+
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=drain)
+        for task in pending:
+            task.cancel()
+        step.timeouts = len(pending)
+    step.elapsed = loop.time() - started
+    step.admission = {
+        name: value - admission_before[name] for name, value in vars(search_admission.stats).items()
+    }
+    return step
+
+
+def report_step(step: StepResult):
+    print(
+        f"\n{step.rate:g} updates/s offered for {step.duration:g}s: {step.offered} sent ({step.offered_rate:.1f}/s), "
+        f"{step.completed} done ({step.throughput:.1f}/s), {step.errors} errors, {step.timeouts} timed out"
+    )
+    for kind in [None, *sorted({sample.kind for sample in step.samples})]:
+        latencies = step.latencies(kind)
+        print(
+            f"  {kind or 'all':<14} n={len(latencies):<6} p50 {percentile(latencies, 50):7.3f}s  "
+            f"p95 {percentile(latencies, 95):7.3f}s  p99 {percentile(latencies, 99):7.3f}s  "
+            f"max {latencies[-1] if latencies else 0:7.3f}s"
+        )
+    print("  admission: " + ", ".join(f"{name} {value}" for name, value in step.admission.items()))
+
+
+def is_sustainable(step: StepResult, slo: float, max_error_rate: float) -> bool:
+    return (
+        step.error_rate <= max_error_rate
+        and percentile(step.latencies("inline_query"), 95) <= slo
+        # the bot kept up instead of finishing long after the traffic stopped
+        and step.throughput >= 0.9 * step.offered_rate
+    )
+
+
+def setup_environment(args) -> str:
+    for name, value in DEFAULT_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+    # never the bot's own database or shared cache
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["STORAGE_ROOT"] = "."
+    os.environ["JOB_QUEUE"] = "0"
+    os.environ["ARIA2_RPC"] = "0"
+    os.environ["BOT_API_URL"] = ""
+    os.environ["BOT_API_LOCAL"] = "0"
+    os.environ["TL_UPLOAD_CONNECTIONS"] = "1"
+
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    os.chdir(workdir)
+    return workdir
+
+
+async def run(args):
+    from loguru import logger
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    import database
+
+    database.engine.echo = False
+    from fakes import FakeBotAPI, FakeTelethonClient, FakeYouTube
+
+    with open(FIXTURE_PATH, encoding="utf-8") as f:
+        entries = json.load(f)
+
+    api = FakeBotAPI(latency=args.api_latency, port=args.port)
+    await api.start()
+    youtube = FakeYouTube(
+        entries,
+        thumbnail_base=api.base_url,
+        search_latency=args.search_latency,
+        download_latency=args.download_latency,
+        audio_size=args.audio_size * 1024,
+    )
+    youtube.install()
+    await database.prepare_db()
+
+    if args.frontend == "aiogram":
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        import aiogram_handlers
+        from aiogram_client import aiogram_dp
+
+        bot = Bot(
+            token=os.environ["BOT_TOKEN"],
+            session=AiohttpSession(api=TelegramAPIServer.from_base(api.base_url)),
+        )
+        # the handlers call the module's bot directly, not the one the update came with
+        aiogram_handlers.aiogram_bot = bot
+        frontend = AiogramFrontend(bot, api, aiogram_dp)
+    else:
+        import tl_client
+
+        client = FakeTelethonClient(latency=args.api_latency)
+        tl_client.tl_bot = client
+        import tl_handlers  # noqa: F401
+
+        frontend = TelethonFrontend(client)
+
+    rng = random.Random(args.seed)
+    mix = {"inline_query": args.mix[0], "scroll": args.mix[1], "chosen": args.mix[2]}
+    traffic = Traffic(entries, args.users, mix, rng)
+
+    steps = []
+    try:
+        for rate in args.rates:
+            step = await run_step(frontend, traffic, rate, args.duration, args.drain, rng)
+            report_step(step)
+            steps.append(step)
+            if not is_sustainable(step, args.slo, args.max_error_rate) and not args.keep_going:
+                break
+    finally:
+        if args.frontend == "aiogram":
+            await bot.session.close()
+        await api.close()
+
+    sustainable = [step.rate for step in steps if is_sustainable(step, args.slo, args.max_error_rate)]
+    calls = api.calls if args.frontend == "aiogram" else client.calls
+    print(f"\nYouTube: {youtube.searches} searches ({youtube.pages} result pages), {youtube.downloads} downloads")
+    print("Telegram: " + ", ".join(f"{name} {count}" for name, count in sorted(calls.items())))
+    print(
+        f"Sustainable rate: {max(sustainable):g} updates/s"
+        if sustainable
+        else "Sustainable rate: below the lowest step"
+    )
+
+    if args.output:
+        result = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "frontend": args.frontend,
+            "arguments": {name: value for name, value in vars(args).items() if name != "output"},
+            "sustainable_rate": max(sustainable) if sustainable else None,
+            "steps": [
+                {
+                    "rate": step.rate,
+                    "offered": step.offered,
+                    "completed": step.completed,
+                    "errors": step.errors,
+                    "timeouts": step.timeouts,
+                    "throughput": step.throughput,
+                    "admission": step.admission,
+                    "latency": {
+                        kind or "all": {
+                            f"p{p}": percentile(step.latencies(kind), p) for p in (50, 95, 99)
+                        }
+                        for kind in [None, "inline_query", "chosen"]
+                    },
+                }
+                for step in steps
+            ],
+        }
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved results to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("LOADTEST_DATABASE_URL"),
+        required=not os.getenv("LOADTEST_DATABASE_URL"),
+        help="a scratch database, LOADTEST_DATABASE_URL by default",
+    )
+    parser.add_argument("--frontend", choices=["aiogram", "telethon"], default="aiogram")
+    parser.add_argument("--rates", type=lambda value: [float(rate) for rate in value.split(",")], default=[5, 10, 20, 40, 80],
+                        help="offered updates per second, one step each")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per step")
+    parser.add_argument("--drain", type=float, default=60, help="seconds to wait for updates still running after a step")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--mix", type=lambda value: [float(part) for part in value.split(",")], default=[0.7, 0.1, 0.2],
+                        help="weights of new queries, scrolling and chosen results")
+    parser.add_argument("--search-latency", type=float, default=0.8, help="seconds per YouTube result page")
+    parser.add_argument("--download-latency", type=float, default=3.0, help="seconds per download")
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds per Telegram request")
+    parser.add_argument("--audio-size", type=int, default=4096, help="downloaded file size in KB")
+    parser.add_argument("--slo", type=float, default=2.0, help="p95 inline query latency a sustainable step stays within")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--keep-going", action="store_true", help="run every step even after one wasn't sustainable")
+    parser.add_argument("--port", type=int, default=8780, help="port of the stand-in Bot API server")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", type=os.path.abspath, help="save the results as JSON")
+    args = parser.parse_args()
+
+    workdir = setup_environment(args)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    print(f"Working directory: {workdir}")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,13 +4,21 @@ from loguru import logger
 
 from tl_client import use_telethon, get_tl_bot
 from database import prepare_db
+from diagnostics import loop_monitor
+from audio_manager import reconcile_downloaded
 from aiogram_client import aiogram_bot, aiogram_dp
+from config import WARMUP_TOP_N, WEBHOOK_URL
+from warmup import run_warmup_loop
 
 
 
 async def main():
+    if loop_monitor:
+        loop_monitor.start()
     # Initialize database
     await prepare_db()
+    # files may have been deleted or left half-written while the bot was down
+    await reconcile_downloaded()
 
     if use_telethon:
         tl_bot = await get_tl_bot()
@@ -20,10 +28,25 @@ async def main():
             tl_inline_query_handler,
             tl_stats_handler,
             tl_mail_handler,
+            tl_profile_handler,
         )  # noqa: F401
+        if WARMUP_TOP_N > 0:
+            # telethon uploads can't be reused by file_id, only the audio folder is warmed
+            warmup_task = asyncio.create_task(run_warmup_loop())
         await tl_bot.run_until_disconnected()
     else:
-        await aiogram_dp.start_polling(aiogram_bot)
+        from aiogram_handlers import warmup_upload
+
+        if WARMUP_TOP_N > 0:
+            warmup_task = asyncio.create_task(run_warmup_loop(warmup_upload))
+        if WEBHOOK_URL:
+            from webhook import run_webhook
+
+            await run_webhook(aiogram_bot, aiogram_dp)
+        else:
+            # getUpdates doesn't work while a webhook from an earlier run is set
+            await aiogram_bot.delete_webhook()
+            await aiogram_dp.start_polling(aiogram_bot)
 
 if __name__ == "__main__":
     asyncio.run(main())
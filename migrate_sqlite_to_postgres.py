@@ -1,122 +1,229 @@
 #!/usr/bin/env python3
 """
-Migration script to transfer data from SQLite3 to PostgreSQL
+Migration script to transfer data from SQLite3 to PostgreSQL.
+Rows are streamed in batches of --batch-size and written with COPY, tables
+are migrated in parallel. Every batch is committed together with a
+checkpoint, so an interrupted run continues where it stopped.
 """
 
-import aiosqlite
-import asyncio
-from sqlmodel import SQLModel, create_engine, Session, select
-from sqlalchemy import text # Import text from sqlalchemy
-from database import File, User, engine as postgres_engine
+import argparse
+import io
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import SQLModel
+
+from database import engine as postgres_engine
 
 # SQLite database path
 SQLITE_DB_PATH = "db.sqlite3"
+BATCH_SIZE = 10000
+
+CHECKPOINT_TABLE = "migration_checkpoint"
+
+
+@dataclass
+class MigratedTable:
+    source: str
+    target: str
+    columns: list[str]
+    # source row (in columns order) to target row
+    convert: Callable[[tuple], tuple]
+
+
+TABLES = [
+    MigratedTable(
+        source="files",
+        target="file",
+        columns=["id", "video_id", "uses_count", "duration", "thumbnail", "title", "uploader", "downloaded"],
+        convert=lambda row: (*row[:2], row[2] or 0, *row[3:7], bool(row[7])),
+    ),
+    MigratedTable(
+        source="users",
+        target="user",
+        columns=["id", "sent_videos_count"],
+        convert=lambda row: (row[0], row[1] or 0),
+    ),
+]
+
+
+def create_checkpoint_table():
+    with postgres_engine.begin() as connection:
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} "
+            "(table_name VARCHAR(64) PRIMARY KEY, last_id BIGINT NOT NULL)"
+        ))
+
+
+def get_checkpoint(table: MigratedTable) -> int | None:
+    with postgres_engine.connect() as connection:
+        return connection.execute(
+            text(f"SELECT last_id FROM {CHECKPOINT_TABLE} WHERE table_name = :table"),
+            {"table": table.target},
+        ).scalar()
+
+
+def reset_checkpoints():
+    with postgres_engine.begin() as connection:
+        connection.execute(text(f"DELETE FROM {CHECKPOINT_TABLE}"))
+
+
+# COPY's csv format only takes unquoted fields as NULL, strings are always quoted
+COPY_NULL = "\\N"
+
+
+def _csv_field(value) -> str:
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def _copy_data(rows: list[tuple]) -> str:
+    """Rows as csv for COPY ... WITH (FORMAT csv, NULL '\\N')."""
+    return "".join(",".join(_csv_field(value) for value in row) + "\n" for row in rows)
+
+
+def _copy_batch(connection, table: MigratedTable, rows: list[tuple]):
+    # COPY can't skip rows that are already there, so it goes through a staging table
+    columns = ", ".join(f'"{column}"' for column in table.columns)
+    stage = f"stage_{table.target}"
+    connection.execute(text(
+        f'CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE "{table.target}" INCLUDING DEFAULTS) '
+        "ON COMMIT DELETE ROWS"
+    ))
+
+    cursor = connection.connection.dbapi_connection.cursor()
+    cursor.copy_expert(
+        f"COPY {stage} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')",
+        io.StringIO(_copy_data(rows)),
+    )
+
+    connection.execute(text(
+        f'INSERT INTO "{table.target}" ({columns}) SELECT {columns} FROM {stage} '
+        "ON CONFLICT DO NOTHING"
+    ))
 
-async def migrate_data():
+
+def _insert_batch(connection, table: MigratedTable, rows: list[tuple]):
+    # multi-row insert for databases without COPY, e.g. a sqlite target in tests
+    target = SQLModel.metadata.tables[table.target]
+    statement = sqlite_insert(target).on_conflict_do_nothing()
+    connection.execute(statement, [dict(zip(table.columns, row)) for row in rows])
+
+
+def write_batch(table: MigratedTable, rows: list[tuple], last_id: int):
+    """Write a batch and move the checkpoint past it in one transaction."""
+    with postgres_engine.begin() as connection:
+        if postgres_engine.dialect.name == "postgresql":
+            _copy_batch(connection, table, rows)
+        else:
+            _insert_batch(connection, table, rows)
+        connection.execute(
+            text(
+                f"INSERT INTO {CHECKPOINT_TABLE} (table_name, last_id) VALUES (:table, :last_id) "
+                "ON CONFLICT (table_name) DO UPDATE SET last_id = excluded.last_id"
+            ),
+            {"table": table.target, "last_id": last_id},
+        )
+
+
+def migrate_table(table: MigratedTable, sqlite_path: str, batch_size: int) -> int:
+    # sqlite connections can't be shared between threads, each table opens its own
+    sqlite_conn = sqlite3.connect(sqlite_path)
+    try:
+        total = sqlite_conn.execute(f"SELECT COUNT(*) FROM {table.source}").fetchone()[0]
+        last_id = get_checkpoint(table)
+        if last_id is None:
+            last_id = -(2**63)
+            done = 0
+        else:
+            done = sqlite_conn.execute(
+                f"SELECT COUNT(*) FROM {table.source} WHERE id <= ?", (last_id,)
+            ).fetchone()[0]
+            print(f"{table.target}: resuming after id {last_id} ({done}/{total} rows)")
+
+        columns = ", ".join(table.columns)
+        started = time.monotonic()
+        migrated = 0
+        while True:
+            # keyset pagination, only one batch is ever held in memory
+            rows = sqlite_conn.execute(
+                f"SELECT {columns} FROM {table.source} WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                break
+
+            last_id = rows[-1][0]
+            write_batch(table, [table.convert(row) for row in rows], last_id)
+            migrated += len(rows)
+            done += len(rows)
+            rate = migrated / max(time.monotonic() - started, 1e-9)
+            print(f"{table.target}: {done}/{total} rows ({rate:.0f} rows/s)")
+
+        print(f"Migrated {migrated} {table.target} rows in {time.monotonic() - started:.1f}s")
+        return migrated
+    finally:
+        sqlite_conn.close()
+
+
+def update_sequences():
+    if postgres_engine.dialect.name != "postgresql":
+        return
+
+    print("Updating PostgreSQL sequences...")
+    with postgres_engine.begin() as connection:
+        for table in TABLES:
+            sequence = connection.execute(
+                text("SELECT pg_get_serial_sequence(:table, 'id')"),
+                {"table": f'"{table.target}"'},
+            ).scalar()
+            if sequence is None:
+                # ids that come from telegram have no sequence
+                continue
+            # with an empty table the next id has to be 1, not 2
+            connection.execute(text(
+                f"SELECT setval('{sequence}', COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) "
+                f'FROM "{table.target}"'
+            ))
+            print(f"Updated sequence {sequence}")
+    print("PostgreSQL sequences updated successfully!")
+
+
+def migrate_data(sqlite_path: str = SQLITE_DB_PATH, batch_size: int = BATCH_SIZE, workers: int = 2):
     # Create tables in PostgreSQL
     SQLModel.metadata.create_all(postgres_engine)
-    
-    # Connect to SQLite database
-    async with aiosqlite.connect(SQLITE_DB_PATH) as sqlite_conn:
-        # Migrate files table
-        await migrate_files(sqlite_conn)
-        
-        # Migrate users table
-        await migrate_users(sqlite_conn)
-        
-    # After migration, update the sequences
-    await update_sequences()
-
-    print("Migration completed successfully!")
-
-async def migrate_files(sqlite_conn):
-    print("Migrating files...")
-    
-    # Get all files from SQLite
-    async with sqlite_conn.execute("SELECT * FROM files") as cursor:
-        rows = await cursor.fetchall()
-        column_names = [description[0] for description in cursor.description]
-    
-    # Create a session for PostgreSQL
-    # Use async session for async engine if applicable, but for this specific
-    # migration, a sync Session with commit will work.
-    # Note: If your postgres_engine is an async engine and you mean to use
-    # AsyncSession, you'd need `async with Session(postgres_engine) as session:`
-    # and `await session.commit()`. Assuming synchronous Session for simplicity
-    # with the current `with Session(...)` block.
-    with Session(postgres_engine) as session:
-        for row in rows:
-            # Create a dictionary from row data
-            row_dict = dict(zip(column_names, row))
-            
-            # Create File object
-            file = File(
-                id=row_dict['id'],
-                video_id=row_dict['video_id'],
-                uses_count=row_dict['uses_count'] or 0,
-                duration=row_dict['duration'],
-                thumbnail=row_dict['thumbnail'],
-                title=row_dict['title'],
-                uploader=row_dict['uploader'],
-                downloaded=bool(row_dict['downloaded']) if row_dict['downloaded'] is not None else False
-            )
-            
-            # Add to session
-            session.add(file)
-        
-        # Commit all files
-        session.commit()
-    
-    print(f"Migrated {len(rows)} files")
-
-async def migrate_users(sqlite_conn):
-    print("Migrating users...")
-    
-    # Get all users from SQLite
-    async with sqlite_conn.execute("SELECT * FROM users") as cursor:
-        rows = await cursor.fetchall()
-        column_names = [description[0] for description in cursor.description]
-    
-    # Create a session for PostgreSQL
-    with Session(postgres_engine) as session:
-        for row in rows:
-            # Create a dictionary from row data
-            row_dict = dict(zip(column_names, row))
-            
-            # Create User object
-            user = User(
-                id=row_dict['id'],
-                sent_videos_count=row_dict['sent_videos_count'] or 0
-            )
-            
-            # Add to session
-            session.add(user)
-        
-        # Commit all users
-        session.commit()
-    
-    print(f"Migrated {len(rows)} users")
-
-async def update_sequences():
-    print("Updating PostgreSQL sequences...")
-    async with postgres_engine.begin() as conn: # Use async with begin() for an async engine
-        # Get the maximum ID from the files table and update the sequence
-        # The sequence name for an autoincrementing primary key 'id' in a table 'files'
-        # is typically 'files_id_seq'
-        await conn.execute(
-            text("SELECT setval('file_id_seq', (SELECT MAX(id) FROM file), true);")
-        )
-        print("Updated sequence for file_id_seq")
+    create_checkpoint_table()
 
-        # Get the maximum ID from the users table and update the sequence
-        # The sequence name for an autoincrementing primary key 'id' in a table 'users'
-        # is typically 'users_id_seq'
-        await conn.execute(
-            text("SELECT setval('user_id_seq', (SELECT MAX(id) FROM user), true);")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        migrated = sum(
+            executor.map(lambda table: migrate_table(table, sqlite_path, batch_size), TABLES)
         )
-        print("Updated sequence for user_id_seq")
-    print("PostgreSQL sequences updated successfully!")
+
+    # After migration, update the sequences
+    update_sequences()
+    print(f"Migration completed successfully! {migrated} rows in {time.monotonic() - started:.1f}s")
 
 
 if __name__ == "__main__":
-    asyncio.run(migrate_data())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sqlite-path", default=SQLITE_DB_PATH)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=len(TABLES), help="tables migrated at once")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints of an earlier run")
+    args = parser.parse_args()
+
+    if args.restart:
+        create_checkpoint_table()
+        reset_checkpoints()
+    migrate_data(args.sqlite_path, args.batch_size, args.workers)
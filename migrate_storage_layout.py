@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Migration script to move cached audio and thumbnails into the sharded layout.
+Safe to run again, e.g. after changing STORAGE_SHARD_DEPTH or STORAGE_SHARD_WIDTH.
+"""
+
+import argparse
+import os
+
+from paths import AUDIO_DIR, THUMBNAILS_DIR, shard_dir, iter_files
+
+
+def migrate_folder(root: str, dry_run: bool = False) -> int:
+    print(f"Migrating {root}...")
+    moved = 0
+
+    # collect first, moving files while scanning would visit them twice
+    entries = [entry for entry in iter_files(root) if not entry.name.startswith(".")]
+    for entry in entries:
+        # video ids never contain dots, everything after the first one is the extension
+        video_id = entry.name.split(".", 1)[0]
+        target = os.path.join(shard_dir(root, video_id), entry.name)
+        if os.path.abspath(target) == os.path.abspath(entry.path):
+            continue
+
+        if not dry_run:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.replace(entry.path, target)
+        moved += 1
+
+    if not dry_run:
+        remove_empty_dirs(root)
+
+    print(f"Moved {moved} of {len(entries)} files in {root}")
+    return moved
+
+
+def remove_empty_dirs(root: str):
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if dirpath != root and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only count the files that would be moved"
+    )
+    args = parser.parse_args()
+
+    migrate_folder(AUDIO_DIR, args.dry_run)
+    migrate_folder(THUMBNAILS_DIR, args.dry_run)
+    print("Migration completed successfully!")
+
+
+if __name__ == "__main__":
+    main()
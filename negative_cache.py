@@ -0,0 +1,122 @@
+import re
+import time
+
+from loguru import logger
+from yt_dlp.utils import DownloadError
+
+from config import (
+    NEGATIVE_TTL_UNAVAILABLE,
+    NEGATIVE_TTL_AGE_RESTRICTED,
+    NEGATIVE_TTL_REGION_BLOCKED,
+    NEGATIVE_TTL_TRANSIENT,
+    NEGATIVE_TTL_EMPTY_SEARCH,
+)
+from database import set_negative_entry, get_negative_entries, delete_expired_negative_entries
+
+FAILURE_TTLS = {
+    "unavailable": NEGATIVE_TTL_UNAVAILABLE,
+    "age_restricted": NEGATIVE_TTL_AGE_RESTRICTED,
+    "region_blocked": NEGATIVE_TTL_REGION_BLOCKED,
+    "transient": NEGATIVE_TTL_TRANSIENT,
+}
+
+# yt-dlp error messages by what they mean, the first match wins. Rate limits
+# and bot checks come first, YouTube words them like unavailable videos
+FAILURE_PATTERNS = [
+    ("transient", re.compile(r"try again later|not a bot|rate.?limit|HTTP Error (?:429|5\d\d)|timed? ?out", re.I)),
+    ("age_restricted", re.compile(r"confirm your age|age.restricted|inappropriate for some users", re.I)),
+    ("region_blocked", re.compile(r"in your country|geo.?restrict|not available in your location", re.I)),
+    (
+        "unavailable",
+        re.compile(
+            r"video unavailable|private video|has been removed|no longer available|"
+            r"account .* terminated|copyright|does not exist|members.only",
+            re.I,
+        ),
+    ),
+]
+
+PURGE_INTERVAL = 3600  # in seconds
+
+_last_purge = 0.0
+
+
+def classify_failure(error: Exception) -> str | None:
+    """Reason of a failed download, None for errors that say nothing about the video."""
+    if not isinstance(error, DownloadError):
+        # aborted prefetches, post-processing and storage errors are ours
+        return None
+    message = str(error)
+    for reason, pattern in FAILURE_PATTERNS:
+        if pattern.search(message):
+            return reason
+    return "transient"
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.lower().split())[:255]
+
+
+async def _purge_expired():
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = time.monotonic()
+    deleted = await delete_expired_negative_entries()
+    if deleted:
+        logger.info(f"Deleted {deleted} expired negative cache entries")
+
+
+async def remember_failure(video_id: str, error: Exception):
+    reason = classify_failure(error)
+    ttl = FAILURE_TTLS.get(reason, 0)
+    if ttl <= 0:
+        return
+    logger.info(f"Remembering {video_id} as {reason} for {ttl}s")
+    try:
+        await set_negative_entry("video", video_id, reason, ttl, str(error)[:1000])
+        await _purge_expired()
+    except Exception as e:
+        logger.error(f"Failed to remember the failure of {video_id}: {str(e)}")
+
+
+async def known_failure(video_id: str) -> str | None:
+    """Reason the video is known to fail for, None if it isn't."""
+    return (await known_failures([video_id])).get(video_id)
+
+
+async def known_failures(video_ids: list[str]) -> dict[str, str]:
+    try:
+        return await get_negative_entries("video", video_ids)
+    except Exception as e:
+        # a lookup that fails just doesn't filter anything
+        logger.error(f"Negative cache lookup failed: {str(e)}")
+        return {}
+
+
+async def filter_known_bad(results: list) -> list:
+    """Results without the videos that are known to fail."""
+    bad = await known_failures([result["id"] for result in results])
+    if not bad:
+        return results
+    logger.info(f"Filtered known bad results: {bad}")
+    return [result for result in results if result["id"] not in bad]
+
+
+async def remember_empty_search(query: str):
+    if NEGATIVE_TTL_EMPTY_SEARCH <= 0:
+        return
+    try:
+        await set_negative_entry("search", normalize_query(query), "empty", NEGATIVE_TTL_EMPTY_SEARCH)
+        await _purge_expired()
+    except Exception as e:
+        logger.error(f"Failed to remember the empty search {query!r}: {str(e)}")
+
+
+async def is_empty_search(query: str) -> bool:
+    key = normalize_query(query)
+    try:
+        return key in await get_negative_entries("search", [key])
+    except Exception as e:
+        logger.error(f"Negative cache lookup failed: {str(e)}")
+        return False
@@ -0,0 +1,59 @@
+import hashlib
+import os
+from typing import Iterator
+
+from config import STORAGE_SHARD_DEPTH, STORAGE_SHARD_WIDTH
+
+AUDIO_DIR = "audio"
+THUMBNAILS_DIR = "thumbnails"
+
+
+def shard_dir(root: str, video_id: str) -> str:
+    """
+    Directory a video's files live in, e.g. audio/3f/ for depth 1 and width 2.
+    Shards come from a hash, so they stay even however video ids are distributed.
+    """
+    digest = hashlib.sha1(video_id.encode()).hexdigest()
+    shards = [
+        digest[i * STORAGE_SHARD_WIDTH : (i + 1) * STORAGE_SHARD_WIDTH]
+        for i in range(STORAGE_SHARD_DEPTH)
+    ]
+    return os.path.join(root, *shards)
+
+
+def audio_path(video_id: str, ext: str = "mp3") -> str:
+    return os.path.join(shard_dir(AUDIO_DIR, video_id), f"{video_id}.{ext}")
+
+
+def thumbnail_path(video_id: str) -> str:
+    return os.path.join(shard_dir(THUMBNAILS_DIR, video_id), f"{video_id}.jpg")
+
+
+def published_video_id(filename: str) -> str | None:
+    """
+    Video id of a finished audio file, None for anything else. Downloads
+    are published by renaming <id>.f<format>.mp3 to <id>.mp3, so an mp3
+    with its plain name is always complete.
+    """
+    if not filename.endswith(".mp3"):
+        return None
+    video_id = filename[:-4]
+    return None if "." in video_id else video_id
+
+
+def iter_files(root: str) -> Iterator[os.DirEntry]:
+    """Yield every file under root, whatever the shard layout is."""
+    if not os.path.isdir(root):
+        return
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+
+
+def count_audio_files() -> int:
+    return sum(1 for entry in iter_files(AUDIO_DIR) if published_video_id(entry.name))
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import yt_dlp
+from loguru import logger
+
+from config import (
+    POSTPROCESS_WORKERS,
+    POSTPROCESS_NICENESS,
+    POSTPROCESS_THREADS,
+    WEBHOOK_URL,
+    WEBHOOK_WORKERS,
+)
+from utils import lower_thread_priority
+
+FFMPEG_POSTPROCESSORS = [
+    {
+        "key": "FFmpegExtractAudio",
+        "preferredcodec": "mp3",
+        "preferredquality": "320",
+    },
+    {"key": "EmbedThumbnail", "already_have_thumbnail": False},
+    {
+        "key": "FFmpegMetadata",
+        "add_metadata": True,
+    },
+]
+
+
+def _post_process_sync(info: dict, threads: int) -> dict:
+    threads_args = ["-threads", str(threads)]
+    ydl_opts = {
+        "postprocessors": FFMPEG_POSTPROCESSORS,
+        "postprocessor_args": {
+            "extractaudio+ffmpeg_o": threads_args,
+            "metadata+ffmpeg_o": threads_args,
+            "embedthumbnail+ffmpeg_o": [
+                "-c:v",
+                "png",
+                "-vf",
+                "crop='if(gt(ih,iw),iw,ih)':'if(gt(iw,ih),ih,iw)'",
+                "-preset",
+                "veryfast",
+                *threads_args,
+            ],
+        },
+        "keepvideo": False,
+        "quiet": True,
+        "no_warnings": True,
+    }
+
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        return ydl.post_process(info["filepath"], info)
+
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _pool_workers() -> int:
+    workers = POSTPROCESS_WORKERS or _available_cores()
+    # every webhook worker process has its own pool, together they get the workers once
+    if WEBHOOK_URL and WEBHOOK_WORKERS > 1:
+        workers = max(1, workers // WEBHOOK_WORKERS)
+    return workers
+
+
+class PostprocessPool:
+    """
+    Runs the ffmpeg stage of downloads (audio extraction, cover and metadata)
+    separately from the network stage, at most one job per worker at a time.
+    Jobs of users waiting for a download go before background ones.
+
+    Args:
+        workers: Number of ffmpeg jobs running at once
+        niceness: Scheduling priority of the ffmpeg processes
+        threads: Threads each ffmpeg job may use
+    """
+
+    def __init__(self, workers: int, niceness: int, threads: int):
+        self.workers = workers
+        self.threads = threads
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="ffmpeg",
+            initializer=lower_thread_priority,
+            initargs=(niceness,),
+        )
+        self._queue: asyncio.PriorityQueue | None = None
+        self._order = itertools.count()
+        self._worker_tasks = []
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    def _start_workers(self):
+        # the queue and workers have to be created inside the running loop
+        self._queue = asyncio.PriorityQueue()
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def run(self, info: dict, background: bool = False) -> dict:
+        """Post-process a downloaded file and return the updated info dict."""
+        if self._queue is None:
+            self._start_workers()
+
+        future = asyncio.get_running_loop().create_future()
+        priority = 1 if background else 0
+        await self._queue.put((priority, next(self._order), info, future))
+        return await future
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, info, future = await self._queue.get()
+            if future.done():
+                continue
+
+            self.running += 1
+            try:
+                result = await loop.run_in_executor(
+                    self._executor, _post_process_sync, info, self.threads
+                )
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Post-processing of {info.get('id')} failed: {str(e)}")
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                self.completed += 1
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.running -= 1
+
+
+postprocess_pool = PostprocessPool(
+    workers=_pool_workers(),
+    niceness=POSTPROCESS_NICENESS,
+    threads=POSTPROCESS_THREADS,
+)
@@ -0,0 +1,188 @@
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from config import (
+    PREFETCH_TOP_K,
+    PREFETCH_MAX_CONCURRENT,
+    PREFETCH_MAX_BYTES,
+    PREFETCH_WINDOW,
+    PREFETCH_NICENESS,
+)
+from paths import audio_path
+from utils import lower_thread_priority
+from yt_utils import download
+
+
+class PrefetchExpired(Exception):
+    """Raised from the progress hook to abort a prefetch nobody picked."""
+
+
+@dataclass
+class PrefetchStats:
+    started: int = 0
+    hits: int = 0
+    expired: int = 0
+    failed: int = 0
+    skipped: int = 0
+    wasted_bytes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.started if self.started else 0.0
+
+
+@dataclass
+class PrefetchJob:
+    video_id: str
+    deadline: float
+    task: asyncio.Task | None = None
+    done: asyncio.Event = field(default_factory=asyncio.Event)
+    bytes: int = 0
+    chosen: bool = False
+    given_up: bool = False
+
+
+class Prefetcher:
+    """
+    Downloads the top results of an inline query in the background, so that
+    the result the user picks is usually already on disk.
+
+    Args:
+        top_k: How many results of each query to prefetch
+        max_concurrent: Global limit on prefetches running at once
+        max_bytes: Global limit on bytes held by prefetches nobody picked yet
+        window: Seconds a prefetch waits to be picked before it is given up
+        niceness: Scheduling priority of the prefetch workers
+    """
+
+    def __init__(
+        self,
+        top_k: int,
+        max_concurrent: int,
+        max_bytes: int,
+        window: int,
+        niceness: int,
+    ):
+        self.top_k = top_k
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.window = window
+        self.stats = PrefetchStats()
+        self._jobs: dict[str, PrefetchJob] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent,
+            thread_name_prefix="prefetch",
+            initializer=lower_thread_priority,
+            initargs=(niceness,),
+        )
+
+    def _running(self) -> int:
+        return sum(1 for job in self._jobs.values() if not job.done.is_set())
+
+    def _reserved_bytes(self) -> int:
+        return sum(job.bytes for job in self._jobs.values() if not job.chosen)
+
+    def schedule(self, results: list):
+        """Start prefetching the top results of an answered inline query."""
+        for result in results[: self.top_k]:
+            video_id = result["id"]
+            if video_id in self._jobs:
+                continue
+            if os.path.exists(audio_path(video_id)):
+                continue
+            if (
+                self._running() >= self.max_concurrent
+                or self._reserved_bytes() >= self.max_bytes
+            ):
+                self.stats.skipped += 1
+                continue
+
+            job = PrefetchJob(
+                video_id=video_id, deadline=time.monotonic() + self.window
+            )
+            job.task = asyncio.create_task(self._run(job))
+            self._jobs[video_id] = job
+            self.stats.started += 1
+
+    async def _run(self, job: PrefetchJob):
+        def progress_callback(current, total, speed):
+            job.bytes = current or 0
+            if job.chosen:
+                return
+            if time.monotonic() > job.deadline:
+                raise PrefetchExpired(job.video_id)
+            if self._reserved_bytes() > self.max_bytes:
+                raise PrefetchExpired(job.video_id)
+
+        def error_callback(error, url):
+            if isinstance(error, PrefetchExpired):
+                job.given_up = True
+                logger.info(f"Prefetch of {job.video_id} given up")
+            else:
+                logger.info(f"Prefetch error: {repr(error)} for {url}")
+
+        try:
+            try:
+                result = await download(
+                    f"https://www.youtube.com/watch?v={job.video_id}",
+                    progress_callback=progress_callback,
+                    complete_callback=None,
+                    error_callback=error_callback,
+                    executor=self._executor,
+                    background=True,
+                )
+            except Exception as e:
+                # e.g. the database failing after the download, see download()
+                logger.error(f"Prefetch of {job.video_id} failed: {str(e)}")
+                result = None
+            job.done.set()
+
+            file_path = audio_path(job.video_id)
+            if result and os.path.exists(file_path):
+                job.bytes = os.path.getsize(file_path)
+            elif not job.given_up:
+                self.stats.failed += 1
+
+            # keep the job around until the window closes, so a late pick still counts
+            remaining = job.deadline - time.monotonic()
+            if remaining > 0 and not job.chosen:
+                await asyncio.sleep(remaining)
+
+            if not job.chosen:
+                self.stats.expired += 1
+                self.stats.wasted_bytes += job.bytes
+        finally:
+            # a job that never finishes would block its pickers and a slot for good
+            job.done.set()
+            self._jobs.pop(job.video_id, None)
+
+    async def claim(self, video_id: str) -> bool:
+        """
+        Mark a prefetched result as picked and wait for its download.
+        Returns True if the result was being prefetched.
+        """
+        job = self._jobs.get(video_id)
+        if job is None:
+            return False
+
+        if not job.chosen:
+            job.chosen = True
+            self.stats.hits += 1
+        await job.done.wait()
+        return True
+
+
+prefetcher: Prefetcher | None = None
+if PREFETCH_TOP_K > 0:
+    prefetcher = Prefetcher(
+        top_k=PREFETCH_TOP_K,
+        max_concurrent=PREFETCH_MAX_CONCURRENT,
+        max_bytes=PREFETCH_MAX_BYTES * 1024 * 1024,
+        window=PREFETCH_WINDOW,
+        niceness=PREFETCH_NICENESS,
+    )
@@ -0,0 +1,321 @@
+import asyncio
+import datetime
+import hashlib
+import hmac
+import os
+import shutil
+import uuid
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from urllib.parse import quote
+
+import aiohttp
+from loguru import logger
+from yarl import URL
+
+from config import (
+    STORAGE_BACKEND,
+    STORAGE_ROOT,
+    S3_ENDPOINT,
+    S3_BUCKET,
+    S3_ACCESS_KEY,
+    S3_SECRET_KEY,
+    S3_REGION,
+)
+from paths import audio_path, iter_files
+
+
+@dataclass
+class StoredObject:
+    key: str
+    size: int
+    modified_time: float
+
+
+def storage_key(path: str) -> str:
+    """Key of a local cache file, its path relative to the working directory."""
+    return os.path.relpath(path).replace(os.sep, "/")
+
+
+def _copy_atomic(source: str, target: str):
+    # readers on other nodes never see a half written file
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    temporary = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        shutil.copyfile(source, temporary)
+        os.replace(temporary, target)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+class StorageBackend:
+    """
+    Where cached audio and thumbnails are kept, shared by all nodes using
+    the same backend. Files are created and read through the local audio and
+    thumbnails folders, the backend keeps the shared copy under the same key.
+    """
+
+    # True when the backend is the local folders themselves, nothing is copied then
+    is_local_cache = False
+
+    async def put(self, key: str, path: str):
+        """Store the local file at path under key."""
+        raise NotImplementedError
+
+    async def get(self, key: str, path: str) -> bool:
+        """Copy the object to the local path, False if there is none."""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        return await self.size(key) is not None
+
+    async def size(self, key: str) -> int | None:
+        """Size of the object in bytes, None if there is none."""
+        raise NotImplementedError
+
+    async def delete(self, key: str) -> bool:
+        raise NotImplementedError
+
+    async def list(self, prefix: str) -> list[StoredObject]:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LocalStorage(StorageBackend):
+    """
+    Files in a directory. With the default root "." that is the local cache
+    itself, another root (e.g. a shared NFS mount) gets copies of it.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.is_local_cache = os.path.abspath(root) == os.path.abspath(".")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    async def put(self, key: str, path: str):
+        target = self._path(key)
+        if os.path.abspath(target) != os.path.abspath(path):
+            await asyncio.to_thread(_copy_atomic, path, target)
+
+    async def get(self, key: str, path: str) -> bool:
+        source = self._path(key)
+        if os.path.abspath(source) == os.path.abspath(path):
+            return os.path.exists(path)
+        try:
+            await asyncio.to_thread(_copy_atomic, source, path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def size(self, key: str) -> int | None:
+        try:
+            return os.path.getsize(self._path(key))
+        except FileNotFoundError:
+            return None
+
+    async def delete(self, key: str) -> bool:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            return False
+        return True
+
+    async def list(self, prefix: str) -> list[StoredObject]:
+        def scan():
+            objects = []
+            for entry in iter_files(self._path(prefix)):
+                stat = entry.stat()
+                key = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+                objects.append(StoredObject(key, stat.st_size, stat.st_mtime))
+            return objects
+
+        return await asyncio.to_thread(scan)
+
+
+class S3Storage(StorageBackend):
+    """
+    Objects in an S3 compatible bucket (AWS, MinIO, ...), addressed path
+    style and signed with AWS signature version 4.
+    """
+
+    def __init__(
+        self,
+        endpoint: str,
+        bucket: str,
+        access_key: str,
+        secret_key: str,
+        region: str = "us-east-1",
+    ):
+        self.endpoint = endpoint.rstrip("/")
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self._session: aiohttp.ClientSession | None = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    def _signed_request(self, method: str, key: str = "", query: dict | None = None):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+
+        path = quote(f"/{self.bucket}/{key}" if key else f"/{self.bucket}", safe="/-_.~")
+        canonical_query = "&".join(
+            f"{quote(name, safe='-_.~')}={quote(str(value), safe='-_.~')}"
+            for name, value in sorted((query or {}).items())
+        )
+        url = URL(self.endpoint)
+        host = url.host if url.is_default_port() else f"{url.host}:{url.port}"
+        # the body is streamed, so its hash isn't part of the signature
+        payload_hash = "UNSIGNED-PAYLOAD"
+        headers = {
+            "host": host,
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": amz_date,
+        }
+        signed_headers = ";".join(headers)
+        canonical_request = "\n".join([
+            method,
+            path,
+            canonical_query,
+            "".join(f"{name}:{value}\n" for name, value in headers.items()),
+            signed_headers,
+            payload_hash,
+        ])
+
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256",
+            amz_date,
+            scope,
+            hashlib.sha256(canonical_request.encode()).hexdigest(),
+        ])
+        signing_key = f"AWS4{self.secret_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            signing_key = hmac.new(signing_key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(signing_key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        headers["Authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+            f"SignedHeaders={signed_headers}, Signature={signature}"
+        )
+        del headers["host"]
+        request_url = f"{self.endpoint}{path}"
+        if canonical_query:
+            request_url += f"?{canonical_query}"
+        # already encoded the way it was signed, aiohttp must not touch it
+        return URL(request_url, encoded=True), headers
+
+    async def put(self, key: str, path: str):
+        url, headers = self._signed_request("PUT", key)
+        headers["Content-Length"] = str(os.path.getsize(path))
+        with open(path, "rb") as f:
+            async with self._get_session().put(url, data=f, headers=headers) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"S3 PUT {key} failed: {response.status} {await response.text()}")
+
+    async def get(self, key: str, path: str) -> bool:
+        url, headers = self._signed_request("GET", key)
+        async with self._get_session().get(url, headers=headers) as response:
+            if response.status == 404:
+                return False
+            if response.status != 200:
+                raise RuntimeError(f"S3 GET {key} failed: {response.status}")
+
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            temporary = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                with open(temporary, "wb") as f:
+                    async for chunk in response.content.iter_chunked(1024 * 1024):
+                        f.write(chunk)
+                os.replace(temporary, path)
+            except BaseException:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+                raise
+        return True
+
+    async def size(self, key: str) -> int | None:
+        url, headers = self._signed_request("HEAD", key)
+        async with self._get_session().head(url, headers=headers) as response:
+            if response.status == 404:
+                return None
+            if response.status != 200:
+                raise RuntimeError(f"S3 HEAD {key} failed: {response.status}")
+            return int(response.headers["Content-Length"])
+
+    async def delete(self, key: str) -> bool:
+        # S3 answers 204 whether or not the object existed
+        url, headers = self._signed_request("DELETE", key)
+        async with self._get_session().delete(url, headers=headers) as response:
+            if response.status not in (200, 204):
+                raise RuntimeError(f"S3 DELETE {key} failed: {response.status}")
+            return True
+
+    async def list(self, prefix: str) -> list[StoredObject]:
+        objects = []
+        query = {"list-type": "2", "prefix": prefix}
+        namespace = {"s3": "http://s3.amazonaws.com/doc/2006-03-01/"}
+        while True:
+            url, headers = self._signed_request("GET", query=query)
+            async with self._get_session().get(url, headers=headers) as response:
+                if response.status != 200:
+                    raise RuntimeError(f"S3 list {prefix} failed: {response.status}")
+                root = ET.fromstring(await response.read())
+
+            for item in root.findall("s3:Contents", namespace):
+                modified = item.findtext("s3:LastModified", namespaces=namespace)
+                objects.append(
+                    StoredObject(
+                        key=item.findtext("s3:Key", namespaces=namespace),
+                        size=int(item.findtext("s3:Size", namespaces=namespace)),
+                        modified_time=datetime.datetime.fromisoformat(
+                            modified.replace("Z", "+00:00")
+                        ).timestamp(),
+                    )
+                )
+
+            token = root.findtext("s3:NextContinuationToken", namespaces=namespace)
+            if root.findtext("s3:IsTruncated", namespaces=namespace) != "true" or not token:
+                return objects
+            query = {**query, "continuation-token": token}
+
+
+def create_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_ENDPOINT, S3_BUCKET, S3_ACCESS_KEY, S3_SECRET_KEY, S3_REGION)
+    if STORAGE_BACKEND != "local":
+        logger.warning(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND}, using local")
+    return LocalStorage(STORAGE_ROOT)
+
+
+storage = create_storage()
+
+
+async def fetch_audio(video_id: str) -> str:
+    """
+    Local path of a stored track, copied from the shared storage if this
+    node doesn't have it yet. Raises FileNotFoundError if nobody has it.
+    """
+    path = audio_path(video_id)
+    if os.path.exists(path):
+        return path
+    if not await storage.get(storage_key(path), path):
+        raise FileNotFoundError(path)
+    return path
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Test script for inline search admission control.
+This script saturates the search slots and a user's token bucket with a
+slow stand-in search and checks which queries are admitted, degraded or shed.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import admission
+import yt_utils
+from admission import Overloaded, SearchAdmission, TokenBucket
+
+
+def result(video_id: str) -> dict:
+    return {"id": video_id, "title": video_id, "uploader": "", "duration": 60}
+
+
+def test_token_bucket():
+    """Test that a bucket allows its burst and then its rate."""
+    bucket = TokenBucket(rate=1000, burst=2)
+    assert bucket.take() and bucket.take()
+    assert not bucket.take()
+    bucket.updated_at -= 0.01
+    assert bucket.take()
+    print("Test completed successfully!")
+
+
+def test_admission():
+    """Test admission, degraded answers and shedding."""
+    async def run():
+        gate = asyncio.Event()
+        calls = []
+
+        async def search_page(query, offset=0, limit=5):
+            calls.append(query)
+            await gate.wait()
+            return [result(query)], ""
+
+        async def search_catalogue(query, limit, max_duration=None):
+            return [result("catalogue")] if query == "known" else []
+
+        async def filter_known_bad(results):
+            return results
+
+        original_search_page = admission.search_page
+        original_search_catalogue = admission.search_catalogue
+        original_filter_known_bad = admission.filter_known_bad
+        admission.search_page = search_page
+        admission.search_catalogue = search_catalogue
+        admission.filter_known_bad = filter_known_bad
+        yt_utils._search_cursors.clear()
+        try:
+            controller = SearchAdmission(
+                max_concurrent=1, queue_timeout=0.05, user_rate=0.001, user_burst=2
+            )
+            running = asyncio.create_task(controller.search("slow", 0, user_id=1))
+            while controller.running == 0:
+                await asyncio.sleep(0.001)
+
+            # the only slot is busy: catalogue hits are served, unknown queries shed
+            results, next_offset, degraded = await controller.search("known", 0, user_id=2)
+            assert degraded and results[0]["id"] == "catalogue" and next_offset == ""
+            try:
+                await controller.search("unknown", 0, user_id=3)
+                raise AssertionError("expected Overloaded")
+            except Overloaded:
+                pass
+
+            gate.set()
+            results, _, degraded = await running
+            assert results[0]["id"] == "slow" and not degraded
+
+            # user 1 used one of two tokens, the third search is over budget
+            await controller.search("second", 0, user_id=1)
+            _, _, degraded = await controller.search("known", 0, user_id=1)
+            assert degraded
+            assert calls == ["slow", "second"]
+
+            stats = controller.stats
+            print(f"Stats: {stats}")
+            assert (stats.admitted, stats.overloaded, stats.rate_limited) == (2, 2, 1)
+            assert (stats.degraded, stats.shed) == (2, 1)
+        finally:
+            admission.search_page = original_search_page
+            admission.search_catalogue = original_search_catalogue
+            admission.filter_known_bad = original_filter_known_bad
+
+    asyncio.run(run())
+    print("Test completed successfully!")
+
+
+def test_stale_results():
+    """Test that expired cached pages are served when the search is over budget."""
+    cursor = yt_utils._get_search_cursor("stale query")
+    cursor.seeded = True
+    cursor.exhausted = True
+    cursor.results = [result("old1"), result("old2")]
+    cursor.created_at -= yt_utils.SEARCH_CACHE_TTL + 1
+    try:
+        assert yt_utils.cached_search_page("stale query") is None
+        controller = SearchAdmission(
+            max_concurrent=1, queue_timeout=0.05, user_rate=0.001, user_burst=0
+        )
+        results, next_offset, degraded = asyncio.run(
+            controller.search("stale query", 0, user_id=1)
+        )
+        assert degraded and [r["id"] for r in results] == ["old1", "old2"]
+        assert next_offset == ""
+    finally:
+        yt_utils._search_cursors.clear()
+    print("Test completed successfully!")
+
+
+
+def test_answer_deadline():
+    """Test that a late search is answered with its partial results and fills the cache."""
+
+    async def run():
+        gate = asyncio.Event()
+        calls = []
+
+        async def search_page(query, offset=0, limit=5):
+            calls.append(query)
+            cursor = yt_utils._get_search_cursor(query)
+            cursor.seeded = True
+            cursor.results = [result("first")]
+            await gate.wait()
+            cursor.results.append(result("second"))
+            cursor.exhausted = True
+            return list(cursor.results), ""
+
+        async def search_catalogue(query, limit, max_duration=None):
+            return []
+
+        original_search_page = admission.search_page
+        original_search_catalogue = admission.search_catalogue
+        admission.search_page = search_page
+        admission.search_catalogue = search_catalogue
+        yt_utils._search_cursors.clear()
+        try:
+            controller = SearchAdmission(
+                max_concurrent=2, queue_timeout=1, user_rate=0, user_burst=0, deadline=0.05
+            )
+            results, next_offset, degraded = await controller.search("partial", 0, user_id=1)
+            assert degraded and [r["id"] for r in results] == ["first"] and next_offset == ""
+            assert controller.stats.late == 1 and controller.running == 1
+
+            # nothing found by the deadline and nothing to fall back on
+            never = asyncio.Event()
+
+            async def stuck_search_page(query, offset=0, limit=5):
+                await never.wait()
+                return [], ""
+
+            admission.search_page = stuck_search_page
+            try:
+                await controller.search("stuck", 0, user_id=1)
+                raise AssertionError("expected Overloaded")
+            except Overloaded:
+                pass
+            admission.search_page = search_page
+
+            # the search went on and the next query is answered in full from the cache
+            gate.set()
+            while controller.running > 1:
+                await asyncio.sleep(0.001)
+            results, _, degraded = await controller.search("partial", 0, user_id=1)
+            assert not degraded and [r["id"] for r in results] == ["first", "second"]
+            assert calls == ["partial"]
+            never.set()
+            while controller.running:
+                await asyncio.sleep(0.001)
+        finally:
+            admission.search_page = original_search_page
+            admission.search_catalogue = original_search_catalogue
+            yt_utils._search_cursors.clear()
+
+    asyncio.run(run())
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_token_bucket()
+    test_admission()
+    test_stale_results()
+    test_answer_deadline()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Test script for downloads through the aria2 RPC daemon.
+This script runs a stand-in aria2 JSON-RPC server and downloads through it
+the way yt-dlp does from a worker thread.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from aiohttp import web
+
+from aria2_rpc import Aria2Daemon, Aria2Error, Aria2YoutubeDL
+
+
+async def start_stand_in_aria2(downloads: dict, calls: list) -> web.AppRunner:
+    """Every download takes three polls, then its file appears."""
+
+    async def handle(request: web.Request):
+        body = await request.json()
+        token, *params = body["params"]
+        if token != "token:secret":
+            return web.json_response({"id": body["id"], "error": {"code": 1, "message": "Unauthorized"}})
+        method = body["method"]
+        calls.append((method, params))
+
+        if method == "aria2.getVersion":
+            result = {"version": "1.37.0"}
+        elif method == "aria2.addUri":
+            result = f"gid{len(downloads)}"
+            downloads[result] = {"options": params[1], "polls": 0, "status": "active"}
+        elif method == "aria2.tellStatus":
+            download = downloads.get(params[0])
+            if download is None:
+                return web.json_response({"id": body["id"], "error": {"code": 1, "message": "not found"}})
+            download["polls"] += 1
+            if download["status"] == "active" and download["polls"] >= 3:
+                options = download["options"]
+                with open(os.path.join(options["dir"], options["out"]), "wb") as f:
+                    f.write(b"audio data")
+                download["status"] = "complete"
+            result = {
+                "gid": params[0],
+                "status": download["status"],
+                "totalLength": "10",
+                "completedLength": str(min(10, download["polls"] * 4)),
+                "downloadSpeed": "100",
+            }
+        elif method == "aria2.forceRemove":
+            downloads[params[0]]["status"] = "removed"
+            result = params[0]
+        else:
+            result = "OK"
+        return web.json_response({"id": body["id"], "jsonrpc": "2.0", "result": result})
+
+    app = web.Application()
+    app.router.add_post("/jsonrpc", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8768).start()
+    return runner
+
+
+def make_daemon() -> Aria2Daemon:
+    return Aria2Daemon(
+        url="http://127.0.0.1:8768/jsonrpc",
+        port=0,
+        secret="secret",
+        global_options={},
+        download_options={"split": "4", "max-connection-per-server": "4"},
+        poll_interval=0.05,
+    )
+
+
+def test_aria2_download():
+    """Test a download handed over by yt-dlp, with progress and completion."""
+
+    async def run():
+        downloads, calls = {}, []
+        runner = await start_stand_in_aria2(downloads, calls)
+        daemon = make_daemon()
+        try:
+            assert await daemon.start()
+            with tempfile.TemporaryDirectory() as root:
+                filename = os.path.join(root, "video.f251.webm")
+                progress = []
+                ydl = Aria2YoutubeDL({"quiet": True, "progress_hooks": [progress.append]}, daemon=daemon)
+                info = {
+                    "url": "https://example.com/audio",
+                    "protocol": "https",
+                    "http_headers": {"User-Agent": "test"},
+                }
+                result = await asyncio.to_thread(ydl.dl, filename, info)
+                assert result == (True, True)
+
+                with open(filename, "rb") as f:
+                    assert f.read() == b"audio data"
+                assert not os.path.exists(f"{filename}.part")
+
+                options = downloads["gid0"]["options"]
+                assert options["out"] == "video.f251.webm.part"
+                assert options["split"] == "4"
+                assert options["header"] == ["User-Agent: test"]
+
+                statuses = [p["status"] for p in progress]
+                assert statuses[0] == "downloading" and statuses[-1] == "finished"
+                assert progress[-1]["total_bytes"] == len(b"audio data")
+                # the result is dropped from aria2 right after the waiter is told
+                for _ in range(50):
+                    if ("aria2.removeDownloadResult", ["gid0"]) in calls:
+                        break
+                    await asyncio.sleep(0.01)
+                else:
+                    raise AssertionError("the download result should be removed")
+                print(f"Progress: {[(p['status'], p['downloaded_bytes']) for p in progress]}")
+        finally:
+            await daemon.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+    print("Test completed successfully!")
+
+
+def test_aria2_abort():
+    """Test that a progress hook raising removes the download from aria2."""
+
+    class Expired(Exception):
+        pass
+
+    def expire(progress):
+        raise Expired()
+
+    async def run():
+        downloads, calls = {}, []
+        runner = await start_stand_in_aria2(downloads, calls)
+        daemon = make_daemon()
+        try:
+            assert await daemon.start()
+            with tempfile.TemporaryDirectory() as root:
+                filename = os.path.join(root, "video.mp3")
+                try:
+                    await asyncio.to_thread(
+                        daemon.download_sync, filename, "https://example.com/audio", {}, [expire], {}
+                    )
+                except Expired:
+                    pass
+                else:
+                    raise AssertionError("the hook's exception should propagate")
+                assert ("aria2.forceRemove", ["gid0"]) in calls
+                assert not os.path.exists(filename)
+
+            # a wrong token is an error, not a hang
+            daemon.secret = "wrong"
+            try:
+                await daemon.call("getVersion")
+            except Aria2Error as e:
+                print(f"Rejected: {e}")
+            else:
+                raise AssertionError("a wrong token should be rejected")
+        finally:
+            await daemon.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_aria2_download()
+    test_aria2_abort()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Test script for cleaning up the audio folder.
+This script checks that stale leftovers of interrupted downloads are
+deleted while fresh ones and finished files are kept, and that the
+downloaded flags are reconciled with the files in storage and the shared
+storage is trimmed, using a temporary audio folder, storage root and
+SQLite database.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlmodel import SQLModel, create_engine, select
+
+import audio_manager
+import database
+from audio_manager import delete_stale_temporary_files, mark_not_downloaded, reconcile_downloaded
+from database import File, get_file, get_session
+from storage import LocalStorage
+
+
+def touch(path: str, age: float = 0, content: bytes = b"data"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    modified = time.time() - age
+    os.utime(path, (modified, modified))
+
+
+def test_delete_stale_temporary_files():
+    """Test that only temporary files older than max_age are deleted."""
+    with tempfile.TemporaryDirectory() as root:
+        old, fresh = 7200, 60
+        files = {
+            "ab/old1.f251.webm.part": old,
+            "ab/old1.f251.webm.part.aria2": old,
+            "ab/old1.f251.webm": old,
+            "ab/old1.info.json": old,
+            "cd/old2.mp3.0123abcd.tmp": old,
+            "cd/old2.f140.mp3": old,
+            "ab/fresh1.f251.webm.part": fresh,
+            "cd/fresh2.mp3.4567cdef.tmp": fresh,
+            "ab/done1.mp3": old,
+            "cd/.keep": old,
+        }
+        for name, age in files.items():
+            touch(os.path.join(root, name), age)
+
+        deleted = delete_stale_temporary_files(root, max_age=3600)
+        print(f"Deleted: {deleted}")
+        assert sorted(deleted) == [
+            "old1.f251.webm",
+            "old1.f251.webm.part",
+            "old1.f251.webm.part.aria2",
+            "old1.info.json",
+            "old2.f140.mp3",
+            "old2.mp3.0123abcd.tmp",
+        ]
+        remaining = sorted(
+            os.path.relpath(os.path.join(path, name), root)
+            for path, _, names in os.walk(root)
+            for name in names
+        )
+        assert remaining == ["ab/done1.mp3", "ab/fresh1.f251.webm.part", "cd/.keep", "cd/fresh2.mp3.4567cdef.tmp"]
+
+        # nothing to do in a folder that doesn't exist yet
+        assert delete_stale_temporary_files(os.path.join(root, "missing"), max_age=0) == []
+    print("Test completed successfully!")
+
+
+class CountingStorage(LocalStorage):
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.listed = 0
+
+    async def list(self, prefix: str):
+        self.listed += 1
+        return await super().list(prefix)
+
+
+def run_with_shared_storage(checks):
+    original_engine = database.engine
+    original_storage = audio_manager.storage
+    with tempfile.TemporaryDirectory() as root:
+        engine = create_engine(f"sqlite:///{os.path.join(root, 'files.sqlite3')}")
+        database.engine = engine
+        database._file_cache.clear()
+        audio_manager.storage = CountingStorage(os.path.join(root, "shared"))
+        try:
+            SQLModel.metadata.create_all(engine)
+            asyncio.run(checks(os.path.join(root, "shared", audio_manager.AUDIO_DIR)))
+        finally:
+            database.engine = original_engine
+            database._file_cache.clear()
+            audio_manager.storage = original_storage
+            engine.dispose()
+
+
+def test_reconcile_downloaded():
+    """Test that the downloaded flags follow the finished files in storage."""
+    run_with_shared_storage(run_reconcile_checks)
+    print("Test completed successfully!")
+
+
+def test_cleanup_storage():
+    """Test that the shared storage is trimmed to its limit and not listed for every track."""
+    run_with_shared_storage(run_cleanup_storage_checks)
+    print("Test completed successfully!")
+
+
+def downloaded_flags() -> dict:
+    with get_session() as session:
+        return {file.video_id: file.downloaded for file in session.exec(select(File)).all()}
+
+
+async def run_reconcile_checks(audio_root: str):
+    with get_session() as session:
+        for video_id, downloaded in [
+            ("flagged_present", True),
+            ("flagged_missing", True),
+            ("unflagged_present", False),
+            ("partial", False),
+            ("untouched", False),
+        ]:
+            session.add(File(video_id=video_id, title=video_id, uploader="Channel", downloaded=downloaded))
+        session.commit()
+
+    touch(os.path.join(audio_root, "ab", "flagged_present.mp3"))
+    touch(os.path.join(audio_root, "cd", "unflagged_present.mp3"))
+    # only finished files count
+    touch(os.path.join(audio_root, "ab", "partial.f251.webm.part"))
+    touch(os.path.join(audio_root, "ab", "partial.f251.mp3"))
+    # an object without a row changes nothing
+    touch(os.path.join(audio_root, "ef", "unknown.mp3"))
+
+    # cached rows are read again afterwards
+    assert (await get_file("flagged_missing"))["downloaded"]
+
+    assert await reconcile_downloaded(batch_size=1) == 2
+    assert downloaded_flags() == {
+        "flagged_present": True,
+        "flagged_missing": False,
+        "unflagged_present": True,
+        "partial": False,
+        "untouched": False,
+    }
+    assert not (await get_file("flagged_missing"))["downloaded"]
+
+    # a second pass finds nothing left to change
+    assert await reconcile_downloaded() == 0
+
+    # evicted files are cleared directly
+    assert (await get_file("flagged_present"))["downloaded"]
+    mark_not_downloaded([])
+    mark_not_downloaded(["flagged_present", "unflagged_present"])
+    flags = downloaded_flags()
+    assert not flags["flagged_present"] and not flags["unflagged_present"]
+    assert not (await get_file("flagged_present"))["downloaded"]
+
+
+async def run_cleanup_storage_checks(audio_root: str):
+    megabyte = b"\0" * 1024 * 1024
+    with get_session() as session:
+        for video_id, uses in [("popular", 10), ("rare", 1), ("middle", 5)]:
+            session.add(
+                File(video_id=video_id, title=video_id, uploader="Channel", uses_count=uses, downloaded=True)
+            )
+            touch(os.path.join(audio_root, "ab", f"{video_id}.mp3"), content=megabyte)
+        session.commit()
+
+    storage = audio_manager.storage
+    audio_manager._last_storage_cleanup = 0.0
+    # the least used file goes first
+    assert await audio_manager.cleanup_storage(max_size_mb=2) == ["rare"]
+    assert storage.listed == 1
+    assert not downloaded_flags()["rare"]
+
+    # right after a cleanup the storage isn't listed again
+    touch(os.path.join(audio_root, "ab", "rare.mp3"), content=megabyte)
+    assert await audio_manager.cleanup_storage(max_size_mb=2) == []
+    assert storage.listed == 1
+
+    assert await audio_manager.cleanup_storage(max_size_mb=2, force=True) == ["rare"]
+    assert storage.listed == 2
+
+    # once the interval is over it runs again
+    original_interval = audio_manager.STORAGE_CLEANUP_INTERVAL
+    audio_manager.STORAGE_CLEANUP_INTERVAL = 0
+    try:
+        assert await audio_manager.cleanup_storage(max_size_mb=1) == ["middle"]
+        assert storage.listed == 3
+    finally:
+        audio_manager.STORAGE_CLEANUP_INTERVAL = original_interval
+
+
+if __name__ == "__main__":
+    test_delete_stale_temporary_files()
+    test_reconcile_downloaded()
+    test_cleanup_storage()
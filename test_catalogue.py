@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Test script for the local catalogue search.
+This script runs against a temporary SQLite database and checks that the
+FTS index follows inserts, updates and deletes, that words match as
+prefixes, that query syntax in user input is harmless and that long
+tracks are filtered out. Rows that add_use created without any metadata
+are looked up and ranked too.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlmodel import SQLModel, create_engine, select
+
+import database
+from database import File, add_file, add_use, get_file, get_popular_files, get_session, search_catalogue
+
+
+def test_catalogue():
+    """Test the SQLite FTS catalogue end to end."""
+    original_engine = database.engine
+    with tempfile.TemporaryDirectory() as root:
+        engine = create_engine(f"sqlite:///{os.path.join(root, 'catalogue.sqlite3')}")
+        database.engine = engine
+        database._file_cache.clear()
+        try:
+            SQLModel.metadata.create_all(engine)
+            database.create_catalogue_index()
+            asyncio.run(run_catalogue_checks())
+        finally:
+            database.engine = original_engine
+            database._file_cache.clear()
+            engine.dispose()
+    print("Test completed successfully!")
+
+
+async def ids(query: str, max_duration: int | None = None) -> list[str]:
+    return [result["id"] for result in await search_catalogue(query, 10, max_duration)]
+
+
+async def run_catalogue_checks():
+    # inserted rows are indexed by the insert trigger, ids come from the database
+    await add_file("lucky", "Get Lucky", "Daft Punk - Topic", "https://i.ytimg.com/vi/lucky/hq.jpg", 248)
+    await add_file("around", "Around the World", "Daft Punk", None, 429)
+    await add_file("mix", "Daft Punk Megamix", "DJ Someone", None, 3 * 3600)
+    await add_file("other", "Something else", "Band", None, 200)
+
+    # every word matches as a prefix, all words have to match
+    assert await ids("daf pun lucky") == ["lucky"]
+    assert sorted(await ids("daft punk")) == ["around", "lucky", "mix"]
+    assert await ids("get-luck") == ["lucky"]
+
+    # uses break ties between equally good matches
+    for _ in range(5):
+        await add_use("around", 1)
+    assert (await ids("daft punk"))[0] == "around"
+
+    # long tracks are left out when a limit is given
+    assert "mix" not in await ids("daft punk", max_duration=600)
+
+    # quotes and fts5 operators in the input are plain words
+    for query in ('daft" OR "x', "punk AND NOT", "NEAR(daft punk)", "lucky*", "^get", "{title}: x"):
+        print(f"{query!r} -> {await ids(query)}")
+    assert await ids('"get lucky') == ["lucky"]
+    assert await ids("punk AND NOT") == []
+    assert await ids("!!! ???") == []
+
+    # the update trigger replaces the indexed words
+    await add_file("other", "Harder Better Faster", "Daft Punk", None, 224)
+    assert await ids("harder") == ["other"]
+    assert await ids("something") == []
+
+    # the delete trigger drops the row from the index
+    with get_session() as session:
+        session.delete(session.exec(select(File).where(File.video_id == "lucky")).one())
+        session.commit()
+    assert await ids("lucky") == []
+
+    # add_use creates a bare row for a video it doesn't know
+    await add_use("bare", 1)
+    bare = await get_file("bare")
+    assert (bare["title"], bare["performer"], bare["track"]) == (None, "", "")
+    popular = {file["video_id"]: file for file in await get_popular_files(10, 30)}
+    assert (popular["bare"]["performer"], popular["bare"]["track"]) == ("", "")
+    assert "bare" not in await ids("bare")
+
+    result = (await search_catalogue("harder", 1))[0]
+    assert result["url"] == "https://www.youtube.com/watch?v=other"
+    assert result["thumbnail"] == "https://i.ytimg.com/vi/other/hqdefault.jpg"
+
+
+if __name__ == "__main__":
+    test_catalogue()
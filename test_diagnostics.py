@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Test script for the diagnostics module.
+This script blocks the event loop on purpose and checks that the lag
+monitor catches it with its stack, and that both profile kinds report
+what the process was doing.
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from loguru import logger
+
+from diagnostics import LoopLagMonitor, Profiler, dump_tasks, profile_cpu
+
+
+def block_the_loop(seconds: float):
+    time.sleep(seconds)
+
+
+def test_loop_lag_monitor():
+    """Test that a blocking call is logged once, with the blocking function in the stack."""
+    warnings = []
+    sink = logger.add(lambda message: warnings.append(str(message)), level="WARNING")
+
+    async def run():
+        monitor = LoopLagMonitor(interval=0.02, threshold=0.1)
+        monitor.start()
+        try:
+            await asyncio.sleep(0.1)
+            block_the_loop(0.4)
+            await asyncio.sleep(0.1)
+        finally:
+            monitor.stop()
+        return monitor
+
+    try:
+        monitor = asyncio.run(run())
+    finally:
+        logger.remove(sink)
+
+    print(f"Blocks: {monitor.stats.blocks}, max lag: {monitor.stats.max_lag:.3f}s")
+    assert monitor.stats.blocks == 1
+    assert monitor.stats.max_lag >= 0.3
+    assert monitor.stats.percentile(0.5) < 0.1
+    assert len(warnings) == 1 and "block_the_loop" in warnings[0]
+    print("Test completed successfully!")
+
+
+def busy_loop(seconds: float):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sum(range(1000))
+
+
+def test_profiles():
+    """Test the sampling profile and the task dump."""
+
+    async def sleeper():
+        await asyncio.sleep(10)
+
+    async def run():
+        busy = asyncio.create_task(asyncio.to_thread(busy_loop, 0.5))
+        cpu_summary, cpu_report = await profile_cpu(0.3, interval=0.005)
+        await busy
+
+        task = asyncio.create_task(sleeper())
+        tasks_summary, tasks_report = await dump_tasks(0.2, interval=0.02)
+        task.cancel()
+        return cpu_summary, cpu_report, tasks_summary, tasks_report
+
+    cpu_summary, cpu_report, tasks_summary, tasks_report = asyncio.run(run())
+    print(cpu_summary)
+    print(tasks_summary)
+    assert "busy_loop" in cpu_report and "Collapsed stacks:" in cpu_report
+    assert "sleeper at sleeper" in tasks_report
+
+    profiler = Profiler(max_seconds=30)
+    assert profiler.parse_args("/profile") == ("cpu", 10.0)
+    assert profiler.parse_args("/profile tasks 5") == ("tasks", 5.0)
+    for text in ("/profile 60", "/profile cpu soon"):
+        try:
+            profiler.parse_args(text)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"{text!r} should be rejected")
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_loop_lag_monitor()
+    test_profiles()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Test script for the File row cache behind get_file.
+This script checks that repeated lookups don't query the configured
+database and that this process's writes keep the cached rows current.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlmodel import select
+
+import database
+from database import (
+    File,
+    create_db_and_tables,
+    get_session,
+    get_file,
+    set_downloaded,
+    set_file_id,
+    forget_files,
+)
+
+
+def clear_files():
+    with get_session() as session:
+        for file in session.exec(select(File).where(File.video_id.like("cachetest%"))).all():
+            session.delete(file)
+        session.commit()
+    database._file_cache.clear()
+
+
+def test_file_cache():
+    """Test read-through caching and write-through updates of File rows."""
+    create_db_and_tables()
+    clear_files()
+    try:
+        with get_session() as session:
+            # explicit ids, the test database may not generate them
+            session.add(File(id=987650, video_id="cachetest1", title="Artist - Song", uploader="Channel"))
+            session.commit()
+        asyncio.run(run_file_cache_checks())
+    finally:
+        clear_files()
+    print("Test completed successfully!")
+
+
+def rename_behind_cache(video_id: str, title: str):
+    with get_session() as session:
+        file = session.exec(select(File).where(File.video_id == video_id)).first()
+        file.title = title
+        session.commit()
+
+
+async def run_file_cache_checks():
+    assert await get_file("cachetest_missing") is None
+
+    file = await get_file("cachetest1")
+    assert (file["performer"], file["track"]) == ("Artist", "Song")
+    assert not file["downloaded"] and file["file_id"] is None
+
+    # the second lookup is answered from memory, a change elsewhere isn't seen
+    rename_behind_cache("cachetest1", "Other - Title")
+    assert (await get_file("cachetest1"))["title"] == "Artist - Song"
+
+    # callers get copies
+    file["title"] = "changed by a caller"
+    assert (await get_file("cachetest1"))["title"] == "Artist - Song"
+
+    # writes of this process go through
+    await set_downloaded("cachetest1")
+    await set_file_id("cachetest1", "file123")
+    file = await get_file("cachetest1")
+    assert file["downloaded"] and file["file_id"] == "file123"
+
+    forget_files(["cachetest1"])
+    assert (await get_file("cachetest1"))["title"] == "Other - Title"
+
+    # entries older than the TTL are read again
+    original_ttl = database.FILE_CACHE_TTL
+    database.FILE_CACHE_TTL = -1
+    try:
+        rename_behind_cache("cachetest1", "Third - Title")
+        assert (await get_file("cachetest1"))["title"] == "Third - Title"
+    finally:
+        database.FILE_CACHE_TTL = original_ttl
+
+
+if __name__ == "__main__":
+    test_file_cache()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script for the database job queue.
+This script checks claiming, retries, visibility timeouts and waiting for
+results against the configured database, with a stand-in job handler.
+"""
+
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlmodel import select
+
+import database
+import jobs
+from database import (
+    Job,
+    create_db_and_tables,
+    get_session,
+    enqueue_job,
+    claim_job,
+    extend_job,
+    complete_job,
+    fail_job,
+    get_job,
+)
+
+
+def clear_jobs():
+    with get_session() as session:
+        for job in session.exec(select(Job).where(Job.kind.like("test%"))).all():
+            session.delete(job)
+        session.commit()
+
+
+def expire(job_id: int, field: str):
+    with get_session() as session:
+        job = session.get(Job, job_id)
+        setattr(job, field, datetime.now(timezone.utc) - timedelta(seconds=1))
+        session.commit()
+
+
+def test_jobs():
+    """Test the life cycle of queued jobs."""
+    create_db_and_tables()
+    clear_jobs()
+    try:
+        asyncio.run(run_queue_checks())
+        asyncio.run(run_worker_checks())
+    finally:
+        clear_jobs()
+    print("Test completed successfully!")
+
+
+async def run_queue_checks():
+    job_id = await enqueue_job("test", {"video_id": "a"}, key="a", max_attempts=2)
+    assert await enqueue_job("test", {"video_id": "a"}, key="a") == job_id
+    print(f"Enqueued job {job_id}")
+
+    # another frontend enqueued it after this one looked: the index turns it away
+    lookups = []
+    original_active_job_id = database._active_job_id
+
+    def late_lookup(session, kind, key):
+        lookups.append(key)
+        return None if len(lookups) == 1 else original_active_job_id(session, kind, key)
+
+    database._active_job_id = late_lookup
+    try:
+        assert await enqueue_job("test", {"video_id": "a"}, key="a") == job_id
+    finally:
+        database._active_job_id = original_active_job_id
+    assert lookups == ["a", "a"]
+    with get_session() as session:
+        assert len(session.exec(select(Job).where(Job.kind == "test", Job.key == "a")).all()) == 1
+
+    job = await claim_job("worker-1", ["test"], visibility_timeout=60)
+    assert job["id"] == job_id and job["payload"] == {"video_id": "a"}
+    assert job["attempts"] == 1
+    assert await claim_job("worker-2", ["test"], visibility_timeout=60) is None
+
+    # a failed attempt is retried after the delay
+    assert await fail_job(job_id, "worker-1", "boom", retry_delay=60)
+    assert (await get_job(job_id))["status"] == "queued"
+    assert await claim_job("worker-2", ["test"], visibility_timeout=60) is None
+    expire(job_id, "run_after")
+
+    # a worker that stops renewing its lock loses the job
+    job = await claim_job("worker-2", ["test"], visibility_timeout=60)
+    assert job["attempts"] == 2
+    expire(job_id, "locked_until")
+    assert not await complete_job(job_id, "worker-1", {"ok": True})
+    # out of attempts, so the expired job is given up instead of reclaimed
+    assert await claim_job("worker-3", ["test"], visibility_timeout=60) is None
+    job = await get_job(job_id)
+    assert job["status"] == "failed"
+    print(f"Job {job_id} ended as {job['status']}: {job['error']}")
+    assert not await extend_job(job_id, "worker-2", 60)
+
+
+async def run_worker_checks():
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload["n"])
+        if len(calls) == 1:
+            raise RuntimeError("first attempt fails")
+        return {"n": payload["n"]}
+
+    jobs.JOB_HANDLERS["test_worker"] = handler
+    worker = jobs.JobWorker(
+        kinds=["test_worker"],
+        concurrency=1,
+        visibility_timeout=60,
+        poll_interval=0.01,
+        retry_delay=0,
+    )
+    try:
+        job_id = await enqueue_job("test_worker", {"n": 7})
+        waiter = asyncio.create_task(jobs.wait_for_job(job_id, timeout=10))
+        assert await worker.run_one("slot-0")
+        assert await worker.run_one("slot-0")
+        job = await waiter
+        assert job["status"] == "done" and job["result"] == {"n": 7}
+        assert calls == [7, 7]
+        print(f"Worker finished job {job_id} after {job['attempts']} attempts")
+    finally:
+        del jobs.JOB_HANDLERS["test_worker"]
+
+
+if __name__ == "__main__":
+    test_jobs()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Test script for the self-hosted Bot API support.
+This script runs a stand-in Bot API server and checks that in local mode
+cached audio is sent by path instead of being uploaded.
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+import aiogram_handlers
+from aiogram_client import local_file_uri
+from paths import audio_path
+
+
+async def start_stand_in_server(requests: list) -> web.AppRunner:
+    async def handle(request: web.Request):
+        form = await request.post()
+        method = request.match_info["method"]
+        requests.append((method, form))
+        if method == "sendAudio":
+            result = {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": -1, "type": "group"},
+                "audio": {"file_id": "stand-in-file-id", "file_unique_id": "u", "duration": 1},
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8765).start()
+    return runner
+
+
+def test_local_file_uri():
+    """Test that paths are made absolute and mapped onto the server's root."""
+    path = audio_path("test_local")
+    assert local_file_uri(path, root="") == f"file://{os.path.abspath(path)}"
+    assert local_file_uri(path, root="/srv/bot") == f"file:///srv/bot/{path}"
+    print("Test completed successfully!")
+
+
+def test_local_bot_api():
+    """Test that uploads through a local server pass the file path."""
+    asyncio.run(run_local_upload())
+    print("Test completed successfully!")
+
+
+async def run_local_upload():
+    requests = []
+    runner = await start_stand_in_server(requests)
+    session = AiohttpSession(
+        api=TelegramAPIServer.from_base("http://127.0.0.1:8765", is_local=True)
+    )
+    bot = Bot(token="123:abc", session=session)
+
+    file_path = audio_path("test_local")
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "wb") as f:
+        f.write(b"\0" * 1024)
+
+    original_bot = aiogram_handlers.aiogram_bot
+    original_local = aiogram_handlers.BOT_API_LOCAL
+    original_set_file_id = aiogram_handlers.set_file_id
+
+    async def set_file_id(video_id, file_id):
+        pass
+
+    aiogram_handlers.aiogram_bot = bot
+    aiogram_handlers.BOT_API_LOCAL = True
+    aiogram_handlers.set_file_id = set_file_id
+    try:
+        file_id = await aiogram_handlers.upload_audio(
+            "test_local", "song.mp3", None, "Song", "Artist"
+        )
+        assert file_id == "stand-in-file-id"
+
+        method, form = requests[0]
+        assert method == "sendAudio"
+        assert form["audio"] == local_file_uri(file_path)
+        assert [method for method, _ in requests] == ["sendAudio", "deleteMessage"]
+        print(f"sendAudio got audio={form['audio']}")
+    finally:
+        aiogram_handlers.aiogram_bot = original_bot
+        aiogram_handlers.BOT_API_LOCAL = original_local
+        aiogram_handlers.set_file_id = original_set_file_id
+        os.remove(file_path)
+        await bot.session.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    test_local_file_uri()
+    test_local_bot_api()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Test script for the batched SQLite to PostgreSQL migration.
+This script migrates a small old-schema SQLite database into a temporary
+SQLite target, interrupting the first run to check that it resumes, and checks
+the data the COPY path sends to PostgreSQL.
+"""
+
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlalchemy import text
+from sqlmodel import create_engine
+
+import database
+import migrate_sqlite_to_postgres as migration
+
+FIRST_ID = 900_000_000
+
+
+def create_source(path: str, files: int, users: int):
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE files (id INTEGER PRIMARY KEY, video_id TEXT, uses_count INTEGER, "
+        "duration INTEGER, thumbnail TEXT, title TEXT, uploader TEXT, downloaded INTEGER)"
+    )
+    connection.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, sent_videos_count INTEGER)")
+    connection.executemany(
+        "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [
+            (FIRST_ID + i, f"migrated{i}", None if i % 2 else i, 180, None, f"Title {i}", "", i % 3)
+            for i in range(files)
+        ],
+    )
+    connection.executemany(
+        "INSERT INTO users VALUES (?, ?)", [(FIRST_ID + i, i) for i in range(users)]
+    )
+    connection.commit()
+    connection.close()
+
+
+def test_migration():
+    """Test that an interrupted migration resumes without losing or duplicating rows."""
+    original_engine = database.engine
+    original_target = migration.postgres_engine
+    with tempfile.TemporaryDirectory() as folder:
+        engine = create_engine(f"sqlite:///{os.path.join(folder, 'target.sqlite3')}")
+        database.engine = migration.postgres_engine = engine
+        try:
+            run_migration_checks(folder, engine)
+        finally:
+            database.engine = original_engine
+            migration.postgres_engine = original_target
+            engine.dispose()
+    print("Test completed successfully!")
+
+
+def run_migration_checks(folder: str, engine):
+    source = os.path.join(folder, "db.sqlite3")
+    create_source(source, files=10, users=4)
+
+    original_write_batch = migration.write_batch
+    batches = []
+
+    def failing_write_batch(table, rows, last_id):
+        if table.target == "file" and len(batches) == 2:
+            raise RuntimeError("interrupted")
+        batches.append(last_id)
+        original_write_batch(table, rows, last_id)
+
+    migration.write_batch = failing_write_batch
+    try:
+        try:
+            migration.migrate_data(source, batch_size=3, workers=1)
+            raise AssertionError("expected the first run to fail")
+        except RuntimeError:
+            pass
+    finally:
+        migration.write_batch = original_write_batch
+
+    with engine.connect() as connection:
+        count = connection.execute(text('SELECT COUNT(*) FROM "file"')).scalar()
+    assert count == 6, count
+    print(f"First run stopped after {count} files")
+
+    migration.migrate_data(source, batch_size=3, workers=2)
+
+    with engine.connect() as connection:
+        rows = connection.execute(
+            text('SELECT video_id, uses_count, downloaded FROM "file" ORDER BY id')
+        ).all()
+        users = connection.execute(text('SELECT COUNT(*) FROM "user"')).scalar()
+    assert [row.video_id for row in rows] == [f"migrated{i}" for i in range(10)]
+    assert rows[1].uses_count == 0 and rows[2].uses_count == 2
+    assert [bool(row.downloaded) for row in rows[:3]] == [False, True, True]
+    assert users == 4
+    assert migration.get_checkpoint(migration.TABLES[0]) == FIRST_ID + 9
+
+
+class StandInCursor:
+    def __init__(self, copies: list):
+        self.copies = copies
+
+    def copy_expert(self, sql, file):
+        self.copies.append((sql, file.read()))
+
+
+class StandInConnection:
+    """Records the statements and COPY data of _copy_batch instead of running them."""
+
+    def __init__(self):
+        self.statements = []
+        self.copies = []
+        cursor = StandInCursor(self.copies)
+        self.connection = SimpleNamespace(dbapi_connection=SimpleNamespace(cursor=lambda: cursor))
+
+    def execute(self, statement):
+        self.statements.append(str(statement))
+
+
+def parse_copy_csv(data: str, null: str) -> list[list]:
+    """Fields of COPY csv data the way PostgreSQL reads them: only unquoted fields can be NULL."""
+    rows = []
+    for line in data.splitlines():
+        fields, field, quoted, in_quotes, i = [], "", False, False, 0
+        while i < len(line):
+            char = line[i]
+            if in_quotes:
+                if char == '"' and line[i + 1 : i + 2] == '"':
+                    field += '"'
+                    i += 1
+                elif char == '"':
+                    in_quotes = False
+                else:
+                    field += char
+            elif char == '"':
+                in_quotes = quoted = True
+            elif char == ",":
+                fields.append(field if quoted or field != null else None)
+                field, quoted = "", False
+            else:
+                field += char
+            i += 1
+        fields.append(field if quoted or field != null else None)
+        rows.append(fields)
+    return rows
+
+
+def test_copy_batch():
+    """Test that NULLs, empty strings and quotes survive the COPY path."""
+    table = migration.TABLES[0]
+    # a row created by add_use has nothing but its video id
+    rows = [
+        table.convert((1, "used", None, None, None, None, None, None)),
+        table.convert((2, 'say "hi", \\N', 3, 180, "", "Title, with comma", "\\N", 1)),
+    ]
+    connection = StandInConnection()
+    migration._copy_batch(connection, table, rows)
+
+    assert len(connection.copies) == 1
+    sql, data = connection.copies[0]
+    print(sql)
+    print(data)
+    null = re.search(r"NULL '([^']*)'", sql).group(1)
+    assert "FORMAT csv" in sql and null == migration.COPY_NULL
+    assert parse_copy_csv(data, null) == [
+        ["1", "used", "0", None, None, None, None, "f"],
+        ["2", 'say "hi", \\N', "3", "180", "", "Title, with comma", "\\N", "t"],
+    ]
+    assert "ON CONFLICT DO NOTHING" in connection.statements[-1]
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_copy_batch()
+    test_migration()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Test script for the negative cache.
+This script checks how download errors are classified, that failures and
+empty searches are remembered in the configured database, and that known
+bad results are neither searched nor downloaded again.
+"""
+
+import asyncio
+import sys
+import uuid
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from sqlmodel import select
+from yt_dlp.utils import DownloadError
+
+import yt_utils
+from database import NegativeEntry, create_db_and_tables, get_session, set_negative_entry
+from negative_cache import classify_failure, filter_known_bad, known_failure, remember_failure
+
+
+# keys of this run only, the configured database may hold real entries
+PREFIX = f"negtest{uuid.uuid4().hex[:12]}"
+
+
+def clear_entries():
+    with get_session() as session:
+        for entry in session.exec(select(NegativeEntry).where(NegativeEntry.key.like(f"{PREFIX}%"))).all():
+            session.delete(entry)
+        session.commit()
+
+
+def test_classify_failure():
+    """Test the reasons given to typical yt-dlp errors."""
+    cases = [
+        ("ERROR: [youtube] abc: Video unavailable. This video has been removed by the uploader", "unavailable"),
+        ("ERROR: [youtube] abc: Private video. Sign in if you've been granted access", "unavailable"),
+        ("ERROR: [youtube] abc: Sign in to confirm your age. This video may be inappropriate", "age_restricted"),
+        ("ERROR: [youtube] abc: The uploader has not made this video available in your country", "region_blocked"),
+        ("ERROR: [youtube] abc: Video unavailable. This content isn't available, try again later", "transient"),
+        ("ERROR: [youtube] abc: Sign in to confirm you're not a bot", "transient"),
+        ("ERROR: unable to download video data: HTTP Error 403: Forbidden", "transient"),
+    ]
+    for message, expected in cases:
+        reason = classify_failure(DownloadError(message))
+        print(f"{message!r} -> {reason}")
+        assert reason == expected
+    # anything that isn't yt-dlp's verdict on the video is not remembered
+    assert classify_failure(RuntimeError("ffmpeg exited with 1")) is None
+    print("Test completed successfully!")
+
+
+def test_negative_cache():
+    """Test remembering failures and empty searches and acting on them."""
+    create_db_and_tables()
+    clear_entries()
+    try:
+        asyncio.run(run_negative_cache_checks())
+    finally:
+        clear_entries()
+        yt_utils._search_cursors.clear()
+    print("Test completed successfully!")
+
+
+async def run_negative_cache_checks():
+    removed, ffmpeg, expired, ok = (f"{PREFIX}{name}" for name in ("removed", "ffmpeg", "expired", "ok"))
+    await remember_failure(removed, DownloadError("Video unavailable. This video has been removed"))
+    await remember_failure(ffmpeg, RuntimeError("ffmpeg exited with 1"))
+    # an expired entry is as good as none
+    await set_negative_entry("video", expired, "transient", -1)
+    assert await known_failure(removed) == "unavailable"
+    assert await known_failure(ffmpeg) is None
+    assert await known_failure(expired) is None
+
+    results = [{"id": ok}, {"id": removed}, {"id": expired}]
+    assert [r["id"] for r in await filter_known_bad(results)] == [ok, expired]
+
+    # a known bad video isn't downloaded again
+    downloads = []
+
+    def download_sync(url, progress_callback, complete_callback, error_callback):
+        downloads.append(url)
+        return None
+
+    original_download_sync = yt_utils._download_sync
+    yt_utils._download_sync = download_sync
+    try:
+        assert await yt_utils.download(f"https://www.youtube.com/watch?v={removed}") is None
+        assert downloads == []
+    finally:
+        yt_utils._download_sync = original_download_sync
+
+    # a query that found nothing isn't searched again, not even by another process
+    searches = []
+
+    def search_entries(query):
+        searches.append(query)
+        yield from ()
+
+    original_search_entries = yt_utils._search_entries
+    yt_utils._search_entries = search_entries
+    try:
+        assert await yt_utils.search_page(f"{PREFIX}  Nothing") == ([], "")
+        yt_utils._search_cursors.clear()
+        assert await yt_utils.search_page(f"{PREFIX.upper()} nothing") == ([], "")
+        assert searches == [f"{PREFIX}  Nothing"]
+    finally:
+        yt_utils._search_entries = original_search_entries
+
+
+if __name__ == "__main__":
+    test_classify_failure()
+    test_negative_cache()
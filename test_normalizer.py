@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Test script for the performer/title normalizer.
+This script checks the heuristics on typical YouTube titles and that
+repeated pairs are answered from the memo.
+"""
+
+import sys
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from utils import extract_performer_title, normalize_results
+
+CASES = [
+    (("Daft Punk - Topic", "Get Lucky (2013)"), ("Daft Punk", "Get Lucky")),
+    (("Channel", "Artist - Song"), ("Artist", "Song")),
+    (("Artist", "Artist - Song"), ("Artist", "Song")),
+    (("Uploader", "A — B - C"), ("B", "C")),
+    (("Label", "Artist - Song - Live"), ("Artist", "Song - Live")),
+    (("Uploader", "Artist - Song, 2019"), ("Artist", "Song")),
+    (("Some - Topic", "Song"), ("Some", "Song")),
+    (("Имя", "Исполнитель — Песня (2011)"), ("Исполнитель", "Песня")),
+    # remixes and covers keep the uploader as the author
+    (("Nightcore Hub", "Artist - Song (Nightcore Remix)"), ("Nightcore Hub", "Artist - Song (Nightcore Remix)")),
+    (("X", "Artist - Song (Sped Up)"), ("X", "Artist - Song (Sped Up)")),
+]
+
+
+def test_extract_performer_title():
+    """Test the heuristics on typical titles."""
+    for (performer, title), expected in CASES:
+        result = extract_performer_title(performer, title)
+        print(f"{performer!r}, {title!r} -> {result!r}")
+        assert result == expected
+    print("Test completed successfully!")
+
+
+def test_memo_and_batch():
+    """Test that a result list is normalized in place and repeats hit the memo."""
+    results = [
+        {"id": "a", "uploader": "Channel", "title": "Artist - Song"},
+        {"id": "b", "uploader": "Daft Punk - Topic", "title": "Get Lucky (2013)"},
+        {"id": "c", "uploader": "Channel", "title": "Artist - Song"},
+    ]
+    hits = extract_performer_title.cache_info().hits
+    assert normalize_results(results) is results
+    assert [(r["uploader"], r["title"]) for r in results] == [
+        ("Artist", "Song"),
+        ("Daft Punk", "Get Lucky"),
+        ("Artist", "Song"),
+    ]
+    assert extract_performer_title.cache_info().hits > hits
+    print(extract_performer_title.cache_info())
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_extract_performer_title()
+    test_memo_and_batch()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Test script for prefetching the top inline results.
+This script runs the Prefetcher with a stand-in download and checks
+scheduling, claiming, expiry of unpicked prefetches, the concurrency
+and byte budgets, and downloads that raise.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import prefetch
+from prefetch import Prefetcher
+
+
+def result(video_id: str) -> dict:
+    return {"id": video_id, "title": video_id, "uploader": "", "duration": 60}
+
+
+class StandInDownload:
+    """Reports chunk bytes steps times from the worker thread, then writes the file."""
+
+    def __init__(
+        self,
+        root: str,
+        steps: int = 10,
+        chunk: int = 1000,
+        step_time: float = 0.01,
+        error: Exception | None = None,
+    ):
+        self.root = root
+        # raised after the download, like a failing database write in download()
+        self.error = error
+        self.steps = steps
+        self.chunk = chunk
+        self.step_time = step_time
+        self.urls = []
+
+    def path(self, video_id: str) -> str:
+        return os.path.join(self.root, f"{video_id}.mp3")
+
+    async def __call__(self, url, progress_callback, complete_callback, error_callback, executor, background):
+        self.urls.append(url)
+        video_id = url.rsplit("=", 1)[1]
+
+        def work():
+            try:
+                for step in range(1, self.steps + 1):
+                    time.sleep(self.step_time)
+                    progress_callback(step * self.chunk, self.steps * self.chunk, 0)
+            except Exception as e:
+                error_callback(e, url)
+                return None
+            with open(self.path(video_id), "wb") as f:
+                f.write(b"\0" * self.steps * self.chunk)
+            return self.path(video_id)
+
+        result = await asyncio.get_running_loop().run_in_executor(executor, work)
+        if self.error is not None:
+            raise self.error
+        return result
+
+
+def run_with_stand_in(checks, **download_args):
+    with tempfile.TemporaryDirectory() as root:
+        stand_in = StandInDownload(root, **download_args)
+        original_download = prefetch.download
+        original_audio_path = prefetch.audio_path
+        prefetch.download = stand_in
+        prefetch.audio_path = stand_in.path
+        try:
+            asyncio.run(checks(stand_in))
+        finally:
+            prefetch.download = original_download
+            prefetch.audio_path = original_audio_path
+
+
+def make_prefetcher(**overrides) -> Prefetcher:
+    args = {"top_k": 2, "max_concurrent": 4, "max_bytes": 10**9, "window": 1, "niceness": 0}
+    args.update(overrides)
+    return Prefetcher(**args)
+
+
+def test_schedule_and_claim():
+    """Test that the top results are prefetched once and a pick waits for its download."""
+
+    async def checks(stand_in):
+        # already on disk, nothing to prefetch
+        with open(stand_in.path("cached"), "wb") as f:
+            f.write(b"audio")
+
+        prefetcher = make_prefetcher(top_k=3)
+        prefetcher.schedule([result("a"), result("cached"), result("b"), result("c")])
+        prefetcher.schedule([result("a")])
+        assert stand_in.urls == []  # the downloads start once the loop gets to them
+        assert prefetcher.stats.started == 2
+
+        assert await prefetcher.claim("a")
+        assert os.path.exists(stand_in.path("a"))
+        assert not await prefetcher.claim("unknown")
+        assert prefetcher.stats.hits == 1
+        assert sorted(stand_in.urls) == [
+            "https://www.youtube.com/watch?v=a",
+            "https://www.youtube.com/watch?v=b",
+        ]
+
+        # the picked one doesn't count as waste, the other one expires with its window
+        await asyncio.sleep(1.2)
+        assert prefetcher.stats.expired == 1
+        assert prefetcher.stats.wasted_bytes == 10000
+        assert prefetcher._jobs == {}
+        print(prefetcher.stats)
+
+    run_with_stand_in(checks)
+    print("Test completed successfully!")
+
+
+def test_expiry_and_budgets():
+    """Test that unpicked prefetches are given up and the budgets are kept."""
+
+    async def checks(stand_in):
+        # the window closes long before the download would finish
+        prefetcher = make_prefetcher(top_k=1, window=0.1)
+        prefetcher.schedule([result("slow")])
+        await asyncio.sleep(0.4)
+        assert prefetcher.stats.expired == 1 and prefetcher.stats.failed == 0
+        assert not os.path.exists(stand_in.path("slow"))
+        assert prefetcher._jobs == {}
+
+        # one slot: the second result is skipped while the first one runs
+        prefetcher = make_prefetcher(max_concurrent=1)
+        prefetcher.schedule([result("first"), result("second")])
+        assert prefetcher.stats.started == 1 and prefetcher.stats.skipped == 1
+        assert await prefetcher.claim("first")
+
+        # a prefetch that outgrows the byte budget is given up
+        prefetcher = make_prefetcher(top_k=1, max_bytes=2500)
+        prefetcher.schedule([result("big")])
+        await asyncio.sleep(0.3)
+        job = prefetcher._jobs["big"]
+        assert job.done.is_set() and job.given_up
+        assert not os.path.exists(stand_in.path("big"))
+        # nothing new starts while its bytes are still reserved
+        prefetcher.schedule([result("next")])
+        assert prefetcher.stats.skipped == 1
+        print(prefetcher.stats)
+
+    run_with_stand_in(checks, steps=20, step_time=0.02)
+    print("Test completed successfully!")
+
+
+def test_download_error():
+    """Test that a download raising doesn't leave a job that pickers wait on forever."""
+
+    async def checks(stand_in):
+        prefetcher = make_prefetcher(top_k=1, max_concurrent=1)
+        prefetcher.schedule([result("broken")])
+        assert await asyncio.wait_for(prefetcher.claim("broken"), 1)
+        await asyncio.sleep(0)
+        assert prefetcher.stats.failed == 1
+        assert prefetcher._jobs == {} and prefetcher._running() == 0
+
+        # the slot is free again
+        prefetcher.schedule([result("next")])
+        assert prefetcher.stats.started == 2 and prefetcher.stats.skipped == 0
+        print(prefetcher.stats)
+
+    run_with_stand_in(checks, error=RuntimeError("database is locked"))
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_schedule_and_claim()
+    test_expiry_and_budgets()
+    test_download_error()
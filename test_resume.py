@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Test script for resuming interrupted downloads.
+This script checks which info json files left by an interrupted download
+are reused, and that a partial download is continued with its format and
+handed on for post-processing instead of being published as it is.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import yt_dlp
+
+import paths
+import yt_utils
+from paths import audio_path
+from yt_utils import _download_sync, _load_resume_info
+
+VIDEO_ID = "resumetest1"
+URL = f"https://www.youtube.com/watch?v={VIDEO_ID}"
+FULL_SIZE = 5000
+
+
+def info(expire: float, format_id: str = "251") -> dict:
+    return {
+        "id": VIDEO_ID,
+        "format_id": format_id,
+        "ext": "webm",
+        "url": f"https://rr1.googlevideo.com/videoplayback?expire={int(expire)}&itag={format_id}",
+    }
+
+
+def write_info(content):
+    os.makedirs(os.path.dirname(audio_path(VIDEO_ID)), exist_ok=True)
+    with open(audio_path(VIDEO_ID, "info.json"), "w") as f:
+        f.write(content if isinstance(content, str) else json.dumps(content))
+
+
+class StandInYoutubeDL:
+    """Extracts a fresh info and continues a .part file like yt-dlp's downloaders."""
+
+    instances = []
+
+    def __init__(self, params: dict):
+        self.params = params
+        self.extracted = []
+        self.processed = []
+        self.resumed_from = None
+        StandInYoutubeDL.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def extract_info(self, url, download=False):
+        self.extracted.append(url)
+        return info(time.time() + 6 * 3600, format_id="140")
+
+    def process_ie_result(self, info_dict, download=True):
+        self.processed.append(info_dict)
+        filename = os.path.join(
+            self.params["paths"]["home"], f"{info_dict['id']}.f{info_dict['format_id']}.{info_dict['ext']}"
+        )
+        part = filename + ".part"
+        self.resumed_from = os.path.getsize(part) if os.path.exists(part) else 0
+        with open(part, "ab") as f:
+            f.write(b"\1" * (FULL_SIZE - self.resumed_from))
+        os.replace(part, filename)
+        return {"requested_downloads": [dict(info_dict, filepath=filename)]}
+
+
+def run_in_audio_dir(checks):
+    original_audio_dir = paths.AUDIO_DIR
+    original_youtube_dl = yt_dlp.YoutubeDL
+    original_aria2_daemon = yt_utils.aria2_daemon
+    StandInYoutubeDL.instances = []
+    with tempfile.TemporaryDirectory() as root:
+        paths.AUDIO_DIR = root
+        yt_dlp.YoutubeDL = StandInYoutubeDL
+        yt_utils.aria2_daemon = None
+        try:
+            checks()
+        finally:
+            paths.AUDIO_DIR = original_audio_dir
+            yt_dlp.YoutubeDL = original_youtube_dl
+            yt_utils.aria2_daemon = original_aria2_daemon
+
+
+def test_load_resume_info():
+    """Test that only info json files with a media URL that's still valid are reused."""
+
+    def checks():
+        info_path = audio_path(VIDEO_ID, "info.json")
+        assert _load_resume_info(VIDEO_ID) == (None, None)
+
+        # corrupt files are dropped, the partial data can't be matched to a format
+        for content in ('{"id": "resumetest1", "url": "https://rr1.goo', "[]", "null"):
+            write_info(content)
+            assert _load_resume_info(VIDEO_ID) == (None, None)
+            assert not os.path.exists(info_path)
+
+        # an expired URL, or one that expires within the margin, needs a new extraction
+        for expire in (time.time() - 60, time.time() + yt_utils.RESUME_URL_MARGIN / 2, 0):
+            write_info(info(expire))
+            assert _load_resume_info(VIDEO_ID) == (None, "251")
+            assert not os.path.exists(info_path)
+        write_info({"id": VIDEO_ID, "format_id": "251", "url": "https://rr1.googlevideo.com/videoplayback"})
+        assert _load_resume_info(VIDEO_ID) == (None, "251")
+
+        fresh = info(time.time() + 3600)
+        write_info(fresh)
+        assert _load_resume_info(VIDEO_ID) == (fresh, "251")
+        assert os.path.exists(info_path)
+
+    run_in_audio_dir(checks)
+    print("Test completed successfully!")
+
+
+def test_resume_partial_download():
+    """Test that an interrupted download is continued rather than published."""
+
+    def checks():
+        errors = []
+        partial = os.path.join(os.path.dirname(audio_path(VIDEO_ID)), f"{VIDEO_ID}.f251.webm.part")
+
+        # valid info: no extraction, the same format, the partial data is kept
+        write_info(info(time.time() + 3600))
+        with open(partial, "wb") as f:
+            f.write(b"\0" * 1000)
+        result = _download_sync(URL, None, None, lambda e, url: errors.append(e))
+        ydl = StandInYoutubeDL.instances[-1]
+        assert errors == []
+        assert ydl.extracted == []
+        assert ydl.params["format"] == "251/bestaudio/best"
+        assert ydl.resumed_from == 1000
+        # handed on for post-processing, publishing is download()'s job
+        assert isinstance(result, dict)
+        assert result["filepath"].endswith(f"{VIDEO_ID}.f251.webm")
+        assert os.path.getsize(result["filepath"]) == FULL_SIZE
+        assert not os.path.exists(audio_path(VIDEO_ID))
+        assert os.path.exists(audio_path(VIDEO_ID, "info.json"))
+        os.remove(result["filepath"])
+
+        # expired info: extracted again, still asking for the partial's format first
+        write_info(info(time.time() - 60))
+        with open(partial, "wb") as f:
+            f.write(b"\0" * 1000)
+        _download_sync(URL, None, None, lambda e, url: errors.append(e))
+        ydl = StandInYoutubeDL.instances[-1]
+        assert errors == []
+        assert ydl.extracted == [URL]
+        assert ydl.params["format"] == "251/bestaudio/best"
+        # the stand-in got format 140, so 251's partial data is left alone
+        assert ydl.resumed_from == 0
+        assert os.path.getsize(partial) == 1000
+
+        # a published file wins over anything left behind
+        write_info(info(time.time() + 3600))
+        with open(audio_path(VIDEO_ID), "wb") as f:
+            f.write(b"audio")
+        result = _download_sync(URL, None, None, lambda e, url: errors.append(e))
+        assert result == audio_path(VIDEO_ID)
+        assert StandInYoutubeDL.instances[-1].processed == []
+
+    run_in_audio_dir(checks)
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_load_resume_info()
+    test_resume_partial_download()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Test script for paginated inline search.
+This script checks that YouTube result pages are requested lazily, only
+as far as needed, that results are cached per query and that searches are
+closed when they're done, without touching YouTube or the database.
+"""
+
+import asyncio
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from yt_dlp.utils import DownloadError
+
+import yt_utils
+
+
+def fake_entries(count: int) -> list:
+    return [
+        {
+            "id": f"video{i}",
+            "title": f"Artist {i} - Song {i}",
+            "uploader": f"Channel {i}",
+            "duration": 60 * 60 if i % 4 == 3 else 180,
+            "url": f"https://www.youtube.com/watch?v=video{i}",
+            "thumbnails": [{"url": f"https://i.ytimg.com/vi/video{i}/hqdefault.jpg"}],
+        }
+        for i in range(count)
+    ]
+
+
+def test_search_pagination():
+    """Test that pages don't overlap and result pages aren't requested twice."""
+    entries = fake_entries(12)
+    calls = []
+
+    def search_entries(query):
+        # YouTube answers with result pages of 5, each is requested when reached
+        for i, entry in enumerate(entries):
+            if i % 5 == 0:
+                calls.append((query, i))
+            yield entry
+
+    with stand_in_search(search_entries):
+        run_pagination_checks(calls)
+
+    print("Test completed successfully!")
+
+
+@contextmanager
+def stand_in_search(search_entries):
+    async def add_file(*args, **kwargs):
+        pass
+
+    async def filter_known_bad(results):
+        return results
+
+    async def is_empty_search(query):
+        return False
+
+    original_search_entries = yt_utils._search_entries
+    original_add_file = yt_utils.add_file
+    original_filter_known_bad = yt_utils.filter_known_bad
+    original_is_empty_search = yt_utils.is_empty_search
+    yt_utils._search_cursors.clear()
+    yt_utils._search_entries = search_entries
+    yt_utils.add_file = add_file
+    yt_utils.filter_known_bad = filter_known_bad
+    yt_utils.is_empty_search = is_empty_search
+
+    try:
+        yield
+    finally:
+        yt_utils._search_entries = original_search_entries
+        yt_utils.add_file = original_add_file
+        yt_utils.filter_known_bad = original_filter_known_bad
+        yt_utils.is_empty_search = original_is_empty_search
+        yt_utils._search_cursors.clear()
+
+
+class StandInYoutubeDL:
+    """Lazy search entries like yt-dlp's; a query containing "broken" fails on its second page."""
+
+    instances = []
+
+    def __init__(self, params):
+        self.closed = False
+        StandInYoutubeDL.instances.append(self)
+
+    def extract_info(self, url, download=True, process=True):
+        query = url.split(":", 1)[1]
+        if "failed" in query:
+            return None
+
+        def entries():
+            for i, entry in enumerate(fake_entries(12)):
+                if i == 5 and "broken" in query:
+                    raise DownloadError("Unable to download API page")
+                yield entry
+
+        return {"_type": "playlist", "entries": entries()}
+
+    def close(self):
+        self.closed = True
+
+
+def test_search_is_closed():
+    """Test that every search's YoutubeDL is closed when it's no longer needed."""
+    original_youtube_dl = yt_utils.yt_dlp.YoutubeDL
+    original_cache_size = yt_utils.SEARCH_CACHE_SIZE
+    yt_utils.yt_dlp.YoutubeDL = StandInYoutubeDL
+    StandInYoutubeDL.instances.clear()
+    try:
+        with stand_in_search(yt_utils._search_entries):
+            asyncio.run(run_closing_checks())
+    finally:
+        yt_utils.yt_dlp.YoutubeDL = original_youtube_dl
+        yt_utils.SEARCH_CACHE_SIZE = original_cache_size
+    print("Test completed successfully!")
+
+
+async def run_closing_checks():
+    instances = StandInYoutubeDL.instances
+
+    # a search that failed right away
+    assert await yt_utils.search_page("failed", 0, 3) == ([], "")
+    assert instances[-1].closed
+
+    # a page that failed, what came before it is still served
+    page, next_offset = await yt_utils.search_page("broken", 0, 12)
+    assert len(page) == 4 and next_offset == ""
+    assert instances[-1].closed
+
+    # a search scrolled to its end
+    offset = "0"
+    while offset:
+        _, offset = await yt_utils.search_page("complete", int(offset), 5)
+    assert instances[-1].closed
+
+    # searches that are still open are closed with their cursor
+    yt_utils.SEARCH_CACHE_SIZE = 1
+    yt_utils._search_cursors.clear()
+    await yt_utils.search_page("first", 0, 3)
+    first = instances[-1]
+    assert not first.closed
+    await yt_utils.search_page("second", 0, 3)
+    second = instances[-1]
+    assert first.closed and not second.closed
+
+    yt_utils._search_cursors["second"].created_at -= yt_utils.SEARCH_CACHE_TTL + 1
+    await yt_utils.search_page("second", 0, 3)
+    assert second.closed and not instances[-1].closed
+
+    # a cursor that is busy is closed once it's released, by a task that is kept alive
+    busy_cursor = yt_utils._search_cursors["second"]
+    busy = instances[-1]
+    await busy_cursor.lock.acquire()
+    await yt_utils.search_page("third", 0, 3)
+    assert not busy.closed and len(yt_utils._closing_tasks) == 1
+    busy_cursor.lock.release()
+    await asyncio.gather(*yt_utils._closing_tasks)
+    assert busy.closed and not yt_utils._closing_tasks
+
+
+def run_pagination_checks(calls: list):
+    async def scroll():
+        pages = []
+        offset = 0
+        while True:
+            page, next_offset = await yt_utils.search_page("test query", offset, 3)
+            if offset == 0:
+                # the first answer waits for the first result page only
+                assert calls == [("test query", 0)]
+            pages.append(page)
+            if not next_offset:
+                return pages
+            offset = int(next_offset)
+
+    pages = asyncio.run(scroll())
+    ids = [result["id"] for page in pages for result in page]
+    print(f"Pages: {[[r['id'] for r in page] for page in pages]}")
+    print(f"Result page requests: {calls}")
+
+    # every 4th entry is too long and must be skipped
+    assert ids == [f"video{i}" for i in range(12) if i % 4 != 3]
+    assert len(ids) == len(set(ids))
+    # one search is continued, each result page is requested once
+    assert calls == [("test query", 0), ("test query", 5), ("test query", 10)]
+
+    # scrolling back to the first page is served from the cache
+    calls.clear()
+    page, _ = asyncio.run(yt_utils.search_page("Test Query", 0, 3))
+    assert [r["id"] for r in page] == ["video0", "video1", "video2"]
+    assert calls == []
+
+
+if __name__ == "__main__":
+    test_search_pagination()
+    test_search_is_closed()
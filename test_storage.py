@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Test script for the storage backends.
+This script runs the local backend against a temporary folder and the S3
+backend against a MinIO-style stand-in server.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from aiohttp import web
+
+from storage import LocalStorage, S3Storage
+
+
+async def start_stand_in_s3(objects: dict, page_size: int = 2) -> web.AppRunner:
+    """Keeps objects in memory, pages listings at page_size keys."""
+
+    async def handle(request: web.Request):
+        authorization = request.headers.get("Authorization", "")
+        if not authorization.startswith("AWS4-HMAC-SHA256 Credential=access/"):
+            return web.Response(status=403)
+        key = request.match_info["key"]
+
+        if request.method == "PUT":
+            objects[key] = await request.read()
+            return web.Response(status=200)
+        if request.method == "DELETE":
+            objects.pop(key, None)
+            return web.Response(status=204)
+        if key not in objects:
+            return web.Response(status=404)
+        if request.method == "HEAD":
+            return web.Response(status=200, headers={"Content-Length": str(len(objects[key]))})
+        return web.Response(body=objects[key])
+
+    async def list_objects(request: web.Request):
+        keys = sorted(key for key in objects if key.startswith(request.query["prefix"]))
+        start = int(request.query.get("continuation-token", 0))
+        page = keys[start : start + page_size]
+        truncated = start + page_size < len(keys)
+        contents = "".join(
+            f"<Contents><Key>{key}</Key><Size>{len(objects[key])}</Size>"
+            f"<LastModified>2024-01-01T00:00:00.000Z</LastModified></Contents>"
+            for key in page
+        )
+        body = (
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            f"<IsTruncated>{str(truncated).lower()}</IsTruncated>{contents}"
+            + (f"<NextContinuationToken>{start + page_size}</NextContinuationToken>" if truncated else "")
+            + "</ListBucketResult>"
+        )
+        return web.Response(body=body, content_type="application/xml")
+
+    app = web.Application()
+    app.router.add_get("/bucket", list_objects)
+    app.router.add_route("*", "/bucket/{key:.+}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8767).start()
+    return runner
+
+
+async def check_backend(storage, workdir: str):
+    source = os.path.join(workdir, "source.mp3")
+    with open(source, "wb") as f:
+        f.write(b"audio data")
+
+    keys = [f"audio/0{i}/video{i}.mp3" for i in range(5)]
+    for key in keys:
+        await storage.put(key, source)
+    await storage.put("thumbnails/00/video0.jpg", source)
+
+    assert await storage.exists(keys[0])
+    assert await storage.size(keys[0]) == len(b"audio data")
+    assert await storage.size("audio/00/missing.mp3") is None
+
+    target = os.path.join(workdir, "fetched", "video1.mp3")
+    assert await storage.get(keys[1], target)
+    with open(target, "rb") as f:
+        assert f.read() == b"audio data"
+    assert not await storage.get("audio/00/missing.mp3", target + ".missing")
+    assert not os.path.exists(target + ".missing")
+
+    listed = await storage.list("audio/")
+    assert sorted(obj.key for obj in listed) == keys
+    assert all(obj.size == len(b"audio data") for obj in listed)
+
+    await storage.delete(keys[0])
+    assert not await storage.exists(keys[0])
+    assert len(await storage.list("audio/")) == len(keys) - 1
+    print(f"{type(storage).__name__} passed")
+
+
+def test_local_storage():
+    """Test the local backend with a root other than the working directory."""
+
+    async def run():
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as workdir:
+            storage = LocalStorage(root)
+            assert not storage.is_local_cache
+            await check_backend(storage, workdir)
+
+    assert LocalStorage(".").is_local_cache
+    asyncio.run(run())
+    print("Test completed successfully!")
+
+
+def test_s3_storage():
+    """Test the S3 backend against the stand-in server, listings included."""
+
+    async def run():
+        objects = {}
+        runner = await start_stand_in_s3(objects)
+        storage = S3Storage("http://127.0.0.1:8767", "bucket", "access", "secret")
+        try:
+            with tempfile.TemporaryDirectory() as workdir:
+                await check_backend(storage, workdir)
+            assert objects["thumbnails/00/video0.jpg"] == b"audio data"
+        finally:
+            await storage.close()
+            await runner.cleanup()
+
+    asyncio.run(run())
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_local_storage()
+    test_s3_storage()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Test script for the sharded audio/thumbnail layout.
+This script migrates a flat cache in a temporary folder and checks
+that every file ends up where the path helpers look for it.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import paths
+from paths import shard_dir, iter_files
+from migrate_storage_layout import migrate_folder
+
+
+def test_storage_layout():
+    """Test that a flat folder is moved into shards and back, and that the move is idempotent."""
+    video_ids = ["dQw4w9WgXcQ", "9bZkp7q5f0-", "kJQP7kiw5Fk", "a_b-c"]
+
+    original_depth = paths.STORAGE_SHARD_DEPTH
+    with tempfile.TemporaryDirectory() as root:
+        for video_id in video_ids:
+            for ext in ("mp3", "webm.part"):
+                with open(os.path.join(root, f"{video_id}.{ext}"), "w") as f:
+                    f.write("test content")
+        open(os.path.join(root, ".gitkeep"), "w").close()
+
+        try:
+            # the default keeps the flat folder of existing deployments
+            paths.STORAGE_SHARD_DEPTH = 0
+            assert migrate_folder(root) == 0
+
+            paths.STORAGE_SHARD_DEPTH = 1
+            moved = migrate_folder(root)
+            print(f"Moved {moved} files")
+            assert moved == len(video_ids) * 2
+
+            for video_id in video_ids:
+                expected = os.path.join(shard_dir(root, video_id), f"{video_id}.mp3")
+                assert os.path.dirname(expected) != root
+                assert os.path.exists(expected), expected
+
+            assert os.path.exists(os.path.join(root, ".gitkeep"))
+            assert sum(1 for _ in iter_files(root)) == len(video_ids) * 2 + 1
+            # running it again has nothing left to do
+            assert migrate_folder(root) == 0
+
+            # going back to a flat folder works the same way
+            paths.STORAGE_SHARD_DEPTH = 0
+            assert migrate_folder(root) == len(video_ids) * 2
+            assert sorted(os.listdir(root)) == sorted(
+                [".gitkeep"] + [f"{video_id}.{ext}" for video_id in video_ids for ext in ("mp3", "webm.part")]
+            )
+        finally:
+            paths.STORAGE_SHARD_DEPTH = original_depth
+
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_storage_layout()
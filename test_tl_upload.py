@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Test script for parallel Telethon uploads.
+This script uploads files through ParallelUploader with a stand-in client
+and stand-in MTProto connections, and checks the parts that are sent and
+the input file that comes back for small and big files.
+"""
+
+import asyncio
+import hashlib
+import os
+import random
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from telethon import functions as tl_functions, types as tl_types
+from telethon.custom import InputSizedFile
+
+import tl_upload
+import upload_source
+from tl_upload import ParallelUploader, upload_file
+from upload_source import UploadSource
+
+PART_SIZE = 1024
+
+
+class StandInClient:
+    """Sends requests like a connected TelegramClient and records them."""
+
+    def __init__(self, fail_part: int | None = None):
+        self.session = SimpleNamespace(
+            auth_key=b"key", server_address="127.0.0.1", port=443, dc_id=2
+        )
+        self._log = self._proxy = self._local_addr = None
+        self.fail_part = fail_part
+        # (connection, request) in the order the requests were sent
+        self.sent = []
+        self.uploaded = []
+
+    def _connection(self, *args, **kwargs):
+        return args
+
+    async def send(self, connection: str, request):
+        self.sent.append((connection, request))
+        await asyncio.sleep(random.random() / 1000)
+        return request.file_part != self.fail_part
+
+    async def __call__(self, request):
+        return await self.send("client", request)
+
+    async def upload_file(self, file, file_size, file_name):
+        self.uploaded.append((file, file_size, file_name))
+        return "uploaded by the client"
+
+
+class StandInSender:
+    """MTProtoSender that sends through the stand-in client."""
+
+    client: StandInClient | None = None
+    connected = 0
+
+    def __init__(self, auth_key, loggers):
+        self.name = f"sender{StandInSender.connected}"
+        self._connected = False
+
+    async def connect(self, connection):
+        StandInSender.connected += 1
+        self._connected = True
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def disconnect(self):
+        self._connected = False
+
+    async def send(self, request):
+        return await StandInSender.client.send(self.name, request)
+
+
+class PeakBudget(upload_source.MemoryBudget):
+    """MemoryBudget that remembers the most bytes held at once."""
+
+    def __init__(self, limit: int):
+        super().__init__(limit)
+        self.peak = 0
+
+    async def acquire(self, size: int) -> int:
+        size = await super().acquire(size)
+        self.peak = max(self.peak, self.used)
+        return size
+
+
+def run_upload(
+    size: int,
+    checks,
+    connections: int = 3,
+    fail_part: int | None = None,
+    budget_limit: int = 10**9,
+):
+    original_sender = tl_upload.MTProtoSender
+    original_budget = upload_source._budget
+    client = StandInClient(fail_part)
+    StandInSender.client = client
+    StandInSender.connected = 0
+    tl_upload.MTProtoSender = StandInSender
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "audio.mp3")
+            content = os.urandom(size)
+            with open(path, "wb") as f:
+                f.write(content)
+
+            async def run():
+                upload_source._budget = PeakBudget(budget_limit)
+                uploader = ParallelUploader(client, connections, PART_SIZE)
+                async with UploadSource(path) as source:
+                    await checks(uploader, source, client, content)
+                await uploader.close()
+
+            asyncio.run(run())
+    finally:
+        tl_upload.MTProtoSender = original_sender
+        upload_source._budget = original_budget
+
+
+def check_parts(client: StandInClient, content: bytes, request_type) -> int:
+    part_count = max(1, -(-len(content) // PART_SIZE))
+    requests = [request for _, request in client.sent]
+    assert all(isinstance(request, request_type) for request in requests)
+    assert len({request.file_id for request in requests}) == 1
+    # taken off the queue in order, whichever connection sends them
+    assert [request.file_part for request in requests] == list(range(part_count))
+    assert b"".join(request.bytes for request in requests) == content
+    return part_count
+
+
+def test_small_file():
+    """Test a file below BIG_FILE_SIZE, sent with SaveFilePartRequest and an md5."""
+
+    async def checks(uploader, source, client, content):
+        input_file = await uploader.upload(source, "song.mp3")
+        part_count = check_parts(client, content, tl_functions.upload.SaveFilePartRequest)
+        assert part_count == 11
+        # the client's own connection and two more
+        assert StandInSender.connected == 2
+        assert {connection for connection, _ in client.sent} == {"client", "sender0", "sender1"}
+
+        assert isinstance(input_file, InputSizedFile)
+        assert input_file.id == client.sent[0][1].file_id
+        assert input_file.parts == part_count and input_file.name == "song.mp3"
+        assert input_file.md5_checksum == hashlib.md5(content).hexdigest()
+        assert input_file.size == len(content)
+
+    run_upload(10 * PART_SIZE + 100, checks)
+    print("Test completed successfully!")
+
+
+def test_big_file():
+    """Test a file above BIG_FILE_SIZE, sent with SaveBigFilePartRequest."""
+    original_big_file_size = tl_upload.BIG_FILE_SIZE
+    tl_upload.BIG_FILE_SIZE = 4 * PART_SIZE
+
+    async def checks(uploader, source, client, content):
+        input_file = await uploader.upload(source, "long.mp3")
+        part_count = check_parts(client, content, tl_functions.upload.SaveBigFilePartRequest)
+        assert part_count == 8
+        assert all(request.file_total_parts == part_count for _, request in client.sent)
+        assert isinstance(input_file, tl_types.InputFileBig)
+        assert (input_file.parts, input_file.name) == (part_count, "long.mp3")
+
+    try:
+        run_upload(8 * PART_SIZE, checks)
+    finally:
+        tl_upload.BIG_FILE_SIZE = original_big_file_size
+    print("Test completed successfully!")
+
+
+def test_edge_cases():
+    """Test empty files, failed parts, the part size check and the fallback to the client."""
+
+    async def empty(uploader, source, client, content):
+        input_file = await uploader.upload(source, "empty.mp3")
+        assert check_parts(client, content, tl_functions.upload.SaveFilePartRequest) == 1
+        assert input_file.parts == 1
+
+    run_upload(0, empty)
+
+    async def failing(uploader, source, client, content):
+        try:
+            await asyncio.wait_for(uploader.upload(source, "song.mp3"), 5)
+        except RuntimeError as e:
+            assert "part 3" in str(e)
+        else:
+            raise AssertionError("the failed part wasn't reported")
+
+    run_upload(20 * PART_SIZE, failing, fail_part=3)
+
+    for part_size in (0, 1000, 1024 * 1024):
+        try:
+            ParallelUploader(StandInClient(), 2, part_size)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"part size {part_size} was accepted")
+
+    # one connection leaves the upload to telethon
+    original_connections = tl_upload.TL_UPLOAD_CONNECTIONS
+    original_uploader = tl_upload.uploader
+    tl_upload.TL_UPLOAD_CONNECTIONS = 1
+    tl_upload.uploader = None
+
+    async def single(uploader, source, client, content):
+        assert await upload_file(client, source, "song.mp3") == "uploaded by the client"
+        assert client.uploaded == [(source, len(content), "song.mp3")]
+        assert client.sent == []
+
+    try:
+        run_upload(PART_SIZE, single)
+    finally:
+        tl_upload.TL_UPLOAD_CONNECTIONS = original_connections
+        tl_upload.uploader = original_uploader
+    print("Test completed successfully!")
+
+
+def test_memory_budget():
+    """Test that parts hold their share of UPLOAD_MEMORY_LIMIT until they're sent."""
+
+    async def unlimited(uploader, source, client, content):
+        budget = upload_source._budget
+        await uploader.upload(source, "song.mp3")
+        check_parts(client, content, tl_functions.upload.SaveFilePartRequest)
+        # one part being sent and one queued per connection, and the one being read
+        print(f"Peak without a limit: {budget.peak}")
+        assert 3 * PART_SIZE <= budget.peak <= (2 * 4 + 1) * PART_SIZE
+        assert budget.used == 0
+
+    run_upload(40 * PART_SIZE, unlimited, connections=4)
+
+    async def limited(uploader, source, client, content):
+        budget = upload_source._budget
+        await uploader.upload(source, "song.mp3")
+        check_parts(client, content, tl_functions.upload.SaveFilePartRequest)
+        print(f"Peak with a limit of {budget.limit}: {budget.peak}")
+        assert budget.peak == budget.limit
+        assert budget.used == 0
+
+    run_upload(40 * PART_SIZE, limited, connections=4, budget_limit=3 * PART_SIZE)
+
+    async def failing(uploader, source, client, content):
+        budget = upload_source._budget
+        try:
+            await asyncio.wait_for(uploader.upload(source, "song.mp3"), 5)
+        except RuntimeError:
+            pass
+        # parts that were queued or in flight when the upload failed are given back
+        assert budget.used == 0
+
+    run_upload(40 * PART_SIZE, failing, connections=4, fail_part=5)
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_small_file()
+    test_big_file()
+    test_memory_budget()
+    test_edge_cases()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Test script for streaming uploads from cached files.
+This script checks that concurrent readers of one file share a single
+mapping, that chunks are released back to the memory budget and what
+readers do once the budget is used up.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+import upload_source
+from upload_source import MappedInputFile, MemoryBudget, UploadSource
+
+
+class CountingMapping(upload_source.SharedMapping):
+    opened = 0
+
+    def __init__(self, path: str, key: tuple):
+        CountingMapping.opened += 1
+        super().__init__(path, key)
+
+
+def run_with_budget(checks, limit: int):
+    original_budget = upload_source._budget
+    original_mapping = upload_source.SharedMapping
+    CountingMapping.opened = 0
+    upload_source.SharedMapping = CountingMapping
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "audio.mp3")
+            with open(path, "wb") as f:
+                f.write(bytes(range(256)) * 40)
+
+            async def run():
+                # the budget's condition has to belong to this loop
+                upload_source._budget = MemoryBudget(limit)
+                await checks(path)
+
+            asyncio.run(run())
+    finally:
+        upload_source._budget = original_budget
+        upload_source.SharedMapping = original_mapping
+        upload_source._mappings.clear()
+
+
+def test_shared_mapping():
+    """Test that two readers of the same file share one mapping and release their chunks."""
+
+    async def checks(path):
+        budget = upload_source._get_budget()
+        with open(path, "rb") as f:
+            content = f.read()
+
+        async with UploadSource(path) as first, UploadSource(path) as second:
+            assert CountingMapping.opened == 1
+            assert first._mapping is second._mapping and first._mapping.refs == 2
+            assert len(upload_source._mappings) == 1
+
+            # one chunk per reader is held until the next read
+            assert await first.read(1000) == content[:1000]
+            assert await second.read(3000) == content[:3000]
+            assert budget.used == 4000
+            assert await first.read(1000) == content[1000:2000]
+            assert budget.used == 4000
+            assert await first.read() == content[2000:]
+            assert await first.read() == b""
+            assert budget.used == 3000
+
+        # leaving releases the last chunk and the mapping
+        assert budget.used == 0
+        assert upload_source._mappings == {}
+
+        # a file replaced on disk isn't read through the old mapping
+        async with UploadSource(path) as source:
+            with open(path + ".new", "wb") as f:
+                f.write(b"new content")
+            os.replace(path + ".new", path)
+            async with UploadSource(path) as replaced:
+                assert source._mapping is not replaced._mapping
+                assert await replaced.read() == b"new content"
+        assert CountingMapping.opened == 3
+
+        # what aiogram reads, chunk by chunk
+        chunks = [chunk async for chunk in MappedInputFile(path, chunk_size=4).read(None)]
+        assert chunks == [b"new ", b"cont", b"ent"]
+        assert budget.used == 0
+
+    run_with_budget(checks, limit=10**6)
+    print("Test completed successfully!")
+
+
+def test_exhausted_budget():
+    """Test that readers wait for the budget instead of going over it."""
+
+    async def checks(path):
+        budget = upload_source._get_budget()
+        async with UploadSource(path) as first, UploadSource(path) as second:
+            await first.read(1500)
+            assert budget.used == 1500
+
+            # the second reader waits until the first one moves on
+            waiting = asyncio.create_task(second.read(1000))
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+            await first._release_chunk()
+            assert len(await asyncio.wait_for(waiting, 1)) == 1000
+            assert budget.used == 1000
+
+        # a chunk bigger than the whole budget is read, counted as all of it
+        async with UploadSource(path) as source:
+            assert len(await source.read(5000)) == 5000
+            assert budget.used == budget.limit
+        assert budget.used == 0
+
+    run_with_budget(checks, limit=2000)
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_shared_mapping()
+    test_exhausted_budget()
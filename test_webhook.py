@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Test script for the webhook receiver.
+This script posts updates to a receiver with stand-in handlers and checks
+the secret token, the queue limit and that queued updates get handled,
+that the webhook is never registered without a secret and that its worker
+processes share the post-processing workers.
+"""
+
+import asyncio
+import re
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+# Add the project root to the Python path
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from aiogram import Bot
+from aiohttp import ClientSession, web
+
+import postprocess
+import webhook
+from webhook import SECRET_HEADER, WebhookReceiver, run_webhook
+
+
+class StandInDispatcher:
+    def __init__(self):
+        self.handled = []
+        self.release = asyncio.Event()
+
+    async def feed_raw_update(self, bot, update):
+        await self.release.wait()
+        self.handled.append(update["update_id"])
+
+
+def test_webhook():
+    """Test secret validation, backpressure and update handling."""
+    asyncio.run(run_webhook_checks())
+    print("Test completed successfully!")
+
+
+async def run_webhook_checks():
+    bot = Bot(token="123:abc")
+    dispatcher = StandInDispatcher()
+    receiver = WebhookReceiver(bot, dispatcher, "s3cret", queue_size=2, concurrency=1)
+    app = web.Application()
+    receiver.register(app, "/webhook")
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 8766).start()
+
+    url = "http://127.0.0.1:8766/webhook"
+    try:
+        async with ClientSession() as session:
+            async def post(update_id, secret="s3cret"):
+                async with session.post(
+                    url, json={"update_id": update_id}, headers={SECRET_HEADER: secret}
+                ) as response:
+                    return response.status
+
+            assert await post(0, secret="wrong") == 401
+            # the only handler holds update 1, updates 2 and 3 fill the queue
+            statuses = [await post(update_id) for update_id in range(1, 5)]
+            print(f"Statuses: {statuses}")
+            assert statuses == [200, 200, 200, 503]
+            assert receiver.refused == 1
+
+            dispatcher.release.set()
+            await asyncio.wait_for(receiver.queue.join(), 1)
+            assert dispatcher.handled == [1, 2, 3]
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+class StandInBot:
+    def __init__(self):
+        self.webhooks = []
+
+    async def set_webhook(self, **kwargs):
+        self.webhooks.append(kwargs)
+
+
+def test_webhook_secret():
+    """Test that the configured secret is used and a random one otherwise."""
+    served = []
+
+    async def serve(bot, dispatcher, secret):
+        served.append(secret)
+
+    dispatcher = SimpleNamespace(resolve_used_update_types=lambda: ["inline_query"])
+    original_serve = webhook.serve
+    original_secret = webhook.WEBHOOK_SECRET
+    webhook.serve = serve
+    try:
+        bot = StandInBot()
+        webhook.WEBHOOK_SECRET = ""
+        asyncio.run(run_webhook(bot, dispatcher))
+        asyncio.run(run_webhook(bot, dispatcher))
+        webhook.WEBHOOK_SECRET = "configured"
+        asyncio.run(run_webhook(bot, dispatcher))
+    finally:
+        webhook.serve = original_serve
+        webhook.WEBHOOK_SECRET = original_secret
+
+    secrets = [kwargs["secret_token"] for kwargs in bot.webhooks]
+    print(f"Secrets: {secrets}")
+    # the receiver checks the same secret Telegram was given
+    assert secrets == served
+    assert secrets[0] and secrets[1] and secrets[0] != secrets[1]
+    assert re.fullmatch(r"[A-Za-z0-9_-]{1,256}", secrets[0])
+    assert secrets[2] == "configured"
+    print("Test completed successfully!")
+
+
+def test_postprocess_workers():
+    """Test that webhook worker processes share the ffmpeg workers instead of each using all cores."""
+    original = (postprocess.POSTPROCESS_WORKERS, postprocess.WEBHOOK_URL, postprocess.WEBHOOK_WORKERS)
+    try:
+        postprocess.POSTPROCESS_WORKERS = 8
+        for url, processes, expected in [
+            ("", 4, 8),  # long polling is one process
+            ("https://bot.example.com", 1, 8),
+            ("https://bot.example.com", 4, 2),
+            ("https://bot.example.com", 3, 2),
+            ("https://bot.example.com", 16, 1),
+        ]:
+            postprocess.WEBHOOK_URL, postprocess.WEBHOOK_WORKERS = url, processes
+            assert postprocess._pool_workers() == expected, (url, processes)
+
+        # all available cores by default
+        postprocess.POSTPROCESS_WORKERS = 0
+        postprocess.WEBHOOK_WORKERS = 2
+        assert postprocess._pool_workers() == max(1, postprocess._available_cores() // 2)
+    finally:
+        postprocess.POSTPROCESS_WORKERS, postprocess.WEBHOOK_URL, postprocess.WEBHOOK_WORKERS = original
+    print("Test completed successfully!")
+
+
+if __name__ == "__main__":
+    test_webhook()
+    test_webhook_secret()
+    test_postprocess_workers()
@@ -7,3 +7,53 @@ Downloaded files: {downloaded}
 Sent files total: {sent_total}
 Sent files by you: {sent_user}
 """
+
+POSTPROCESS_STATS_TEXT = """
+Post-processing:
+
+Workers: {workers}
+Running: {running}
+Queued: {queued}
+Completed: {completed}
+Failed: {failed}
+"""
+
+ADMISSION_STATS_TEXT = """
+Inline search:
+
+Running: {running}/{max_concurrent}
+Admitted: {admitted}
+From cache: {cached}
+Rate limited: {rate_limited}
+Over capacity: {overloaded}
+Over deadline: {late}
+Degraded answers: {degraded}
+Shed (busy): {shed}
+"""
+
+PREFETCH_STATS_TEXT = """
+Prefetch:
+
+Started: {started}
+Hits: {hits} ({hit_rate:.0%})
+Expired: {expired}
+Failed: {failed}
+Skipped (over budget): {skipped}
+Wasted: {wasted_mb:.1f} MB
+"""
+
+LOOP_LAG_STATS_TEXT = """
+Event loop:
+
+Lag p50/p99: {p50_ms:.1f}/{p99_ms:.1f} ms
+Max lag: {max_ms:.0f} ms
+Blocked over {threshold:g}s: {blocks}
+"""
+
+PROFILE_USAGE_TEXT = "Usage: /profile [cpu|tasks] [seconds]\n{error}"
+
+PROFILE_DISABLED_TEXT = "Diagnostics are off, set DIAGNOSTICS=1 to use /profile"
+
+PROFILE_BUSY_TEXT = "Another profile is running, try again when it's done"
+
+PROFILE_STARTED_TEXT = "Profiling ({kind}) for {seconds:g}s..."
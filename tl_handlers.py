@@ -14,20 +14,34 @@ from tl_client import tl_bot
 import os
 import random
 import re
-from yt_utils import search, download
+from admission import search_admission, Overloaded
+from jobs import download_audio
 from loguru import logger
 from config import queued, CHAT_ID, ADMIN_ID
-from const import REMIX_KEYWORDS
+from const import REMIX_KEYWORDS, DEGRADED_CACHE_TIME
 from utils import (
     download_and_crop_thumbnail,
     safe_filename,
     hide_link,
-    extract_performer_title,
 )
-from database import add_file, get_file, add_use, get_user_ids, get_stats
-from text import STATS_TEXT
+from database import get_file, add_use, get_user_ids, get_stats, set_downloaded
+from text import (
+    STATS_TEXT,
+    PROFILE_USAGE_TEXT,
+    PROFILE_DISABLED_TEXT,
+    PROFILE_BUSY_TEXT,
+    PROFILE_STARTED_TEXT,
+)
 import asyncio
-from audio_manager import cleanup_audio_folder
+import io
+import time
+from audio_manager import cleanup_audio_folder, cleanup_storage
+from prefetch import prefetcher
+from admin_stats import get_admin_stats_text
+from diagnostics import profiler
+from storage import fetch_audio
+from upload_source import UploadSource
+from tl_upload import upload_file
 
 
 @tl_bot.on(tl_events.NewMessage(pattern="/start"))
@@ -47,7 +61,24 @@ async def tl_inline_query_handler(
 ):
     # user = await get_user(query.from_user.id)
     query: tl_types.UpdateBotInlineQuery = event.query
-    results = await search(query.query)
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    try:
+        results, next_offset, degraded = await search_admission.search(
+            query.query, offset, event.sender_id
+        )
+    except Overloaded:
+        busy = [
+            await event.builder.article(
+                title="Busy, try again in a moment",
+                text="The bot is busy right now, please try again in a moment.",
+            )
+        ]
+        return await event.answer(
+            results=busy if offset == 0 else [], cache_time=0, private=True
+        )
+
+    if not results and offset > 0:
+        return await event.answer(results=[], cache_time=86400, next_offset="")
 
     if not results:
         builder = event.builder
@@ -64,14 +95,8 @@ async def tl_inline_query_handler(
     inline_results = []
     builder = event.builder
     for result in results:
+        # rows were stored when the results were found, see yt_utils.search_page
         logger.info(result["id"])
-        await add_file(
-            result["id"],
-            result["title"],
-            result["uploader"],
-            result["thumbnail"],
-            result["duration"],
-        )
         inline_results.append(
             await builder.article(
                 # content=tl_types.InputMediaWebPage(
@@ -79,7 +104,11 @@ async def tl_inline_query_handler(
                 #     force_large_media=True
                 # ),
                 title=result["title"],
-                description=f'{result["uploader"]} | {result["view_count"]} views',
+                description=(
+                    f'{result["uploader"]} | {result["view_count"]} views'
+                    if result["view_count"]
+                    else result["uploader"]
+                ),
                 # type="article",
                 # attributes=[],
                 # mime_type="text/html",
@@ -103,7 +132,13 @@ async def tl_inline_query_handler(
 
     logger.info(results)
 
-    await event.answer(results=inline_results, cache_time=86400)
+    await event.answer(
+        results=inline_results,
+        cache_time=DEGRADED_CACHE_TIME if degraded else 86400,
+        next_offset=next_offset,
+    )
+    if prefetcher and offset == 0 and not degraded:
+        prefetcher.schedule(results)
     return None
 
 
@@ -128,12 +163,11 @@ async def tl_click_download_handler(event: tl_events.CallbackQuery.Event):
 
     file = await get_file(result_id)
     logger.info(result_id)
-    file_path = f"audio/{result_id}.mp3"
     filename = f"{safe_filename(file['title'])}_{result_id}.mp3"
     logger.info(f"filename: {filename}")
     logger.info(file)
 
-    performer, title = extract_performer_title(file["uploader"], file["title"])
+    performer, title = file["performer"], file["track"]
 
     await tl_bot(tl_functions.messages.EditInlineBotMessageRequest(
         id=event.original_update.msg_id,
@@ -143,12 +177,20 @@ async def tl_click_download_handler(event: tl_events.CallbackQuery.Event):
     logger.info("get thumbnail")
     thumb = await download_and_crop_thumbnail(file["thumbnail"], result_id)
 
-    if os.path.exists(file_path):
+    prefetched = prefetcher is not None and await prefetcher.claim(result_id)
+
+    # only finished files are ever published, so the flag is enough to decide
+    input_file = None
+    if file["downloaded"] or prefetched:
         logger.info("File already exists")
-        input_file: InputSizedFile = await tl_bot.upload_file(
-            file=file_path,
-            file_name=filename
-        )
+        try:
+            async with UploadSource(await fetch_audio(result_id)) as source:
+                input_file = await upload_file(tl_bot, source, filename)
+        except FileNotFoundError:
+            logger.info("File was evicted")
+            await set_downloaded(result_id, 0)
+
+    if input_file is not None:
         logger.info(f'{input_file=}')
         logger.info("edit message")
         if thumb is not None:
@@ -187,10 +229,10 @@ async def tl_click_download_handler(event: tl_events.CallbackQuery.Event):
         return
 
     # info_dict = await download(f'https://www.youtube.com/watch?v={inline_result.result_id}', progress_callback=default_progress_callback, complete_callback=default_complete_callback, error_callback=default_error_callback)
-    info_dict = await download(f"https://www.youtube.com/watch?v={result_id}")
+    info_dict = await download_audio(result_id)
     queued.remove(event.sender_id)
 
-    if not info_dict or not os.path.exists(file_path):
+    if not info_dict:
         logger.info(f"info dict: {info_dict}")
         await tl_bot(tl_functions.messages.EditInlineBotMessageRequest(
             id=event.original_update.msg_id,
@@ -198,10 +240,18 @@ async def tl_click_download_handler(event: tl_events.CallbackQuery.Event):
         ))
         return
 
-    input_file = await tl_bot.upload_file(
-        file=file_path,
-        file_name=filename
-    )
+    try:
+        async with UploadSource(await fetch_audio(result_id)) as source:
+            input_file = await upload_file(tl_bot, source, filename)
+    except FileNotFoundError:
+        # evicted between the download and the upload
+        logger.info("File was evicted")
+        await set_downloaded(result_id, 0)
+        await tl_bot(tl_functions.messages.EditInlineBotMessageRequest(
+            id=event.original_update.msg_id,
+            message="Failed to download the audio."
+        ))
+        return
     logger.info(f'{input_file=}')
 
     if thumb is not None:
@@ -242,6 +292,7 @@ async def tl_click_download_handler(event: tl_events.CallbackQuery.Event):
         deleted_files = cleanup_audio_folder()
         if deleted_files:
             logger.info(f"Cleaned up audio folder, deleted {len(deleted_files)} files")
+        await cleanup_storage()
     except Exception as e:
         logger.error(f"Error during audio folder cleanup: {str(e)}")
 
@@ -266,12 +317,36 @@ async def tl_mail_handler(event: tl_events.NewMessage.Event):
 @tl_bot.on(tl_events.NewMessage(pattern="/stats"))
 async def tl_stats_handler(event: tl_events.NewMessage.Event):
     stats = await get_stats(event.sender_id)
-    await event.respond(
-        STATS_TEXT.format(
-            users=stats.users_count,
-            cached=stats.cached_files,
-            sent_user=stats.sent_videos_user,
-            sent_total=stats.sent_videos_total,
-            downloaded=stats.downloaded,
-        )
+    text = STATS_TEXT.format(
+        users=stats.users_count,
+        cached=stats.cached_files,
+        sent_user=stats.sent_videos_user,
+        sent_total=stats.sent_videos_total,
+        downloaded=stats.downloaded,
     )
+    if event.sender_id == ADMIN_ID:
+        text += get_admin_stats_text()
+    await event.respond(text)
+
+
+@tl_bot.on(tl_events.NewMessage(pattern="/profile"))
+async def tl_profile_handler(event: tl_events.NewMessage.Event):
+    if event.sender_id != ADMIN_ID:
+        return
+    if profiler is None:
+        await event.respond(PROFILE_DISABLED_TEXT)
+        return
+    try:
+        kind, seconds = profiler.parse_args(event.raw_text)
+    except ValueError as e:
+        await event.respond(PROFILE_USAGE_TEXT.format(error=str(e)))
+        return
+    if profiler.busy:
+        await event.respond(PROFILE_BUSY_TEXT)
+        return
+
+    await event.respond(PROFILE_STARTED_TEXT.format(kind=kind, seconds=seconds))
+    summary, report = await profiler.run(kind, seconds)
+    document = io.BytesIO(report.encode())
+    document.name = f"profile_{kind}_{int(time.time())}.txt"
+    await event.respond(summary, file=document, force_document=True)
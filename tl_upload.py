@@ -0,0 +1,175 @@
+import asyncio
+import hashlib
+import random
+
+from loguru import logger
+from telethon import TelegramClient, functions as tl_functions, types as tl_types
+from telethon.custom import InputSizedFile
+from telethon.network import MTProtoSender
+
+from config import TL_UPLOAD_CONNECTIONS, TL_UPLOAD_PART_SIZE
+from upload_source import UploadSource
+
+# telegram treats files above this size as big files with a different request
+BIG_FILE_SIZE = 10 * 1024 * 1024
+MAX_PART_SIZE = 512 * 1024
+
+
+class ParallelUploader:
+    """
+    Uploads files to Telegram with several parts in flight at once, each over
+    its own MTProto connection to the home DC. Returns the same input files
+    as TelegramClient.upload_file.
+
+    Args:
+        client: Connected telethon client whose authorization is reused
+        connections: Number of connections sending parts, the client's own included
+        part_size: Bytes per part, a multiple of 1024 of at most 512 KiB
+    """
+
+    def __init__(self, client: TelegramClient, connections: int, part_size: int):
+        if part_size % 1024 or not 0 < part_size <= MAX_PART_SIZE:
+            raise ValueError("The part size must be a multiple of 1024 up to 512 KiB")
+        self.client = client
+        self.connections = connections
+        self.part_size = part_size
+        self._senders: list[MTProtoSender] = []
+        self._lock = asyncio.Lock()
+
+    async def _connect_sender(self, sender: MTProtoSender):
+        client = self.client
+        session = client.session
+        await sender.connect(
+            client._connection(
+                session.server_address,
+                session.port,
+                session.dc_id,
+                loggers=client._log,
+                proxy=client._proxy,
+                local_addr=client._local_addr,
+            )
+        )
+
+    async def _get_senders(self) -> list[MTProtoSender]:
+        # connections are opened on first use and kept for later uploads
+        async with self._lock:
+            while len(self._senders) < self.connections - 1:
+                sender = MTProtoSender(self.client.session.auth_key, loggers=self.client._log)
+                await self._connect_sender(sender)
+                self._senders.append(sender)
+            for sender in self._senders:
+                if not sender.is_connected():
+                    await self._connect_sender(sender)
+            return self._senders
+
+    async def close(self):
+        async with self._lock:
+            for sender in self._senders:
+                await sender.disconnect()
+            self._senders = []
+
+    async def upload(
+        self, source: UploadSource, file_name: str
+    ) -> tl_types.InputFileBig | InputSizedFile:
+        """Upload an opened UploadSource and return the file to attach to a message."""
+        file_size = source.size
+        is_big = file_size > BIG_FILE_SIZE
+        part_count = max(1, (file_size + self.part_size - 1) // self.part_size)
+        file_id = random.randrange(-(2**63), 2**63)
+
+        try:
+            senders = await self._get_senders()
+        except Exception as e:
+            # the client's own connection is enough to upload, just slower
+            logger.warning(f"Failed to open upload connections: {str(e)}")
+            senders = []
+
+        send_functions = [self.client] + [sender.send for sender in senders]
+        # at most one queued part per connection, on top of the ones being sent
+        queue = asyncio.Queue(maxsize=len(send_functions))
+        hash_md5 = hashlib.md5()
+
+        async def send_parts(send):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                part_index, part, held = item
+                try:
+                    if is_big:
+                        request = tl_functions.upload.SaveBigFilePartRequest(
+                            file_id, part_index, part_count, part
+                        )
+                    else:
+                        request = tl_functions.upload.SaveFilePartRequest(
+                            file_id, part_index, part
+                        )
+                    if not await send(request):
+                        raise RuntimeError(f"Failed to upload file part {part_index}")
+                finally:
+                    # the part counts towards UPLOAD_MEMORY_LIMIT until it's sent
+                    await asyncio.shield(source.release(held))
+
+        logger.info(
+            f"Uploading {file_name}: {file_size} bytes in {part_count} parts "
+            f"over {len(send_functions)} connections"
+        )
+        workers = [asyncio.create_task(send_parts(send)) for send in send_functions]
+
+        async def put(item) -> bool:
+            # a failed worker stops taking parts, don't wait on a full queue forever
+            task = asyncio.create_task(queue.put(item))
+            await asyncio.wait([task, *workers], return_when=asyncio.FIRST_COMPLETED)
+            if not task.done():
+                task.cancel()
+                return False
+            return True
+
+        try:
+            for part_index in range(part_count):
+                part, held = await source.read_held(self.part_size)
+                if not is_big:
+                    # parts are read in order, so the md5 is still computed sequentially
+                    hash_md5.update(part)
+                if not await put((part_index, part, held)):
+                    await source.release(held)
+                    break
+            else:
+                for _ in workers:
+                    if not await put(None):
+                        break
+            # raises the error of a failed worker, if any
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            # parts no worker took anymore
+            while not queue.empty():
+                item = queue.get_nowait()
+                if item is not None:
+                    await source.release(item[2])
+
+        if is_big:
+            return tl_types.InputFileBig(file_id, part_count, file_name)
+        return InputSizedFile(file_id, part_count, file_name, md5=hash_md5, size=file_size)
+
+
+uploader: ParallelUploader | None = None
+
+
+def get_uploader(client: TelegramClient) -> ParallelUploader | None:
+    global uploader
+    if uploader is None and TL_UPLOAD_CONNECTIONS > 1:
+        uploader = ParallelUploader(client, TL_UPLOAD_CONNECTIONS, TL_UPLOAD_PART_SIZE)
+    return uploader
+
+
+async def upload_file(client: TelegramClient, source: UploadSource, file_name: str):
+    """Upload a cached file, in parallel unless TL_UPLOAD_CONNECTIONS is 1."""
+    parallel = get_uploader(client)
+    if parallel is None:
+        return await client.upload_file(
+            file=source, file_size=source.size, file_name=file_name
+        )
+    return await parallel.upload(source, file_name)
@@ -0,0 +1,159 @@
+import asyncio
+import mmap
+import os
+from typing import AsyncGenerator
+
+from aiogram import Bot
+from aiogram.types import InputFile
+
+from config import UPLOAD_CHUNK_SIZE, UPLOAD_MEMORY_LIMIT
+
+
+class MemoryBudget:
+    """Caps the bytes held by upload chunks across the whole process."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self, size: int) -> int:
+        size = min(size, self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        return size
+
+    async def release(self, size: int):
+        async with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+class SharedMapping:
+    def __init__(self, path: str, key: tuple):
+        self.key = key
+        self.refs = 0
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            # mmap can't map empty files
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.close()
+
+
+_mappings: dict[tuple, SharedMapping] = {}
+_budget: MemoryBudget | None = None
+
+
+def _get_budget() -> MemoryBudget:
+    # created lazily so the condition belongs to the running loop
+    global _budget
+    if _budget is None:
+        _budget = MemoryBudget(UPLOAD_MEMORY_LIMIT * 1024 * 1024)
+    return _budget
+
+
+class UploadSource:
+    """
+    Read-only stream over a cached file for uploads.
+
+    Concurrent uploads of the same file share one mapping, at most one chunk
+    per reader is held in memory and all chunks count towards the process
+    wide UPLOAD_MEMORY_LIMIT. Usable as a file object for telethon uploads.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = 0
+        self._mapping: SharedMapping | None = None
+        self._position = 0
+        self._held = 0
+
+    async def __aenter__(self):
+        stat = os.stat(self.path)
+        # a file replaced on disk gets a new mapping instead of the stale one
+        key = (os.path.abspath(self.path), stat.st_ino, stat.st_mtime_ns)
+        mapping = _mappings.get(key)
+        if mapping is None:
+            mapping = SharedMapping(self.path, key)
+            _mappings[key] = mapping
+        mapping.refs += 1
+        self._mapping = mapping
+        self.size = mapping.size
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._release_chunk()
+        mapping = self._mapping
+        self._mapping = None
+        mapping.refs -= 1
+        if mapping.refs == 0:
+            _mappings.pop(mapping.key, None)
+            mapping.close()
+
+    async def _release_chunk(self):
+        if self._held:
+            await _get_budget().release(self._held)
+            self._held = 0
+
+    async def read(self, size: int = -1) -> bytes:
+        # the previous chunk has been consumed once the next one is asked for
+        await self._release_chunk()
+        chunk, self._held = await self.read_held(size)
+        return chunk
+
+    async def read_held(self, size: int = -1) -> tuple[bytes, int]:
+        """
+        Read the next chunk and return it with the bytes it holds of the
+        budget. They stay held until they're given back with release(), for
+        callers that keep several chunks in flight.
+        """
+        mapping = self._mapping
+        remaining = self.size - self._position
+        if size < 0 or size > remaining:
+            size = remaining
+        if size <= 0:
+            return b"", 0
+
+        held = await _get_budget().acquire(size)
+        start = self._position
+        chunk = mapping.mmap[start : start + size]
+        self._position += size
+
+        # drop the pages from this process, the page cache still has them
+        if hasattr(mmap, "MADV_DONTNEED"):
+            page_start = start - start % mmap.PAGESIZE
+            mapping.mmap.madvise(mmap.MADV_DONTNEED, page_start, self._position - page_start)
+
+        return chunk, held
+
+    async def release(self, held: int):
+        """Give back the budget of a chunk from read_held()."""
+        if held:
+            await _get_budget().release(held)
+
+    def seekable(self) -> bool:
+        return False
+
+
+class MappedInputFile(InputFile):
+    """aiogram input file that streams through an UploadSource."""
+
+    def __init__(
+        self, path: str, filename: str | None = None, chunk_size: int = UPLOAD_CHUNK_SIZE
+    ):
+        if filename is None:
+            filename = os.path.basename(path)
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.path = path
+        # fail here rather than halfway through building the request
+        self.size = os.path.getsize(path)
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        async with UploadSource(self.path) as source:
+            while chunk := await source.read(self.chunk_size):
+                yield chunk
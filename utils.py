@@ -4,21 +4,28 @@ from loguru import logger
 import io
 from PIL import Image
 import re
+import threading
+from functools import lru_cache
+from config import NORMALIZER_CACHE_SIZE
 from const import REMIX_KEYWORDS
+from paths import thumbnail_path
+from storage import storage, storage_key
 
 
 async def download_and_crop_thumbnail(url: str | None, video_id: str) -> str | None:
     if not url:
         return None
 
-    thumb_dir = "thumbnails"
-    os.makedirs(thumb_dir, exist_ok=True)
-    filename = os.path.join(thumb_dir, f"{video_id}.jpg")
+    filename = thumbnail_path(video_id)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
 
     if os.path.exists(filename):
         return filename
 
     try:
+        if not storage.is_local_cache and await storage.get(storage_key(filename), filename):
+            return filename
+
         async with aiohttp.ClientSession() as session:
             async with session.get(url) as response:
                 if response.status != 200:
@@ -37,48 +44,65 @@ async def download_and_crop_thumbnail(url: str | None, video_id: str) -> str | N
                 cropped = image.crop((left, top, right, bottom))
                 cropped.save(filename, "JPEG", quality=85)
 
-                return filename
     except Exception as e:
         logger.error(f"Thumbnail error: {str(e)}")
         return None
 
+    try:
+        await storage.put(storage_key(filename), filename)
+    except Exception as e:
+        logger.error(f"Failed to store thumbnail of {video_id}: {str(e)}")
+    return filename
+
 
 def safe_filename(title: str, max_length=64) -> str:
     safe = re.sub(r'[\\/*?:"<>|\x00-\x1F]', "", title)
     return safe.strip()
 
 
+def lower_thread_priority(niceness: int):
+    # niceness is per thread on linux and inherited by aria2c/ffmpeg children,
+    # so this is used as an executor initializer for background work
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"Can't lower thread priority: {str(e)}")
+
+
 def hide_link(url: str) -> str:
     return f'<a href="{url}">&#8203;</a>'
 
 
-def extract_performer_title(performer: str, title: str):
-    for kw in REMIX_KEYWORDS:
-        if kw in title.lower():
-            break
-    else:
+# the keywords are found in one pass over the lowercased title
+REMIX_PATTERN = re.compile("|".join(re.escape(kw) for kw in REMIX_KEYWORDS))
+YEAR_SUFFIX_PATTERN = re.compile(r"\s*\(\d{4}\)\s*$")
+COMMA_YEAR_SUFFIX_PATTERN = re.compile(r",\s*\d{4}\s*$")
+
+
+@lru_cache(maxsize=NORMALIZER_CACHE_SIZE)
+def extract_performer_title(performer: str, title: str) -> tuple[str, str]:
+    """Performer and track title for Telegram from a YouTube uploader and title."""
+    # in remixes and covers the uploader is the author, not the original artist
+    if not REMIX_PATTERN.search(title.lower()):
         for sep in (" — ", " - "):
-            # maybe_uploader = title.split(sep, 1)[1]
-            # if ', ' in maybe_uploader or uploader.lower() in maybe_uploader.lower():
-            #     uploader = title.split(sep, 1)[0]
-            #     title = title.split(sep, 1)[1]
-            if sep not in title:
-                continue
-            if performer in title.split(sep, 1)[1]:
+            head, found, tail = title.partition(sep)
+            if not found or performer in tail:
                 continue
-            performer = title.split(sep, 1)[0]
-            title = title.split(sep, 1)[1]
+            performer, title = head, tail
 
-    # chars_to_strip = len(performer) + 3
-    # if title.lower().startswith(f'{performer.lower()} - '):
-    #     title = title[chars_to_strip:]
-    # elif title.lower().endswith(f'{performer.lower()} - '):
-    #     title = title[:len(title) - chars_to_strip]
-
-    title = re.sub(r"\s*\(\d{4}\)\s*$", "", title).strip()
-    title = re.sub(r",\s*\d{4}\s*$", "", title).strip()
+    title = YEAR_SUFFIX_PATTERN.sub("", title).strip()
+    title = COMMA_YEAR_SUFFIX_PATTERN.sub("", title).strip()
 
     if performer.endswith("- Topic"):
         performer = performer.removesuffix(" - Topic")
 
     return performer, title
+
+
+def normalize_results(results: list[dict]) -> list[dict]:
+    """Replace uploader and title of search results in place, returns the list."""
+    for result in results:
+        result["uploader"], result["title"] = extract_performer_title(
+            result["uploader"], result["title"]
+        )
+    return results
@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+from loguru import logger
+
+from config import (
+    WARMUP_TOP_N,
+    WARMUP_RECENT_DAYS,
+    WARMUP_INTERVAL,
+    WARMUP_RATE,
+    WARMUP_NICENESS,
+)
+from database import get_popular_files
+from utils import lower_thread_priority
+from yt_utils import download
+
+_executor = ThreadPoolExecutor(
+    max_workers=1,
+    thread_name_prefix="warmup",
+    initializer=lower_thread_priority,
+    initargs=(WARMUP_NICENESS,),
+)
+
+
+async def warm_up_cache(
+    upload: Callable[[str, dict], Awaitable[str | None]] | None = None,
+    top_n: int = WARMUP_TOP_N,
+) -> int:
+    """
+    Download the most popular recent tracks that are missing from the audio folder,
+    and upload the ones that have no cached Telegram file_id yet.
+
+    Args:
+        upload: Coroutine that uploads a cached track and stores its file_id,
+            None if the frontend can't reuse uploaded files
+        top_n: How many of the most used tracks to keep warm
+
+    Returns:
+        Number of tracks that were downloaded or uploaded
+    """
+    files = await get_popular_files(top_n, WARMUP_RECENT_DAYS)
+    delay = 60 / WARMUP_RATE if WARMUP_RATE > 0 else 0
+    warmed = 0
+
+    for file in files:
+        video_id = file["video_id"]
+        needs_upload = upload is not None and not file["file_id"]
+
+        # downloaded flags are kept in sync with the disk by the reconciler
+        if file["downloaded"] and not needs_upload:
+            continue
+
+        try:
+            if not file["downloaded"]:
+                result = await download(
+                    f"https://www.youtube.com/watch?v={video_id}",
+                    executor=_executor,
+                    background=True,
+                )
+                if not result:
+                    continue
+
+            if needs_upload:
+                await upload(video_id, file)
+
+            warmed += 1
+            logger.info(f"Warmed up {video_id} (uses: {file['uses_count']})")
+        except Exception as e:
+            logger.error(f"Failed to warm up {video_id}: {str(e)}")
+
+        await asyncio.sleep(delay)
+
+    logger.info(f"Cache warm-up done, {warmed} of {len(files)} popular tracks warmed")
+    return warmed
+
+
+async def run_warmup_loop(
+    upload: Callable[[str, dict], Awaitable[str | None]] | None = None,
+):
+    """Warm the cache at startup and then every WARMUP_INTERVAL seconds."""
+    while True:
+        try:
+            await warm_up_cache(upload)
+        except Exception as e:
+            logger.error(f"Error during cache warm-up: {str(e)}")
+        await asyncio.sleep(WARMUP_INTERVAL)
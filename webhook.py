@@ -0,0 +1,164 @@
+import asyncio
+import hmac
+import multiprocessing
+import secrets
+
+from aiogram import Bot, Dispatcher
+from aiohttp import web
+from loguru import logger
+
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_CONCURRENCY,
+    WEBHOOK_WORKERS,
+)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookReceiver:
+    """
+    Accepts updates posted by Telegram and hands them to a fixed number of
+    handler tasks through a bounded queue. Telegram gets its answer as soon
+    as the update is queued; when the queue is full it gets a 503 and sends
+    the update again later.
+
+    Args:
+        bot: Bot the updates are processed with
+        dispatcher: Dispatcher with the handlers registered
+        secret: Expected secret token header, empty to accept any request
+        queue_size: Updates waiting for a handler before new ones are refused
+        concurrency: Updates handled at once in this process
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dispatcher: Dispatcher,
+        secret: str,
+        queue_size: int,
+        concurrency: int,
+    ):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.secret = secret
+        self.concurrency = concurrency
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.refused = 0
+        self._handler_tasks = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret
+        ):
+            return web.Response(status=401)
+
+        try:
+            update = await request.json(loads=self.bot.session.json_loads)
+        except ValueError:
+            return web.Response(status=400)
+
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.refused += 1
+            logger.warning(f"Update queue is full, refused update {update.get('update_id')}")
+            return web.Response(status=503)
+        return web.json_response({})
+
+    async def _handle_updates(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dispatcher.feed_raw_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Error handling update {update.get('update_id')}: {str(e)}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self, app: web.Application):
+        self._handler_tasks = [
+            asyncio.create_task(self._handle_updates()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self, app: web.Application):
+        for task in self._handler_tasks:
+            task.cancel()
+        await asyncio.gather(*self._handler_tasks, return_exceptions=True)
+
+    def register(self, app: web.Application, path: str):
+        app.router.add_post(path, self.handle)
+        app.on_startup.append(self.start)
+        app.on_shutdown.append(self.stop)
+
+
+async def serve(bot: Bot, dispatcher: Dispatcher, secret: str):
+    """Serve the webhook in this process until cancelled."""
+    receiver = WebhookReceiver(
+        bot, dispatcher, secret, WEBHOOK_QUEUE_SIZE, WEBHOOK_CONCURRENCY
+    )
+    app = web.Application()
+    receiver.register(app, WEBHOOK_PATH)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # every worker process binds the same port, the kernel spreads connections
+    site = web.TCPSite(
+        runner, WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=WEBHOOK_WORKERS > 1
+    )
+    await site.start()
+    logger.info(f"Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
+
+
+async def _serve_worker(secret: str):
+    from aiogram_client import aiogram_bot, aiogram_dp
+    import aiogram_handlers  # noqa: F401  registers the handlers
+
+    await serve(aiogram_bot, aiogram_dp, secret)
+
+
+def _worker_process(secret: str):
+    asyncio.run(_serve_worker(secret))
+
+
+async def run_webhook(bot: Bot, dispatcher: Dispatcher):
+    """
+    Register the webhook with Telegram and serve it from this process and
+    WEBHOOK_WORKERS - 1 more. Workers share the database and the audio
+    folder, background loops only run in this process.
+    """
+    # the endpoint is public, without a secret anyone could post updates.
+    # The webhook is registered again on every start, so a new one is fine
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    if not WEBHOOK_SECRET:
+        logger.info("WEBHOOK_SECRET is not set, using a random one for this run")
+    await bot.set_webhook(
+        url=WEBHOOK_URL + WEBHOOK_PATH,
+        secret_token=secret,
+        allowed_updates=dispatcher.resolve_used_update_types(),
+    )
+
+    # spawned rather than forked, so no event loop or connection is inherited
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_worker_process, args=(secret,), name=f"webhook-{i}", daemon=True)
+        for i in range(1, WEBHOOK_WORKERS)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        await serve(bot, dispatcher, secret)
+    finally:
+        for process in processes:
+            process.terminate()
@@ -1,15 +1,103 @@
 from loguru import logger
 import yt_dlp
-from config import SEARCH_LIMIT, LENGTH_LIMIT
-from const import REMIX_KEYWORDS
-from database import set_downloaded, add_file
+from aria2_rpc import Aria2YoutubeDL, aria2_daemon
+from config import (
+    SEARCH_LIMIT,
+    LENGTH_LIMIT,
+    SEARCH_CACHE_TTL,
+    SEARCH_CACHE_SIZE,
+    CATALOGUE_RESULTS,
+    RESUME_URL_MARGIN,
+)
+from const import SEARCH_MAX_RESULTS
+from database import set_downloaded, add_file, search_catalogue
+from negative_cache import (
+    filter_known_bad,
+    is_empty_search,
+    known_failure,
+    remember_empty_search,
+    remember_failure,
+)
+from paths import audio_path, published_video_id
+from postprocess import postprocess_pool
+from storage import storage, storage_key
+from utils import normalize_results
+import asyncio
+import json
 import os
-from typing import Callable
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Generator, Iterator
+from urllib.parse import parse_qs, urlparse
 import time
-import re
 
 
-async def search(query: str) -> list:
+@dataclass
+class SearchCursor:
+    query: str
+    results: list = field(default_factory=list)
+    seen: set = field(default_factory=set)
+    # raw entries of the YouTube search, pages are requested as they're consumed
+    entries: Generator | None = None
+    fetched: int = 0
+    exhausted: bool = False
+    seeded: bool = False
+    created_at: float = field(default_factory=time.monotonic)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+_search_cursors: OrderedDict[str, SearchCursor] = OrderedDict()
+# the loop only keeps weak references to tasks, these would be collected unfinished
+_closing_tasks: set[asyncio.Task] = set()
+
+
+def _get_search_cursor(query: str) -> SearchCursor:
+    key = query.strip().lower()
+    cursor = _search_cursors.get(key)
+    if cursor is not None and time.monotonic() - cursor.created_at > SEARCH_CACHE_TTL:
+        del _search_cursors[key]
+        _close_cursor(cursor)
+        cursor = None
+
+    if cursor is None:
+        cursor = SearchCursor(query=query)
+        _search_cursors[key] = cursor
+        while len(_search_cursors) > SEARCH_CACHE_SIZE:
+            _close_cursor(_search_cursors.popitem(last=False)[1])
+    else:
+        _search_cursors.move_to_end(key)
+
+    return cursor
+
+
+def _close_cursor(cursor: SearchCursor):
+    """Stop the cursor's search, which closes its YoutubeDL."""
+    if cursor.entries is None:
+        return
+    if cursor.lock.locked():
+        # the entries may be consumed in a worker thread right now
+        task = asyncio.create_task(_close_cursor_when_idle(cursor))
+        _closing_tasks.add(task)
+        task.add_done_callback(_closing_tasks.discard)
+        return
+    cursor.entries.close()
+
+
+async def _close_cursor_when_idle(cursor: SearchCursor):
+    async with cursor.lock:
+        cursor.entries.close()
+
+
+def _search_entries(query: str) -> Generator[dict, None, None] | None:
+    """
+    Raw entries of a YouTube search. Nothing is requested until the first
+    entry is taken, then one result page at a time as the entries are
+    consumed, so a search that's abandoned early costs fewer requests.
+    The YoutubeDL is closed once the entries run out, fail or are closed.
+    None if the search failed.
+    """
     ydl_opts = {
         "extract_flat": True,
         "force_generic_extractor": True,
@@ -19,82 +107,142 @@ async def search(query: str) -> list:
         # 'cookiefile': os.getenv('COOKIEFILE')
     }
 
-    search_results = []
-
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        search_query = f"ytsearch{SEARCH_LIMIT * 2}:{query}"
-        result = ydl.extract_info(search_query, download=False)
+    ydl = yt_dlp.YoutubeDL(ydl_opts)
+    search_query = f"ytsearch{SEARCH_MAX_RESULTS}:{query}"
+    try:
+        result = ydl.extract_info(search_query, download=False, process=False)
+    except BaseException:
+        ydl.close()
+        raise
+    if not result:
+        # errors are ignored, so a failed search comes back as nothing
+        logger.info(f"Search for {query} failed")
+        ydl.close()
+        return None
+    if "entries" not in result:
+        logger.info(f"No results for {query} #1")
+        result["entries"] = ()
+    return _closing_entries(ydl, result["entries"])
 
-        logger.info(result)
 
-        if not result or "entries" not in result:
-            logger.info(f"No results for {query} #1")
-            return []
+def _closing_entries(ydl: yt_dlp.YoutubeDL, entries: Iterator[dict]) -> Generator[dict, None, None]:
+    # the entries need the YoutubeDL, it's closed with them
+    try:
+        yield from entries
+    finally:
+        ydl.close()
+
+
+def _take_entries(entries: Generator[dict, None, None], count: int, seen: set) -> tuple[list, int, bool, bool]:
+    """
+    Consume entries until count of them can be sent: short enough and not
+    in seen. Returns them, how many entries were consumed, whether the
+    search ran out and whether it ran out because a page failed.
+    """
+    taken = []
+    consumed = 0
+    try:
+        for entry in entries:
+            consumed += 1
+            if not entry:
+                continue
+            if (entry.get("duration") or 0) > LENGTH_LIMIT * 60:
+                logger.info("Skip result #1")
+                continue
+            if entry.get("id") in seen:
+                continue
+            taken.append(entry)
+            if len(taken) >= count:
+                return taken, consumed, False, False
+    except Exception as e:
+        # what was found so far is still served, the search isn't continued
+        logger.error(f"Search page failed: {str(e)}")
+        return taken, consumed, True, True
+    return taken, consumed, True, False
+
+
+def _shape_entry(entry: dict) -> dict:
+    thumbnails = entry.get("thumbnails", [])
+    thumbnail = next(
+        (t["url"] for t in reversed(thumbnails) if t.get("url")),
+        "https://i.ytimg.com/vi/{}/hqdefault.jpg".format(entry.get("id", "")),
+    )
+
+    if not thumbnail.startswith(("https://", "http://")):
+        if thumbnail.startswith("//"):
+            thumbnail = f"https:{thumbnail}"
+        else:
+            thumbnail = f"https://{thumbnail}"
+
+    # uploader and title are raw, see utils.normalize_results
+    return {
+        "title": entry.get("title", "Без названия"),
+        "duration": (entry.get("duration", 0)) or 0,
+        "thumbnail": thumbnail,
+        "uploader": entry.get("uploader", "Неизвестный автор"),
+        "url": entry.get("url", ""),
+        "view_count": entry.get("view_count", 0),
+        "id": entry.get("id", ""),
+    }
 
-        for entry in result["entries"]:
-            if entry and len(search_results) < SEARCH_LIMIT:
-                thumbnails = entry.get("thumbnails", [])
-                thumbnail = next(
-                    (t["url"] for t in reversed(thumbnails) if t.get("url")),
-                    "https://i.ytimg.com/vi/{}/hqdefault.jpg".format(
-                        entry.get("id", "")
-                    ),
-                )
 
-                if not (
-                    thumbnail.startswith("https://" or thumbnail.startswith("http://"))
+async def search_page(
+    query: str, offset: int = 0, limit: int = SEARCH_LIMIT
+) -> tuple[list, str]:
+    """
+    Return one page of results for an inline query and the next offset.
+
+    Raw entries are consumed lazily and only until the page can be filled,
+    the search is kept per query and continued for later pages, so YouTube
+    is asked for as few result pages as possible. Shaped results are kept
+    per query too. An empty next offset means there is nothing more to
+    scroll to.
+    """
+    limit = min(limit, SEARCH_MAX_RESULTS - offset)
+    if limit <= 0:
+        return [], ""
+
+    cursor = _get_search_cursor(query)
+
+    async with cursor.lock:
+        if not cursor.seeded:
+            cursor.seeded = True
+            if await is_empty_search(query):
+                # found nothing not long ago, the cursor answers until it expires
+                cursor.exhausted = True
+            elif CATALOGUE_RESULTS > 0:
+                # tracks we already know go first; with enough of them the first
+                # page is answered without asking YouTube at all
+                for video_data in await filter_known_bad(
+                    await search_catalogue(query, CATALOGUE_RESULTS, LENGTH_LIMIT * 60)
                 ):
-                    if thumbnail.startswith("//"):
-                        thumbnail = f"https:{thumbnail}"
-                    else:
-                        thumbnail = f"https://{thumbnail}"
-
-                video_data = {
-                    "title": entry.get("title", "Без названия"),
-                    "duration": (entry.get("duration", 0)) or 0,
-                    "thumbnail": thumbnail,
-                    "uploader": entry.get("uploader", "Неизвестный автор"),
-                    "url": entry.get("url", ""),
-                    "view_count": entry.get("view_count", 0),
-                    "id": entry.get("id", ""),
-                }
-
-                uploader = video_data["uploader"]
-                title = video_data["title"]
-
-                for kw in REMIX_KEYWORDS:
-                    if kw in title.lower():
-                        break
-                else:
-                    for sep in (" — ", " - "):
-                        # maybe_uploader = title.split(sep, 1)[1]
-                        # if ', ' in maybe_uploader or uploader.lower() in maybe_uploader.lower():
-                        #     uploader = title.split(sep, 1)[0]
-                        #     title = title.split(sep, 1)[1]
-                        if sep not in title:
-                            continue
-                        if uploader in title.split(sep, 1)[1]:
-                            continue
-                        uploader = title.split(sep, 1)[0]
-                        title = title.split(sep, 1)[1]
-
-                # chars_to_strip = len(uploader) + 3
-                # if title.lower().startswith(f'{uploader.lower()} - '):
-                #     title = title[chars_to_strip:]
-                # elif title.lower().endswith(f'{uploader.lower()} - '):
-                #     title = title[:len(title) - chars_to_strip]
-
-                title = re.sub(r"\s*\(\d{4}\)\s*$", "", title).strip()
-                title = re.sub(r",\s*\d{4}\s*$", "", title).strip()
-
-                if uploader.endswith("- Topic"):
-                    uploader = uploader.removesuffix(" - Topic")
-
-                video_data["title"] = title
-                video_data["uploader"] = uploader
-
-                if video_data["duration"] > LENGTH_LIMIT * 60:
-                    logger.info("Skip result #1")
+                    cursor.seen.add(video_data["id"])
+                    cursor.results.append(video_data)
+
+        while len(cursor.results) < offset + limit and not cursor.exhausted:
+            if cursor.entries is None:
+                cursor.entries = await asyncio.to_thread(_search_entries, query)
+                if cursor.entries is None:
+                    cursor.exhausted = True
+                    break
+            entries, consumed, cursor.exhausted, failed = await asyncio.to_thread(
+                _take_entries,
+                cursor.entries,
+                offset + limit - len(cursor.results),
+                cursor.seen,
+            )
+            if cursor.fetched == 0 and consumed == 0 and not failed and not cursor.results:
+                await remember_empty_search(query)
+            cursor.fetched += consumed
+            if cursor.fetched >= SEARCH_MAX_RESULTS:
+                cursor.exhausted = True
+            if cursor.exhausted:
+                # nothing more will be taken, the YoutubeDL is released now
+                cursor.entries.close()
+
+            shaped = normalize_results([_shape_entry(entry) for entry in entries])
+            for video_data in await filter_known_bad(shaped):
+                if video_data["id"] in cursor.seen:
                     continue
                 await add_file(
                     video_data["id"],
@@ -103,11 +251,46 @@ async def search(query: str) -> list:
                     video_data["thumbnail"],
                     video_data["duration"],
                 )
-                search_results.append(video_data)
+                cursor.seen.add(video_data["id"])
+                cursor.results.append(video_data)
+
+        page = cursor.results[offset : offset + limit]
+        has_more = len(cursor.results) > offset + limit or not cursor.exhausted
 
-        logger.info(search_results)
+    logger.info(page)
 
-        return search_results
+    next_offset = str(offset + len(page)) if page and has_more else ""
+    return page, next_offset
+
+
+def cached_search_page(
+    query: str, offset: int = 0, limit: int = SEARCH_LIMIT, allow_stale: bool = False
+) -> tuple[list, str] | None:
+    """
+    Page of already fetched results, None if answering would need an extraction.
+    With allow_stale, expired and incomplete pages are returned too, without
+    a next offset.
+    """
+    cursor = _search_cursors.get(query.strip().lower())
+    if cursor is None or not cursor.seeded:
+        return None
+
+    limit = min(limit, SEARCH_MAX_RESULTS - offset)
+    page = cursor.results[offset : offset + limit]
+    fresh = time.monotonic() - cursor.created_at <= SEARCH_CACHE_TTL
+    complete = len(page) == limit or cursor.exhausted
+
+    if fresh and complete:
+        has_more = len(cursor.results) > offset + limit or not cursor.exhausted
+        return page, str(offset + len(page)) if page and has_more else ""
+    if allow_stale and page:
+        return page, ""
+    return None
+
+
+async def search(query: str) -> list:
+    results, _ = await search_page(query)
+    return results
 
 
 def default_progress_callback(current, total, speed):
@@ -122,45 +305,56 @@ def default_error_callback(error, url):
     logger.info(f"Error: {repr(error)} for {url}")
 
 
-async def download(
+def _video_id_from_url(url: str) -> str | None:
+    return parse_qs(urlparse(url).query).get("v", [None])[0]
+
+
+def _load_resume_info(video_id: str) -> tuple[dict | None, str | None]:
+    """
+    Info json left by an interrupted download of the video. Returns the info if
+    its media URL is still valid, and the format id the partial data belongs to.
+    """
+    info_path = audio_path(video_id, "info.json")
+    try:
+        with open(info_path) as f:
+            info = json.load(f)
+    except OSError:
+        return None, None
+    except ValueError:
+        info = None
+    if not isinstance(info, dict):
+        # unreadable, a fresh extraction will write a new one
+        os.remove(info_path)
+        return None, None
+
+    expire = parse_qs(urlparse(info.get("url", "")).query).get("expire", ["0"])[0]
+    if expire.isdigit() and int(expire) > time.time() + RESUME_URL_MARGIN:
+        return info, info.get("format_id")
+
+    # a fresh extraction will write a new one
+    os.remove(info_path)
+    return None, info.get("format_id")
+
+
+def _download_sync(
     url: str,
-    progress_callback: Callable = default_progress_callback,
-    complete_callback: Callable = default_complete_callback,
-    error_callback: Callable = default_error_callback,
+    progress_callback: Callable,
+    complete_callback: Callable,
+    error_callback: Callable,
 ):
-    output_dir = "audio"
-    os.makedirs(output_dir, exist_ok=True)
-
+    # network stage only, ffmpeg runs afterwards in the post-processing pool
     ydl_opts = {
         "format": "bestaudio/best",
         "external_downloader": "aria2c",
         "nocheckcertificate": True,
-        "postprocessors": [
-            {
-                "key": "FFmpegExtractAudio",
-                "preferredcodec": "mp3",
-                "preferredquality": "320",
-            },
-            {"key": "EmbedThumbnail", "already_have_thumbnail": False},
-            {
-                "key": "FFmpegMetadata",
-                "add_metadata": True,
-            },
-        ],
-        "postprocessor_args": {
-            "embedthumbnail+ffmpeg_o": [
-                "-c:v",
-                "png",
-                "-vf",
-                "crop='if(gt(ih,iw),iw,ih)':'if(gt(iw,ih),ih,iw)'",
-                "-preset",
-                "veryfast",
-            ]
-        },
-        "outtmpl": os.path.join(output_dir, "%(id)s.%(ext)s"),
-        "embedthumbnail": True,
+        # the shard directory is only known once the video id is, see paths below.
+        # Temporary names include the format, so partial data is only ever
+        # resumed with the same format; the info json is kept until the
+        # download is published and lets a retry skip extraction
+        "outtmpl": {"default": "%(id)s.f%(format_id)s.%(ext)s", "infojson": "%(id)s"},
         "writethumbnail": True,
-        "keepvideo": False,
+        "writeinfojson": True,
+        "continuedl": True,
         "quiet": True,
         "http_chunk_size": 2621440,
         "noprogress": True,
@@ -171,10 +365,9 @@ async def download(
     }
 
     last_progress_time = 0
-    final_filename = None
 
     def progress_hook(d):
-        nonlocal last_progress_time, final_filename
+        nonlocal last_progress_time
         if d["status"] == "downloading":
             current_time = time.time()
             if current_time - last_progress_time >= 1:
@@ -185,17 +378,30 @@ async def download(
                     speed = d.get("speed", 0)
                     progress_callback(current, total, speed)
 
-        elif d["status"] == "finished":
-            video_id = d["info_dict"].get("id", "unknown")
-            final_filename = os.path.join(output_dir, f"{video_id}.mp3")
-
     ydl_opts["progress_hooks"].append(progress_hook)
 
+    resume_info, resume_format = None, None
+    video_id = _video_id_from_url(url)
+    if video_id and not os.path.exists(audio_path(video_id)):
+        resume_info, resume_format = _load_resume_info(video_id)
+    if resume_format:
+        ydl_opts["format"] = f"{resume_format}/{ydl_opts['format']}"
+
+    ydl_class = yt_dlp.YoutubeDL
+    if aria2_daemon is not None and aria2_daemon.available:
+        # the media itself goes to the shared daemon, see aria2_rpc
+        del ydl_opts["external_downloader"]
+        ydl_class = partial(Aria2YoutubeDL, daemon=aria2_daemon)
+
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict: dict = ydl.extract_info(url, download=False)
+        with ydl_class(ydl_opts) as ydl:
+            if resume_info:
+                logger.info(f"Resuming download of {video_id}")
+                info_dict = resume_info
+            else:
+                info_dict: dict = ydl.extract_info(url, download=False)
             video_id = info_dict.get("id", "unknown")
-            predicted_filename = os.path.join(output_dir, f"{video_id}.mp3")
+            predicted_filename = audio_path(video_id)
 
             if os.path.exists(predicted_filename):
                 logger.info(f"Файл уже существует: {predicted_filename}")
@@ -203,13 +409,13 @@ async def download(
                     complete_callback(predicted_filename)
                 return predicted_filename
 
-            ydl.download([url])
-
-            if complete_callback and final_filename:
-                complete_callback(final_filename)
+            output_dir = os.path.dirname(predicted_filename)
+            os.makedirs(output_dir, exist_ok=True)
+            ydl.params["paths"] = {"home": output_dir}
+            info_dict = ydl.process_ie_result(info_dict, download=True)
 
-            await set_downloaded(video_id)
-            return info_dict
+            # info of the downloaded format, with the paths of the audio and thumbnail
+            return info_dict["requested_downloads"][-1]
 
     except Exception as e:
         if error_callback:
@@ -217,3 +423,86 @@ async def download(
         else:
             logger.error(f"Ошибка при обработке {url}: {str(e)}")
         return None
+
+
+async def download(
+    url: str,
+    progress_callback: Callable = default_progress_callback,
+    complete_callback: Callable = default_complete_callback,
+    error_callback: Callable = default_error_callback,
+    executor: Executor | None = None,
+    background: bool = False,
+):
+    # another node may have published the track to the shared storage already
+    video_id = _video_id_from_url(url)
+    if video_id and not storage.is_local_cache:
+        file_path = audio_path(video_id)
+        try:
+            if not os.path.exists(file_path) and await storage.get(storage_key(file_path), file_path):
+                await set_downloaded(video_id)
+                return file_path
+        except Exception as e:
+            logger.error(f"Failed to fetch {video_id} from storage: {str(e)}")
+
+    if video_id and not os.path.exists(audio_path(video_id)):
+        reason = await known_failure(video_id)
+        if reason:
+            logger.info(f"Not downloading {video_id}, it failed recently ({reason})")
+            return None
+
+    if aria2_daemon is not None and not await aria2_daemon.start():
+        logger.warning("aria2 RPC unavailable, downloading with an aria2c per track")
+
+    errors = []
+
+    def record_error(error, url):
+        errors.append(error)
+        if error_callback:
+            error_callback(error, url)
+        else:
+            logger.error(f"Ошибка при обработке {url}: {str(error)}")
+
+    # yt-dlp and ffmpeg are blocking, so they run off the event loop;
+    # callbacks are invoked from the worker thread
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        executor,
+        _download_sync,
+        url,
+        progress_callback,
+        complete_callback,
+        record_error,
+    )
+    if result is None and errors and video_id:
+        await remember_failure(video_id, errors[-1])
+
+    if isinstance(result, dict):
+        try:
+            result = await postprocess_pool.run(result, background=background)
+        except Exception as e:
+            if error_callback:
+                error_callback(e, url)
+            return None
+
+        video_id = result.get("id", "unknown")
+        final_filename = audio_path(video_id)
+        os.replace(result["filepath"], final_filename)
+        result["filepath"] = final_filename
+        try:
+            os.remove(audio_path(video_id, "info.json"))
+        except FileNotFoundError:
+            pass
+
+        try:
+            await storage.put(storage_key(final_filename), final_filename)
+        except Exception as e:
+            logger.error(f"Failed to store {video_id}: {str(e)}")
+
+        if complete_callback:
+            complete_callback(final_filename)
+        await set_downloaded(video_id)
+    elif isinstance(result, str):
+        # already published, possibly by another process
+        await set_downloaded(published_video_id(os.path.basename(result)))
+
+    return result